@@ -0,0 +1,122 @@
+'''
+auth_benchmark.py
+
+Measures what checking a token costs per request in each token mode (see
+config.token_format): JWTs with the decoded token cache turned off, JWTs
+with the cache and opaque tokens. Users are registered into an empty
+in-memory store (nothing is saved), then worker threads validate randomly
+chosen tokens as fast as they can, like requests arriving under load.
+
+Then it measures how many logins a second the same threads get through with
+passwords hashed on the request threads and in the password workers (see
+passwords.py). Run it from the top of the repository:
+
+    python3 -m benchmarks.auth_benchmark [users] [requests] [threads]
+'''
+
+from src.auth import auth_register_v1, auth_login_v1
+from src.other import check_valid_token, clear_v1
+from src import config
+from src import passwords
+from src.data_store import data_store
+
+import random
+import sys
+import threading
+import time
+
+MODES = [
+    ('jwt, no cache', 'jwt', 0),
+    ('jwt, cached', 'jwt', config.jwt_cache_size),
+    ('opaque', 'opaque', config.jwt_cache_size),
+]
+
+# Logins timed in each password hashing mode
+LOGINS = 50
+
+def register_users(count):
+    # Register count users, returns their tokens. Their passwords are hashed
+    # cheaply, since that isn't what's being measured.
+    password_kdf = config.password_kdf
+    password_workers = config.password_workers
+    iterations = config.pbkdf2_iterations
+    try:
+        config.password_kdf = 'pbkdf2_sha256'
+        config.password_workers = 0
+        config.pbkdf2_iterations = 1
+        tokens = []
+        for number in range(count):
+            user = auth_register_v1(f'user{number}@example.com', 'password', 'Bench', f'User{number}')
+            tokens.append(user['token'])
+        return tokens
+    finally:
+        config.password_kdf = password_kdf
+        config.password_workers = password_workers
+        config.pbkdf2_iterations = iterations
+
+def run_threads(action, requests, threads):
+    # Call action(rng) requests times spread over threads, where rng is the
+    # thread's random.Random, returns the number of calls made and the
+    # seconds they took
+    def worker(count, seed):
+        rng = random.Random(seed)
+        for _ in range(count):
+            action(rng)
+
+    workers = [
+        threading.Thread(target=worker, args=(requests // threads, seed))
+        for seed in range(threads)
+    ]
+    start = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return requests // threads * threads, time.perf_counter() - start
+
+def run(users, requests, threads):
+    token_format = config.token_format
+    jwt_cache_size = config.jwt_cache_size
+    password_workers = config.password_workers
+    try:
+        print(f'{users} users, {requests} requests on {threads} threads')
+        for name, mode_token_format, mode_jwt_cache_size in MODES:
+            config.token_format = mode_token_format
+            config.jwt_cache_size = mode_jwt_cache_size
+            clear_v1()
+            tokens = register_users(users)
+            checked, seconds = run_threads(
+                lambda rng: check_valid_token(rng.choice(tokens)), requests, threads
+            )
+            print(f'{name:>15}: {seconds / checked * 1e6:8.2f} us per request, '
+                  f'{checked / seconds:10.0f} requests/s')
+
+        # Give every user a password hashed with the real settings
+        password_hash = passwords.hash_password('password')
+        for user in data_store.get()['users']:
+            user['password'] = password_hash
+        print(f'{LOGINS} logins with {config.password_kdf} on {threads} threads')
+        for name, mode_password_workers in (('request threads', 0), ('workers', password_workers)):
+            config.password_workers = mode_password_workers
+            passwords.start()
+            logged_in, seconds = run_threads(
+                lambda rng: auth_login_v1(f'user{rng.randrange(users)}@example.com', 'password'),
+                LOGINS, threads
+            )
+            print(f'{name:>15}: {logged_in / seconds:8.2f} logins/s')
+    finally:
+        config.token_format = token_format
+        config.jwt_cache_size = jwt_cache_size
+        config.password_workers = password_workers
+        passwords.shutdown()
+        clear_v1()
+
+if __name__ == '__main__':
+    try:
+        arguments = [int(argument) for argument in sys.argv[1:]]
+    except ValueError:
+        arguments = None
+    if arguments is None or len(arguments) > 3:
+        print('Usage: python3 -m benchmarks.auth_benchmark [users] [requests] [threads]')
+        sys.exit(1)
+    run(*(arguments + [1000, 200000, 8][len(arguments):]))
@@ -1,5 +1,9 @@
 from src.data_store import data_store
-from src.other import check_valid_token, decode_jwt
+from src.other import check_valid_token, decode_jwt, get_user, check_is_member, check_is_dm_member
+from src.other import forget_user_tokens, count_live_sessions, jwt_cache_stats
+from src.mailer import MAIL_STATS
+from src.persistence import SNAPSHOT_STATS
+from src.scheduler import scheduler_stats
 from src.error import InputError, AccessError
 
 def count_global_owners():
@@ -35,11 +39,7 @@ def admin_userpermission_change_v1(token, u_id, permission_id):
     input_id = permission_id
     # Check if u_id is valid
     store = data_store.get()
-    valid_user = False
-    for user in store['users']:
-        if user['u_id'] == u_id:
-            valid_user = True
-            break
+    valid_user = get_user(u_id) is not None
     if valid_user == False:
         raise InputError(description="Invalid user id")
     
@@ -52,13 +52,8 @@ def admin_userpermission_change_v1(token, u_id, permission_id):
     num_global_owners = count_global_owners()
     
     # Searches and fetches the user by their u_id
-    target_user = {}
-    auth_user = {}
-    for user in store['users']:
-        if user['u_id'] == u_id:
-            target_user = user
-        if user['u_id'] == decode['u_id']:
-            auth_user = user
+    target_user = get_user(u_id)
+    auth_user = get_user(decode['u_id'])
                 
     # If the auth_user is not a global_owner
     if auth_user['global_owner'] == False:
@@ -69,6 +64,7 @@ def admin_userpermission_change_v1(token, u_id, permission_id):
         target_user['global_owner'] = True
         target_user['global_member'] = False
         data_store.set(store)    
+        data_store.touch('users', u_id)
         
     if input_id == 2:
         # If the only global user tries to demote themselves raise error
@@ -80,6 +76,7 @@ def admin_userpermission_change_v1(token, u_id, permission_id):
         target_user['global_owner'] = False
         target_user['global_member'] = True
         data_store.set(store)
+        data_store.touch('users', u_id)
 
     return {
     }    
@@ -105,24 +102,15 @@ def admin_user_remove_v1(token, u_id):
     
     # Check if u_id is valid
     store = data_store.get()
-    valid_user = False
-    for user in store['users']:
-        if user['u_id'] == u_id:
-            valid_user = True
-            break
+    valid_user = get_user(u_id) is not None
     if valid_user == False:
         raise InputError(description="Invalid user id")
     
     num_global_owners = count_global_owners()
     
     # Searches and fetches the user and the autherised user
-    target_user = {}
-    auth_user = {}
-    for user in store['users']:
-        if user['u_id'] == u_id:
-            target_user = user
-        if user['u_id'] == decode['u_id']:
-            auth_user = user
+    target_user = get_user(u_id)
+    auth_user = get_user(decode['u_id'])
     
     
     if auth_user['global_owner'] == False:
@@ -134,33 +122,41 @@ def admin_user_remove_v1(token, u_id):
         else:
             # Remove the user from all channels
             for channel in store['channels']:
-                if target_user in channel['all_members']:
-                    channel['all_members'].remove(target_user)
-                if target_user in channel['owner_members']:
-                    channel['owner_members'].remove(target_user)
+                if check_is_member(target_user['u_id'], channel['channel_id']):
+                    data_store.remove_member('channels', channel['channel_id'], target_user['u_id'])
+                    data_store.touch('channels', channel['channel_id'])
+                if target_user['u_id'] in channel['owner_members']:
+                    channel['owner_members'].remove(target_user['u_id'])
                 # Remove the message sent by that user in the channels
                 for message in channel['messages']:
                     if message['u_id'] == target_user['u_id']:
                         message['u_id'] = "Removed user"
+                        data_store.touch('messages', message['message_id'], ('channels', channel['channel_id']))
             # Remove the user from all dms
             for dm in store['dms']:
-                if target_user == dm['owner']:
-                    dm['owner'] == ""
-                if target_user in dm['members']:
-                    dm['members'].remove(target_user)
+                if target_user['u_id'] == dm['owner']:
+                    dm['owner'] = None
+                if check_is_dm_member(target_user['u_id'], dm['dm_id']):
+                    data_store.remove_member('dms', dm['dm_id'], target_user['u_id'])
+                    data_store.touch('dms', dm['dm_id'])
                 # Remove the message sent by that user in the dms
                 for message in dm['messages']:
                     if message['u_id'] == target_user['u_id']:
                         message['u_id'] = "Removed user"
                         message['message'] = "Removed user"
+                        data_store.touch('messages', message['message_id'], ('dms', dm['dm_id']))
              
             # After removing them from channels and dms
             # change their name to Removed User and remove their 
             # email and handle so it can be still reuseable
             target_user['name_first'] = "Removed"
             target_user['name_last'] = "user"
-            target_user['email'] = ""
-            target_user['handle_str'] = ""
+            data_store.set_user_key(target_user, 'email', "")
+            data_store.set_user_key(target_user, 'handle_str', "")
+            # and log them out everywhere
+            data_store.end_sessions(target_user)
+            forget_user_tokens(u_id)
+            data_store.touch('users', u_id)
             
     data_store.set(store)
 
@@ -169,3 +165,33 @@ def admin_user_remove_v1(token, u_id):
             
             
     
+
+def admin_metrics_v1(token):
+    '''
+    If the token is a global owner, return figures about the running server:
+    the number of sessions logged in and the counters kept for the token
+    cache, outgoing email, snapshots and scheduled calls
+    
+    Arguments:
+        - token (string)
+        
+    Exceptions:
+        AccessError:
+            - token is not a global owner
+            
+    Return value:
+        {live_sessions, jwt_cache, mail, snapshots, scheduler}
+    '''
+    decode = check_valid_token(token)
+    
+    auth_user = get_user(decode['u_id'])
+    if auth_user['global_owner'] == False:
+        raise AccessError(description="You do not have permission to perform this action")
+    
+    return {
+        'live_sessions': count_live_sessions(),
+        'jwt_cache': jwt_cache_stats(),
+        'mail': dict(MAIL_STATS),
+        'snapshots': dict(SNAPSHOT_STATS),
+        'scheduler': scheduler_stats(),
+    }
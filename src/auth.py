@@ -1,14 +1,15 @@
 from src.data_store import data_store
 from src.error import InputError
-from src.other import hashing, generate_session_id, create_jwt, decode_jwt, check_valid_token, reaction_current_user
+from src.other import generate_session_id, create_token, check_valid_token, get_user
+from src.other import forget_token, forget_user_tokens
+from src.passwords import hash_password, check_password
+from src.mailer import send_email
 from src import config
 
 from datetime import datetime, timezone
 
-import hashlib
-import jwt
 import random
-import smtplib
+import threading
 
 from os import path
 import sys
@@ -19,6 +20,9 @@ import re
 SECRET = 'F13BCAMEL'
 BASE_URL = config.url
 
+# Held while a new user is checked, given a u_id and added to the store
+REGISTER_LOCK = threading.Lock()
+
 def auth_login_v1(email, password):
 
     '''
@@ -42,10 +46,9 @@ def auth_login_v1(email, password):
     valid_password = False
     
     # Check if email is registered
-    for user in store['users']:
-        if user['email'] == email:
-            valid_email = True
-            break
+    user = data_store.lookup_user('email', email)
+    if user is not None:
+        valid_email = True
     
     # If email is not registered, raise InputError
     if valid_email == False:
@@ -53,8 +56,7 @@ def auth_login_v1(email, password):
     
     # Check if password is correct
     else:
-        if user['password'] == hashing(password):
-            valid_password = True
+        valid_password, new_hash = check_password(password, user['password'])
     
     # If password is incorrect
     if valid_password == False:
@@ -63,12 +65,16 @@ def auth_login_v1(email, password):
     # If the user is registered (valid email and password), get their auth_user_id
     user_id = user['u_id']
     
+    # Replace a hash made with old settings now that we know the password
+    if new_hash is not None:
+        user['password'] = new_hash
+    
     session_id = generate_session_id()
-    user['session_id'].append(session_id)
-    token = create_jwt(user_id, session_id)
+    data_store.add_session(user, session_id)
+    token = create_token(user, session_id)
     
     data_store.set(store)
-    reaction_current_user(user_id)
+    data_store.touch('users', user_id)
     return {
         'auth_user_id': user_id,
         'token': token,
@@ -101,9 +107,6 @@ def auth_register_v1(email, password, name_first, name_last):
     session_list = [] 
     user_dict = {}
     
-    # Create a new id for the user
-    new_id = len(store['users']) + 1
-    
     # A valid email should match this expression
     valid = r'^[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}$'
     
@@ -113,9 +116,8 @@ def auth_register_v1(email, password, name_first, name_last):
     
     # If the email is valid, check that it is not already taken    
     else: 
-        for user in store['users']:
-            if user['email'] == email:
-                raise InputError(description="Email already in use")
+        if data_store.lookup_user('email', email) is not None:
+            raise InputError(description="Email already in use")
                 
         # If the email is not taken, add the email to the data store
         user_dict['email'] = email 
@@ -123,9 +125,6 @@ def auth_register_v1(email, password, name_first, name_last):
     # Check valid password
     if len(password) < 6:
         raise InputError(description="Invalid password, must be longer than 6 characters")
-        
-    else:
-        user_dict['password'] = hashing(password)
     
     # Check valid first name
     if len(name_first) < 1 or len(name_first) > 50:
@@ -141,78 +140,88 @@ def auth_register_v1(email, password, name_first, name_last):
     else:
         user_dict['name_last'] = name_last   
     
-    # Generate the handle 
-    # Make first name and last name lowercase, and combine them
-    new_string = name_first.lower() + name_last.lower()
+    # Hashing takes a while and the store can change in the meantime, so it is
+    # done before the store is read
+    user_dict['password'] = hash_password(password)
+    
+    # Everything from here to the insert is done under REGISTER_LOCK, so two
+    # users registering at once never get the same email or u_id
+    with REGISTER_LOCK:
+        # The email may have been taken while the password was hashed
+        if data_store.lookup_user('email', email) is not None:
+            raise InputError(description="Email already in use")
+    
+        # Create a new id for the user
+        new_id = len(store['users']) + 1
+    
+        # Generate the handle 
+        # Make first name and last name lowercase, and combine them
+        new_string = name_first.lower() + name_last.lower()
     
-    # Remove non-alphanumeric characters
-    handle = re.sub(r'[^a-zA-Z0-9]', '', new_string)
+        # Remove non-alphanumeric characters
+        handle = re.sub(r'[^a-zA-Z0-9]', '', new_string)
     
-    # If the handle is longer than 20 characters, cut it off at 20 characters
-    handle = handle[:20]
+        # If the handle is longer than 20 characters, cut it off at 20 characters
+        handle = handle[:20]
     
-    # If the handle is already taken, append the smallest number
-    # (starting from 0) to form a new handle that isn't already taken
-    counter = 0
-    handle_len = len(handle)
-    for user in store['users']:
-        while handle in user['handle_str']:
-            handle = handle[:handle_len] + str(counter)
-            counter += 1
+        # If the handle is already taken, append the smallest number
+        # (starting from 0) to form a new handle that isn't already taken
+        handle = data_store.next_handle(handle)
                        
-    user_dict['handle_str'] = handle
-    user_dict['u_id'] = new_id
+        user_dict['handle_str'] = handle
+        user_dict['u_id'] = new_id
     
-    if new_id == 1:
-        user_dict['global_owner'] = True
-        user_dict['global_member'] = False
+        if new_id == 1:
+            user_dict['global_owner'] = True
+            user_dict['global_member'] = False
         
-        # If the user is the first user registered, initialise the workplace_stats
-        workspace_stats = {}
+            # If the user is the first user registered, initialise the workplace_stats
+            workspace_stats = {}
 
-        timestamp = int(datetime.now(timezone.utc).timestamp())
+            timestamp = int(datetime.now(timezone.utc).timestamp())
         
-        workspace_stats['channels_exist'] = [{'num_channels_exist': 0, 'time_stamp': timestamp}]
-        workspace_stats['dms_exist'] = [{'num_dms_exist': 0, 'time_stamp': timestamp}]
-        workspace_stats['messages_exist'] = [{'num_messages_exist': 0, 'time_stamp': timestamp}]
-        workspace_stats['utilization_rate'] = 0
+            workspace_stats['channels_exist'] = [{'num_channels_exist': 0, 'time_stamp': timestamp}]
+            workspace_stats['dms_exist'] = [{'num_dms_exist': 0, 'time_stamp': timestamp}]
+            workspace_stats['messages_exist'] = [{'num_messages_exist': 0, 'time_stamp': timestamp}]
+            workspace_stats['utilization_rate'] = 0
         
-        store['stats'].append(workspace_stats)
+            store['stats'].append(workspace_stats)
+            data_store.touch('stats')
         
-    else:
-        user_dict['global_owner'] = False
-        user_dict['global_member'] = True
-    
-    # Create a new token using JWTs
-    session_id = generate_session_id()
-    session_list.append(session_id)
-    user_dict['session_id'] = session_list
-    token = create_jwt(new_id, session_id)
-    
-    # Set default profile image
-    default_image = f'{BASE_URL}static/default.jpg'
+        else:
+            user_dict['global_owner'] = False
+            user_dict['global_member'] = True
+    
+        # Create a new token for the user's first session
+        session_id = generate_session_id()
+        session_list.append(session_id)
+        user_dict['session_id'] = session_list
+        token = create_token(user_dict, session_id)
+    
+        # Set default profile image
+        default_image = f'{BASE_URL}static/default.jpg'
         
-    user_dict['profile_img_url'] = default_image
+        user_dict['profile_img_url'] = default_image
 
-    # Create user stats dictionary and add to user data
-    user_stats = {}
+        # Create user stats dictionary and add to user data
+        user_stats = {}
     
-    timestamp = int(datetime.now(timezone.utc).timestamp())
+        timestamp = int(datetime.now(timezone.utc).timestamp())
 
-    user_stats['channels_joined'] = [{'num_channels_joined': 0, 'time_stamp': timestamp}]
-    user_stats['dms_joined'] = [{'num_dms_joined': 0, 'time_stamp': timestamp}]
-    user_stats['messages_sent'] = [{'num_messages_sent': 0, 'time_stamp': timestamp}]
-    user_stats['involvement_rate'] = 0
+        user_stats['channels_joined'] = [{'num_channels_joined': 0, 'time_stamp': timestamp}]
+        user_stats['dms_joined'] = [{'num_dms_joined': 0, 'time_stamp': timestamp}]
+        user_stats['messages_sent'] = [{'num_messages_sent': 0, 'time_stamp': timestamp}]
+        user_stats['involvement_rate'] = 0
     
-    user_dict['user_stats'] = user_stats
+        user_dict['user_stats'] = user_stats
     
-    # Create empty notifications for user
-    user_dict['notifications'] = []
+        # Create empty notifications for user
+        user_dict['notifications'] = []
     
-    # Append the user's data to the data store
-    store['users'].append(user_dict)
-    data_store.set(store)
-    reaction_current_user(new_id)
+        # Append the user's data to the data store
+        data_store.insert('users', user_dict)
+        data_store.set(store)
+        data_store.touch('users', new_id)
     return {
         'auth_user_id': new_id,
         'token': token,
@@ -243,11 +252,11 @@ def auth_logout_v1(token):
     user_session_id =  decoded_token['session_id']
     
     # Invalidate the token to log the user out
-    for user in store['users']:
-        if user['u_id'] == user_id and user_session_id in user['session_id']:
-            user['session_id'].remove(user_session_id)
+    data_store.remove_session(get_user(user_id), user_session_id)
+    forget_token(token)
     
     data_store.set(store)
+    data_store.touch('users', user_id)
     
     return {
     }
@@ -262,60 +271,46 @@ def auth_passwordreset_request_v1(email):
     data = data_store.get()
     
     valid_email = False
-    for user in data['users']:
-        if user['email'] == email:
-            valid_email = True
-            user_id = user['u_id']
-            break
+    user = data_store.lookup_user('email', email)
+    if user is not None:
+        valid_email = True
+        user_id = user['u_id']
             
     if valid_email == False:
         return {
         }       
     
      
-    # Generate the 10 character secret code email with English alphabet ASCII
-    secret_code = ''
-    i = 0
-    while i <= 10:
-        
-        # get integer value for uper and lowercase letters
-        random_int = random.randint(97, 97 + 26 - 1)
-        flip_case = random.randint(0,1)
-        
-        # if flip_case is 1, flip to lowercase
-        if flip_case == 1:
-            random_int = random_int - 32
-            
-        # append to string
-        secret_code += (chr(random_int))
-        i += 1
+    timestamp = int(datetime.now(timezone.utc).timestamp())
+    expire_reset_codes(timestamp)
+    
+    # Generate a secret code that isn't already in use
+    secret_code = generate_reset_code()
+    while data_store.lookup_code(secret_code) is not None:
+        secret_code = generate_reset_code()
+    
+    # Only the newest few codes sent to an email are kept
+    while len(data_store.codes_for(email)) >= max(1, config.reset_codes_per_email):
+        data_store.remove_code(data_store.codes_for(email)[0])
          
     # Store the secret code in data_store
     code_dict = {}
     code_dict['reset_code'] = secret_code
     code_dict['email'] = email
-    data['codes'].append(code_dict)
+    code_dict['time_created'] = timestamp
+    data_store.add_code(code_dict)
+    data_store.touch('codes')
     
       
-    # Send the email
-    gmail_user = 'comp1531camel@gmail.com'
-    gmail_app_password = 'detail_digestion'
-    sent_from = gmail_user
-    sent_to = email
-    sent_body = secret_code
-
-    
-       
-    server = smtplib.SMTP_SSL('smtp.gmail.com', 465)
-    server.ehlo()
-    server.login(gmail_user, gmail_app_password)
-    server.sendmail(sent_from, sent_to, sent_body)
-    server.close()
+    # Queue the email, it's sent in the background
+    send_email(email, secret_code)
          
     
     # Log the user out
-    data['users'][user_id - 1]['session_id'].clear()   
+    data_store.end_sessions(get_user(user_id))
+    forget_user_tokens(user_id)
     data_store.set(data)
+    data_store.touch('users', user_id)
     
     
     return {
@@ -329,25 +324,62 @@ def auth_passwordreset_reset_v1(reset_code, new_password):
     # Check if reset_code is valid
     data = data_store.get() 
     
-    valid_code = False 
-    code_email = ''  
-    for code in data['codes']:
-        if code['reset_code'] == reset_code:
-            valid_code = True
-            code_email = code['email']
-            
-    if valid_code == False:
+    timestamp = int(datetime.now(timezone.utc).timestamp())
+    if expire_reset_codes(timestamp):
+        data_store.touch('codes')
+    
+    if data_store.lookup_code(reset_code) is None:
         raise InputError(description="Invalid reset code")
     
+    password_hash = hash_password(new_password)
+    
+    # Each code can only be used once, and another request could have used
+    # it while the password was hashed
+    code = data_store.lookup_code(reset_code)
+    if code is None:
+        raise InputError(description="Invalid reset code")
+    data_store.remove_code(code)
+    data_store.touch('codes')
+    code_email = code['email']
+    
     # Get user info
-    for user in data['users']:
-        if code_email == user['email']:
-            user['password'] = hashing(new_password)
+    user = data_store.lookup_user('email', code_email)
+    if user is not None:
+        user['password'] = password_hash
+        data_store.touch('users', user['u_id'])
     
     data_store.set(data)    
     
     return {
-    } 
-    
-    
+    }
+
+def generate_reset_code():
+    # Generate the 11 character secret code with English alphabet ASCII
+    secret_code = ''
+    i = 0
+    while i <= 10:
+        
+        # get integer value for uper and lowercase letters
+        random_int = random.randint(97, 97 + 26 - 1)
+        flip_case = random.randint(0,1)
+        
+        # if flip_case is 1, flip to lowercase
+        if flip_case == 1:
+            random_int = random_int - 32
+            
+        # append to string
+        secret_code += (chr(random_int))
+        i += 1
     
+    return secret_code
+
+def expire_reset_codes(timestamp):
+    # Remove the reset codes older than config.reset_code_ttl. Codes are kept
+    # oldest first, so the expired ones are all at the front. Returns whether
+    # any were removed.
+    codes = data_store.get()['codes']
+    expired = False
+    while codes and codes[0]['time_created'] + config.reset_code_ttl <= timestamp:
+        data_store.remove_code(codes[0])
+        expired = True
+    return expired
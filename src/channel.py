@@ -4,6 +4,7 @@ from src.other import check_valid_token
 from src.stats import increase_num_channels_joined, decrease_num_channels_joined
 from src.other import hashing, generate_session_id, create_jwt, decode_jwt, check_global_owner 
 from src.other import check_is_member, check_is_member_token, check_valid_id, check_valid_channel_id, check_get_channel
+from src.other import get_user, get_channel, user_details, message_view, newest_first, messages_from_cursor
 from src.notifications import update_notification_added_channel
 
 import hashlib
@@ -31,50 +32,32 @@ def channel_invite_v1(token, channel_id, u_id):
     '''
 
     # Check if user exists
-    check_valid_token(token)
-    get_channel = data_store.get()
-    decode = decode_jwt(token)
-
-    valid_user = False
-    for user in get_channel['users']:
-        if u_id == user['u_id']:
-            valid_user = True
-            break    
+    decode = check_valid_token(token)
+    store = data_store.get()
+
+    valid_user = check_valid_id(u_id)
     if valid_user == False:
         raise InputError("Invalid User Id")
     
     # Check if channel ID is valid
-    valid_channel = False
-    for channel in get_channel['channels']:
-        if channel['channel_id'] == channel_id:
-            valid_channel = True
-            break
+    channel = get_channel(channel_id)
+    valid_channel = channel is not None
     if valid_channel == False:
         raise InputError(description = "Channel id does not exist")
 
     # Check if user is already in the channel
-    for member in channel['all_members']:
-        if member['u_id'] == u_id:
-            raise InputError(description = "User already a member of channel")
+    if check_is_member(u_id, channel['channel_id']):
+        raise InputError(description = "User already a member of channel")
 
     # Check if user has access to the channel
-    user_access = False
-    for channel in get_channel['channels']:
-        for member in channel['all_members']:
-            if member['u_id'] == decode['u_id']:
-                user_access = True
-                break
+    user_access = check_is_member(decode['u_id'], channel_id)
     if user_access == False and valid_channel == True:
             raise AccessError(description = "User does not have access to the channel")
 
-    # getting the user details (newly added)
-    for user in get_channel['users']:
-        if user['u_id'] == u_id:
-            user_details = user 
-
     # Adding user to channel
-    get_channel['channels'][channel_id - 1]['all_members'].append(user_details)
-    data_store.set(get_channel)
+    data_store.add_member('channels', channel_id, u_id)
+    data_store.set(store)
+    data_store.touch('channels', channel_id)
     
     increase_num_channels_joined(u_id)
     
@@ -105,31 +88,20 @@ def channel_details_v1(token, channel_id):
         }
     
     '''
-    get_channel = data_store.get()
     decode = check_valid_token(token)
 
     # Check if valid channel_id exists
-    valid_channel = False
-    for channel in get_channel['channels']:
-        if channel_id == channel['channel_id']:
-            valid_channel = True
-            break
+    channel = get_channel(channel_id)
+    valid_channel = channel is not None
 
     if valid_channel == False:
         raise InputError(description="Channel id does not exist")
         
     # Gets the details of the channel
-    channel_data = {}
-    for channel in get_channel['channels']:
-        if channel_id == channel['channel_id']:
-            channel_data = channel
+    channel_data = channel
             
     # Check if user is part of that channel
-    valid_user = False
-    
-    for users in channel['all_members']:
-        if users['u_id'] == decode['u_id']:
-            valid_user = True
+    valid_user = check_is_member(decode['u_id'], channel['channel_id'])
 
     if valid_user == False:
         raise AccessError(description="User not authorised access to channel")
@@ -138,70 +110,74 @@ def channel_details_v1(token, channel_id):
     return {
             'name': channel_data['name'],
             'is_public': channel_data['is_public'],
-            'owner_members': channel_data['owner_members'],
-            'all_members' : channel_data['all_members'],
+            'owner_members': [user_details(u_id) for u_id in channel_data['owner_members']],
+            'all_members' : [user_details(u_id) for u_id in channel_data['all_members']],
     }
 
 
-def channel_messages_v1(token, channel_id, start):
+def channel_messages_v1(token, channel_id, start, before_message_id=None, after_message_id=None):
     '''
-    Given a user's token, valid channel id and start, returns a list of up to 50 messages
+    Given a user's token, valid channel id and start, returns a list of up to 50 messages.
+    Given before_message_id or after_message_id instead of start, returns up to 50
+    messages older or newer than that message, and the cursor for the next page.
 
     Arguments:
         - token,
         - channel_id,
-        - start
+        - start,
+        - before_message_id (optional),
+        - after_message_id (optional)
 
     Exceptions:
         InputError - channel_id is invalid
         InputError - start > number of messages in channel
+        InputError - both before_message_id and after_message_id are given
+        InputError - the cursor is not a message in the channel
         AccessError - channel_id is valid but authorised user is not a member
 
     Return value:
-        { messages, start, end}
+        { messages, start, end }
+        { messages, before_message_id } when before_message_id is given
+        { messages, after_message_id } when after_message_id is given
     '''
 
-    store = data_store.get()
     decode = check_valid_token(token)
 
     # Check if channel ID is valid
-    valid_channel = False
-    for channel in store['channels']:
-        if channel['channel_id'] == channel_id:
-            valid_channel = True
-            break
+    channel = get_channel(channel_id)
+    valid_channel = channel is not None
             
     if valid_channel == False:
         raise InputError(description = "Channel id does not exist")
 
     # Check if user has access to the channel
-    user_access = False
-    for member in channel['all_members']:
-        if member['u_id'] == decode['u_id']:
-            user_access = True
-            break
+    user_access = check_is_member(decode['u_id'], channel['channel_id'])
             
     if user_access == False and valid_channel == True:
             raise AccessError(description = "User does not have access to the channel")
 
+    # Page from a cursor
+    if before_message_id is not None or after_message_id is not None:
+        page, next_cursor = messages_from_cursor(
+            'channels', channel, before_message_id, after_message_id, 50
+        )
+        return {
+            'messages': [message_view(message, decode['u_id']) for message in page],
+            'before_message_id' if before_message_id is not None else 'after_message_id': next_cursor
+        }
+
     # Check if number of messages is valid      
     if start > len(channel['messages']):
         raise InputError(description = "Start is greater than total number of messages in channel")
 
     # Function implementation
-    messages = []
-    end = 0
-    
-    for message in channel['messages']:
-        if end < start:
-            end += 1
-        elif end == start + 50: 
-            break
-        else:
-            messages.append(message)
-            end += 1
+    messages = [
+        message_view(message, decode['u_id'])
+        for message in newest_first(channel['messages'], start, 50)
+    ]
     
-    if end == len(channel['messages']):
+    end = start + 50
+    if end >= len(channel['messages']):
         end = -1
     
     return {
@@ -216,34 +192,28 @@ def channel_join_v1(token, channel_id):
     # Check if user exists
     decode = check_valid_token(token)
    
-    get_channel = data_store.get()
+    store = data_store.get()
       
     # Check if valid channel_id exists
-    valid_channel = False
-    for channel in get_channel['channels']:
-        if channel['channel_id'] == channel_id:
-            valid_channel = True
-            break
+    channel = get_channel(channel_id)
+    valid_channel = channel is not None
 
     if valid_channel == False:
         raise InputError(description="Channel id does not exist")
       
     # Check if user is part of that channel
-    for member in channel['all_members']:
-        if member['u_id'] == decode['u_id']:
-            raise InputError(description="User already a member of channel")
+    if check_is_member(decode['u_id'], channel['channel_id']):
+        raise InputError(description="User already a member of channel")
                     
     # Get user details
-    for user in get_channel['users']:
-        if user['u_id'] == decode['u_id']:
-            user_details = user    
-                    
+    user = get_user(decode['u_id'])
     
-    if channel['is_public'] == False and user_details['global_owner'] == False:
+    if channel['is_public'] == False and user['global_owner'] == False:
         raise AccessError(description="Channel is private")
 
-    get_channel['channels'][channel_id - 1]['all_members'].append(user_details)
-    data_store.set(get_channel)
+    data_store.add_member('channels', channel_id, decode['u_id'])
+    data_store.set(store)
+    data_store.touch('channels', channel_id)
        
     increase_num_channels_joined(decode['u_id'])    
    
@@ -255,48 +225,32 @@ def channel_leave_v1(token, channel_id):
     # Check if user exists
     decode = check_valid_token(token)
        
-    get_channel = data_store.get()
+    store = data_store.get()
     
     # Check if valid channel_id exists
-    valid_channel = False
-    for channel in get_channel['channels']:
-        if channel['channel_id'] == channel_id:
-            valid_channel = True
-            break
+    channel = get_channel(channel_id)
+    valid_channel = channel is not None
 
     if valid_channel == False:
         raise InputError(description="Channel id does not exist") 
   
       
     # Check if user is part of that channel
-    is_member = False
-    for member in channel['all_members']:
-        if member['u_id'] == decode['u_id']:
-            is_member = True
-            break
+    is_member = check_is_member(decode['u_id'], channel['channel_id'])
             
     if is_member == False:        
         raise AccessError(description="User is not a member of the channel")
     
-    owner_member = False
-    
     # Check if user is a owner
-    owner_member = False
-    for member in channel['owner_members']:
-        if member['u_id'] == decode['u_id']:
-            owner_member = True
-    
-    # Get user details
-    for user in get_channel['users']:
-        if user['u_id'] == decode['u_id']:
-            user_details = user  
+    owner_member = decode['u_id'] in channel['owner_members']
     
     if owner_member == True:
-        get_channel['channels'][channel_id - 1]['owner_members'].remove(user_details)
+        channel['owner_members'].remove(decode['u_id'])
     
-    get_channel['channels'][channel_id - 1]['all_members'].remove(user_details)
+    data_store.remove_member('channels', channel_id, decode['u_id'])
     
-    data_store.set(get_channel)
+    data_store.set(store)
+    data_store.touch('channels', channel_id)
     
     decrease_num_channels_joined(decode['u_id'])
     
@@ -304,8 +258,6 @@ def channel_leave_v1(token, channel_id):
     }
 
 def channel_addowner_v1(token, channel_id, u_id):
-    get_channel = data_store.get()
-    
     # check valid token
     decode = check_valid_token(token)
     
@@ -330,38 +282,28 @@ def channel_addowner_v1(token, channel_id, u_id):
         raise AccessError(description="User does not have owner permissions")
     
     # Check if u_id is already an owner
-    owner_member = False
     channel = check_get_channel(channel_id)
-    for member in channel['owner_members']:
-        if member['u_id'] == u_id:
-            owner_member = True  
+    owner_member = u_id in channel['owner_members']
             
     if owner_member == True:        
         raise InputError(description="User is already a owner")       
                    
     # Check if token has owner permissions
     owner_member = check_global_owner(token)
-    for member in channel['owner_members']:
-        if member['u_id'] == decode['u_id']:
-            owner_member = True
+    if decode['u_id'] in channel['owner_members']:
+        owner_member = True
     
     if owner_member == False:
         raise AccessError(description="User does not have owner permissions")
     
     # add u_id as owner   
-    for user in get_channel['users']:
-        if user['u_id'] == u_id:
-            user_details = user
-             
-     
-    get_channel['channels'][channel_id - 1]['owner_members'].append(user_details)  
+    channel['owner_members'].append(u_id)  
+    data_store.touch('channels', channel_id)
     
     return {
     }
     
 def channel_removeowner_v1(token, channel_id, u_id):
-    get_channel = data_store.get()
-    
     # check valid token
     decode = check_valid_token(token)
     
@@ -392,19 +334,15 @@ def channel_removeowner_v1(token, channel_id, u_id):
         
     # Check if token has owner permissions
     owner_member = check_global_owner(token)
-    for member in channel['owner_members']:
-        if member['u_id'] == decode['u_id']:
-            owner_member = True
+    if decode['u_id'] in channel['owner_members']:
+        owner_member = True
     
     if owner_member == False:
         raise AccessError(description="User does not have owner permissions")
     
-    # add u_id as owner   
-    for user in get_channel['users']:
-        if user['u_id'] == u_id:
-            user_details = user  
-     
-    get_channel['channels'][channel_id - 1]['owner_members'].remove(user_details)  
+    # remove u_id as owner   
+    channel['owner_members'].remove(u_id)  
+    data_store.touch('channels', channel_id)
     
     return {
     }      
@@ -1,6 +1,6 @@
 from src.data_store import data_store
 from src.error import InputError, AccessError
-from src.other import check_valid_token
+from src.other import check_valid_token, joined_channels
 from src.stats import increase_num_channels_joined, increase_channels_exist
 
 def channels_list_v1(token):
@@ -19,19 +19,15 @@ def channels_list_v1(token):
         }
     
     '''
-    data = data_store.get()
-    
     decode = check_valid_token(token)
     user_channels = []
-    for channel in data['channels']:
-        # If the user is in that channel, then create a dictionary
+    for channel in joined_channels(decode['u_id']):
+        # For each channel the user is in, create a dictionary
         # with data channel_id and name and append it to the list
-        for member in channel['all_members']:
-            channel_info = {}
-            if decode['u_id'] == member['u_id']:
-                channel_info['channel_id'] = channel['channel_id']
-                channel_info['name'] = channel['name']
-                user_channels.append(channel_info)
+        channel_info = {}
+        channel_info['channel_id'] = channel['channel_id']
+        channel_info['name'] = channel['name']
+        user_channels.append(channel_info)
             
     return {    
             'channels' : user_channels
@@ -84,22 +80,19 @@ def channels_create_v1(token, name, is_public):
     if len(name) < 1 or len(name) > 20:
         raise InputError("Invalid name, must be between 1 to 20 characters")
         
-    # Fetches the data of the user making the channel
-    for user in store['users']:
-        if user['u_id'] == decode['u_id']:
-            user_details = user
-            
-        
+    # Members are stored by u_id, the user making the channel is the first owner
     channel_dict['channel_id'] = new_id    
     channel_dict['is_public'] = is_public
-    channel_dict['owner_members'] = [user_details]
+    channel_dict['owner_members'] = [decode['u_id']]
     channel_dict['name'] = name
-    channel_dict['all_members'] = [user_details]
+    channel_dict['all_members'] = [decode['u_id']]
     channel_dict['messages'] = []
     channel_dict['standup'] = {}
+    channel_dict['scheduled'] = []
     
-    store['channels'].append(channel_dict)
+    data_store.insert('channels', channel_dict)
     data_store.set(store)
+    data_store.touch('channels', new_id)
     
     increase_num_channels_joined(decode['u_id'])
     
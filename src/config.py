@@ -1,3 +1,105 @@
 port = 8080
 
-url = f"http://localhost:{port}/"
\ No newline at end of file
+url = f"http://localhost:{port}/"
+
+# Passwords
+# How passwords are hashed (see passwords.py): 'scrypt' or 'pbkdf2_sha256',
+# and how costly each is. Raising the cost only affects new hashes; existing
+# ones are upgraded when their users next log in.
+password_kdf = 'scrypt'
+scrypt_n = 2 ** 14
+scrypt_r = 8
+scrypt_p = 1
+pbkdf2_iterations = 600000
+
+# How many processes hash passwords, None for one per core. 0 hashes them on
+# the request threads instead, as does any platform without fork.
+password_workers = None
+
+# Password reset codes last reset_code_ttl seconds and can only be used once.
+# An email has at most reset_codes_per_email codes at a time; asking for
+# another replaces the oldest.
+reset_code_ttl = 15 * 60
+reset_codes_per_email = 3
+
+# Standups
+# The most bytes of messages a standup buffers for its packaged message. Once
+# it's full, standup/send is refused until the standup ends.
+standup_buffer_bytes = 64 * 1024
+
+# Email
+# How email is sent (see mailer.py): 'smtp' through smtp_host, or 'file' to
+# append each message to mail_file instead
+mail_transport = 'smtp'
+mail_sender = 'comp1531camel@gmail.com'
+mail_file = 'outbox.jsonl'
+
+smtp_host = 'smtp.gmail.com'
+smtp_port = 465
+smtp_ssl = True
+smtp_user = 'comp1531camel@gmail.com'
+smtp_password = 'detail_digestion'
+# Seconds to wait for the server to respond, and how long the connection is
+# kept open with nothing to send
+smtp_timeout = 10
+smtp_idle_timeout = 30
+
+# Messages sent over the connection in one go, and how often a message that
+# fails is retried. The wait before each retry starts at mail_retry_delay
+# seconds and doubles every time.
+mail_batch_size = 20
+mail_retries = 5
+mail_retry_delay = 1
+
+# Persistence
+# Where the data store is saved: 'wal' keeps a JSON snapshot plus a log of
+# changes since it was taken, 'sqlite' keeps it in an SQLite database and
+# 'sharded' keeps a file per channel and dm in shard_dir
+storage_engine = 'wal'
+sqlite_file = 'data_store.db'
+shard_dir = 'data_store'
+
+# The snapshot of the whole data store, and the write-ahead log of every
+# change made since that snapshot was taken
+snapshot_file = 'data_store.json'
+wal_file = 'data_store.wal'
+
+# 'json' or 'binary'. Binary snapshots (see snapshot_format.py) are smaller
+# and load much faster at startup
+snapshot_format = 'json'
+binary_snapshot_file = 'data_store.snap'
+
+# How long the flusher waits after the first change before committing, so a
+# burst of writes is appended together. This is the most that can be lost if
+# the server is killed.
+flush_delay = 0.1
+
+# Once the log grows past this many bytes a new snapshot is taken and the log
+# is truncated
+wal_snapshot_bytes = 8 * 1024 * 1024
+
+# How snapshots are written. 'fork' serialises a copy-on-write image of the
+# store in a child process so requests aren't held up; 'inline' writes it from
+# the server process (and is used wherever fork isn't available)
+snapshot_mode = 'fork'
+
+# How many message or session ids are reserved in the store's counters at a
+# time. Larger blocks mean the counters are saved less often; ids left over in
+# a block when the server stops are never used.
+id_block = 100
+
+# The tokens handed out by login and register. 'jwt' tokens are signed and
+# verified on every request; 'opaque' tokens are random strings of
+# opaque_token_bytes that are checked with a single lookup. Tokens of either
+# kind keep working after this is changed.
+token_format = 'jwt'
+opaque_token_bytes = 32
+
+# How many decoded tokens are cached (see other.decode_jwt()). 0 turns the
+# cache off. Every live session's token fits with the default unless there
+# are a lot of users logged in at once.
+jwt_cache_size = 4096
+
+# fsync the log after every commit (slower, but survives power loss as well as
+# the server crashing)
+wal_fsync = False
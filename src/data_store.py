@@ -24,6 +24,13 @@ Example usage:
     data_store.set(store)
 '''
 
+import json
+import threading
+
+# The layout of the store, kept in its counters. Before version 2 channels
+# and dms kept their messages newest first, now they are oldest first.
+SCHEMA_VERSION = 2
+
 ## YOU SHOULD MODIFY THIS OBJECT BELOW
 initial_object = {
     'users': [
@@ -40,7 +47,13 @@ initial_object = {
     ],
     'codes': [
     
-    ]
+    ],
+    'counters': {
+        'message_id': 0,
+        'session_id': 0,
+        'dm_id': 0,
+        'schema_version': SCHEMA_VERSION
+    }
 }
 
 '''
@@ -53,6 +66,7 @@ initial_object = {
             'name_last': "Smith",
             'handle_str': "johnsmith"
             'session_id': []
+            'tokens': {}      (opaque token -> session_id, see config.token_format)
             'global_owner': True (if first user registered)
             'global_member': False (if first user registered)
             'profile_img_url': 'img_url'
@@ -76,43 +90,62 @@ initial_object = {
             'channel_id': 1,
             'name': "New Channel",
             'is_public': True,
-            'owner_members': [users[0]],                        # [user, user, ...]
-            'all_members': [users[0], users[1], users[2]],      # [user, user, ...], user[0] is explained below
-            'messages': [
+            'owner_members': [1],                               # [u_id, u_id, ...]
+            'all_members': [1, 2, 3],                           # [u_id, u_id, ...]
+            'messages': [                                       # oldest first
                             {
                                 'message_id': 1,
                                 'u_id': 1,
                                 'message': "Hi",
                                 'time_created': 1
-                                'react': [{'react_id': 1, 'u_ids' : [], 'is_this_user_reacted': False}, ...]
+                                'reacts': [{'react_id': 1, 'u_ids' : []}, ...]   # see other.message_view()
                                 'is_pinned': False
                             }
                         ]
             'standup':  {
                             'time_finish': 1,
-                            'messages': []
+                            'deadline': 1.5,            # when it ends, time_finish rounded down
+                            'u_id': 1,                  # who started it, None if unknown
+                            'messages': [{'u_id': 1, 'handle_str': "johnsmith", 'message': "Hi"}],
+                            'bytes': 14                 # of the packaged message so far
                         }
+            'scheduled': [                                      # see messages.schedule_message()
+                            {
+                                'message_id': 2,                # reserved when it was scheduled
+                                'u_id': 1,
+                                'message': "Later",
+                                'time_sent': 2
+                            }
+                        ]
         }
     ],
     'dms': [
         {
             'dm_id': 1,
             'name': "ahandle1, bhandle2, chandle3",
-            'owner': users[0],
-            'members': [users[0], users[1], users[2]],       # [user, user, ...]
-            'messages': [
+            'owner': 1,                                      # u_id, None once they leave
+            'members': [1, 2, 3],                            # [u_id, u_id, ...]
+            'messages': [                                       # oldest first
                             {
                                 'message_id': 1,
                                 'u_id': 1,
                                 'message': "Hi",
                                 'time_created': 1
-                                'react': [{'react_id': 1, 'u_ids' : [], 'is_this_user_reacted': False}, ...]
+                                'reacts': [{'react_id': 1, 'u_ids' : []}, ...]   # see other.message_view()
                                 'is_pinned': True
                             }
                         ]
+            'scheduled': []                                     # as for channels
         }
     ]
     
+    'counters': {
+        'message_id': 9,    # the highest message_id handed out or reserved
+        'session_id': 4,    # the highest session_id handed out or reserved
+        'dm_id': 1,         # the highest dm_id handed out or reserved
+        'schema_version': 2,
+    }
+
     'stats': [
         'workspace_stats': {
             'channels_exist': [{num_channels_exist, time_stamp}], 
@@ -122,6 +155,14 @@ initial_object = {
         }
     ]
 
+    'codes': [                                              # oldest first
+        {
+            'reset_code': "aBcDeFgHiJk",
+            'email': "johnsmith@gmail.com",
+            'time_created': 1,
+        }
+    ]
+
 eg.
 users[0] = {
                 'u_id': 1,
@@ -135,9 +176,62 @@ users[0] = {
 
 ## YOU SHOULD MODIFY THIS OBJECT ABOVE
 
+# The tables that are indexed by id, and the field holding each record's id
+ID_FIELDS = {
+    'users': 'u_id',
+    'channels': 'channel_id',
+    'dms': 'dm_id',
+}
+
+# The field holding the u_ids of a channel's or dm's members
+MEMBER_FIELDS = {
+    'channels': 'all_members',
+    'dms': 'members',
+}
+
+# Fields that are unique among users and indexed, see lookup_user()
+USER_KEYS = ['email', 'handle_str']
+
+# Lists that entries are only ever added to, as the path to each one in a
+# user or in the workspace stats. They grow for as long as the server runs,
+# so new entries are saved on their own rather than with the whole record.
+# Notifications are kept newest first, the others oldest first.
+HISTORY_FIELDS = {
+    'users': [
+        ('user_stats', 'channels_joined'),
+        ('user_stats', 'dms_joined'),
+        ('user_stats', 'messages_sent'),
+        ('notifications',),
+    ],
+    'stats': [
+        ('channels_exist',),
+        ('dms_exist',),
+        ('messages_exist',),
+    ],
+}
+NEWEST_FIRST = [('notifications',)]
+
 class Datastore:
     def __init__(self):
-        self.__store = initial_object
+        # A copy, so initial_object stays empty for the loaders that start
+        # from it
+        self.__store = json.loads(json.dumps(initial_object))
+        # id -> record for each table in ID_FIELDS, see lookup(),
+        # message_id -> where the message is, see lookup_message(), and
+        # message_id -> position in its channel or dm, see message_position(),
+        # channel/dm membership in both directions, see is_member(),
+        # email/handle_str -> user, see lookup_user(), reset codes by code
+        # and by email, see lookup_code(), and
+        # session_id -> u_id, see lookup_session(), and opaque token ->
+        # (u_id, session_id), see lookup_token()
+        self.__indexes = build_indexes(self.__store)
+        # Records modified since the last commit, in the order they were first
+        # touched, as (table, key, parent). parent is the conversation for
+        # messages, eg. ('channels', 1), and None for everything else.
+        self.__changes = {}
+        self.__changes_lock = threading.Lock()
+        # Set whenever there are changes that haven't been committed yet
+        self.__dirty = threading.Event()
 
     def get(self):
         return self.__store
@@ -145,8 +239,416 @@ class Datastore:
     def set(self, store):
         if not isinstance(store, dict):
             raise TypeError('store must be of type dictionary')
+        if store is not self.__store:
+            # Replacing the whole store can't be described record by record
+            self.touch('store')
+            self.__indexes = build_indexes(store)
         self.__store = store
 
+    def lookup(self, table, key):
+        '''
+        Find the record in table ('users', 'channels' or 'dms') with the
+        given id, or None if there isn't one
+        '''
+        return self.__indexes[table].get(key)
+
+    def insert(self, table, record):
+        # Add a new record to the end of table and to its index
+        self.__store[table].append(record)
+        self.__indexes[table][record[ID_FIELDS[table]]] = record
+        if table == 'users':
+            for field in USER_KEYS:
+                index_user_key(self.__indexes, field, record)
+            index_sessions(self.__indexes, record)
+        if table in MEMBER_FIELDS:
+            self.__indexes['members'][table][record[ID_FIELDS[table]]] = set()
+            for u_id in record[MEMBER_FIELDS[table]]:
+                index_member(self.__indexes, table, record[ID_FIELDS[table]], u_id)
+
+    def delete(self, table, key):
+        # Remove the record with the given id from table and its index, along
+        # with the messages and members of a channel or dm
+        record = self.__indexes[table].pop(key, None)
+        if record is not None:
+            self.__store[table].remove(record)
+            if table in MEMBER_FIELDS:
+                for u_id in record[MEMBER_FIELDS[table]]:
+                    self.__indexes['joined'][table][u_id].discard(key)
+                self.__indexes['members'][table].pop(key, None)
+                self.__indexes['positions'][table].pop(key, None)
+            for message in record.get('messages', []):
+                if isinstance(message, dict):
+                    location = self.__indexes['messages'].get(message['message_id'])
+                    if location is not None and location[2] is message:
+                        del self.__indexes['messages'][message['message_id']]
+        return record
+
+    def lookup_user(self, field, value):
+        '''
+        Find the user whose email or handle_str (field) is value, or None if
+        there isn't one. Values are matched exactly, so case matters.
+        '''
+        return self.__indexes[field].get(value)
+
+    def set_user_key(self, user, field, value):
+        # Change a user's email or handle_str, keeping its index up to date
+        if self.__indexes[field].get(user[field]) is user:
+            del self.__indexes[field][user[field]]
+            if field == 'handle_str':
+                release_handle(self.__indexes, user[field])
+        user[field] = value
+        index_user_key(self.__indexes, field, user)
+
+    def lookup_session(self, session_id):
+        # The u_id of the user logged in with session_id, None if it isn't live
+        return self.__indexes['sessions'].get(session_id)
+
+    def add_session(self, user, session_id):
+        # Log user in with a new session
+        user['session_id'].append(session_id)
+        self.__indexes['sessions'][session_id] = user['u_id']
+
+    def remove_session(self, user, session_id):
+        # Log one of user's sessions out, along with its opaque token
+        if session_id in user['session_id']:
+            user['session_id'].remove(session_id)
+        self.__indexes['sessions'].pop(session_id, None)
+        tokens = user.get('tokens', {})
+        for token in [token for token in tokens if tokens[token] == session_id]:
+            del tokens[token]
+            self.__indexes['tokens'].pop(token, None)
+
+    def end_sessions(self, user):
+        # Log user out of every session
+        for session_id in user['session_id']:
+            self.__indexes['sessions'].pop(session_id, None)
+        user['session_id'].clear()
+        tokens = user.get('tokens', {})
+        for token in tokens:
+            self.__indexes['tokens'].pop(token, None)
+        tokens.clear()
+
+    def lookup_token(self, token):
+        # The (u_id, session_id) an opaque token was issued for, None if it
+        # wasn't issued or has been logged out
+        return self.__indexes['tokens'].get(token)
+
+    def add_token(self, user, token, session_id):
+        # Issue an opaque token for one of user's sessions
+        user.setdefault('tokens', {})[token] = session_id
+        self.__indexes['tokens'][token] = (user['u_id'], session_id)
+
+    def session_count(self):
+        # The number of live sessions across all users
+        return len(self.__indexes['sessions'])
+
+    def next_handle(self, base):
+        '''
+        The handle to give a new user whose handle would be base: base itself
+        if no one has it, otherwise base followed by the smallest number
+        (starting from 0) that makes a handle no one has
+        '''
+        handles = self.__indexes['handle_str']
+        if base not in handles:
+            return base
+        # Every suffix below a base's counter was taken when last checked
+        suffixes = self.__indexes['handle_suffixes']
+        counter = suffixes.get(base, 0)
+        while base + str(counter) in handles:
+            counter += 1
+        suffixes[base] = counter
+        return base + str(counter)
+
+    def lookup_code(self, reset_code):
+        # The password reset code record for reset_code, None if there isn't one
+        return self.__indexes['codes'].get(reset_code)
+
+    def codes_for(self, email):
+        # The reset codes sent to email, oldest first, don't modify it
+        return self.__indexes['codes_by_email'].get(email, [])
+
+    def add_code(self, code):
+        # Add a new reset code to the end of the codes table
+        self.__store['codes'].append(code)
+        index_code(self.__indexes, code)
+
+    def remove_code(self, code):
+        # Remove a reset code from the codes table
+        self.__store['codes'].remove(code)
+        if self.__indexes['codes'].get(code['reset_code']) is code:
+            del self.__indexes['codes'][code['reset_code']]
+        codes = self.__indexes['codes_by_email'][code['email']]
+        codes.remove(code)
+        if not codes:
+            del self.__indexes['codes_by_email'][code['email']]
+
+    def lookup_message(self, message_id):
+        '''
+        Find the message with the given id, as (kind, conversation_id, message)
+        where kind is 'channels' or 'dms', or None if there isn't one
+        '''
+        return self.__indexes['messages'].get(message_id)
+
+    def add_message(self, kind, conversation_id, message):
+        # Add a new message to a channel or dm and to the message index
+        conversation = self.__indexes[kind][conversation_id]
+        # Messages are kept oldest first
+        conversation['messages'].append(message)
+        self.__indexes['messages'][message['message_id']] = (kind, conversation_id, message)
+        positions = self.__indexes['positions'][kind].get(conversation_id)
+        if positions is not None:
+            positions[message['message_id']] = len(conversation['messages']) - 1
+
+    def message_position(self, kind, conversation_id, message_id):
+        '''
+        Find where the message with the given id is in the messages of a
+        channel or dm, or None if it isn't one of them
+        '''
+        location = self.__indexes['messages'].get(message_id)
+        if location is None or location[:2] != (kind, conversation_id):
+            return None
+        messages = self.__indexes[kind][conversation_id]['messages']
+        positions = self.__indexes['positions'][kind].get(conversation_id, {})
+        position = positions.get(message_id)
+        if position is None or position >= len(messages) or messages[position] is not location[2]:
+            # Not indexed yet, or a removal moved the messages after it
+            positions = index_positions(messages)
+            self.__indexes['positions'][kind][conversation_id] = positions
+            position = positions[message_id]
+        return position
+
+    def remove_message(self, message_id):
+        # Remove a message from its channel or dm and from the message index,
+        # returns where it was
+        location = self.__indexes['messages'].pop(message_id, None)
+        if location is not None:
+            kind, conversation_id, message = location
+            self.__indexes[kind][conversation_id]['messages'].remove(message)
+            # The messages after it have moved up, index them again when needed
+            self.__indexes['positions'][kind].pop(conversation_id, None)
+        return location
+
+    def is_member(self, kind, conversation_id, u_id):
+        # Whether u_id is a member of the channel or dm, kind is 'channels' or 'dms'
+        return u_id in self.__indexes['members'][kind].get(conversation_id, ())
+
+    def joined(self, kind, u_id):
+        # The ids of the channels or dms u_id is a member of, don't modify it
+        return self.__indexes['joined'][kind].get(u_id, set())
+
+    def add_member(self, kind, conversation_id, u_id):
+        # Add u_id to the members of a channel or dm
+        conversation = self.__indexes[kind][conversation_id]
+        conversation[MEMBER_FIELDS[kind]].append(u_id)
+        index_member(self.__indexes, kind, conversation_id, u_id)
+
+    def remove_member(self, kind, conversation_id, u_id):
+        # Remove u_id from the members of a channel or dm
+        conversation = self.__indexes[kind][conversation_id]
+        conversation[MEMBER_FIELDS[kind]].remove(u_id)
+        self.__indexes['members'][kind][conversation_id].discard(u_id)
+        self.__indexes['joined'][kind][u_id].discard(conversation_id)
+
+    def reindex(self):
+        # Rebuild the indexes after the tables were changed directly, eg. cleared
+        self.__indexes = build_indexes(self.__store)
+
+    def touch(self, table, key=None, parent=None):
+        '''
+        Mark a record as modified so that persistence writes it out on the
+        next commit.
+
+        table is one of 'users', 'channels', 'dms', 'messages', 'stats',
+        'codes' or 'counters'; key is the record's id (u_id, channel_id, dm_id, message_id)
+        and parent is the conversation a message belongs to. 'clear' drops
+        every pending change, since the whole store has been wiped, and
+        'store' means the store was replaced and needs a full snapshot.
+        '''
+        with self.__changes_lock:
+            if table == 'clear':
+                self.__changes = {}
+            self.__changes[(table, key, parent)] = None
+            self.__dirty.set()
+
+    def pop_changes(self):
+        # Return the pending changes and start a new batch
+        with self.__changes_lock:
+            changes = self.__changes
+            self.__changes = {}
+            self.__dirty.clear()
+        return changes
+
+    def restore_changes(self, changes):
+        # Put back changes from pop_changes() that couldn't be committed,
+        # ahead of any made since. A clear since then makes them moot.
+        with self.__changes_lock:
+            if ('clear', None, None) in self.__changes:
+                return
+            restored = dict(changes)
+            restored.update(self.__changes)
+            self.__changes = restored
+            self.__dirty.set()
+
+    def wait_until_dirty(self, timeout=None):
+        # Block until a record is touched, returns False if timeout ran out first
+        return self.__dirty.wait(timeout)
+
+def reset_counters(store):
+    # Put the counters back to where they start in an empty store
+    store['counters'] = {
+        'message_id': 0,
+        'session_id': 0,
+        'dm_id': 0,
+        'schema_version': SCHEMA_VERSION
+    }
+
+def messages_oldest_first(store):
+    # Whether store keeps messages oldest first, it was saved before
+    # SCHEMA_VERSION 2 if not
+    return store.get('counters', {}).get('schema_version', 1) >= 2
+
+def history(record, path):
+    # One of a record's HISTORY_FIELDS, as it is kept in the record
+    for field in path:
+        record = record[field]
+    return record
+
+def new_history(record, path, count):
+    # The entries of one of a record's HISTORY_FIELDS after the first count,
+    # oldest first
+    entries = history(record, path)
+    if path in NEWEST_FIRST:
+        return entries[:max(0, len(entries) - count)][::-1]
+    return entries[count:]
+
+def add_history(record, path, entries):
+    # Add entries, oldest first, to one of a record's HISTORY_FIELDS
+    if path in NEWEST_FIRST:
+        history(record, path)[:0] = entries[::-1]
+    else:
+        history(record, path).extend(entries)
+
+def without_history(table, record):
+    # A copy of a user or workspace stats record with its HISTORY_FIELDS left
+    # out, the rest of it is shared with record
+    record = dict(record)
+    for path in HISTORY_FIELDS[table]:
+        parent = record
+        for field in path[:-1]:
+            parent[field] = dict(parent[field])
+            parent = parent[field]
+        parent.pop(path[-1], None)
+    return record
+
+def with_history(table, record, previous=None):
+    # Put back the HISTORY_FIELDS that record is missing, from previous (the
+    # same record as it was before) if there is one, or empty
+    for path in HISTORY_FIELDS[table]:
+        parent = record
+        for field in path[:-1]:
+            parent = parent.setdefault(field, {})
+        if path[-1] not in parent:
+            try:
+                parent[path[-1]] = history(previous, path) if previous is not None else []
+            except KeyError:
+                parent[path[-1]] = []
+    return record
+
+def history_lengths(store):
+    # The number of entries in each history in store, by (table, owner, path)
+    # where owner is the u_id for users and the position for stats
+    owners = [('users', user['u_id'], user) for user in store['users']]
+    owners += [('stats', position, stats) for position, stats in enumerate(store.get('stats', []))]
+    return {
+        (table, owner, path): len(history(record, path))
+        for table, owner, record in owners
+        for path in HISTORY_FIELDS[table]
+    }
+
+def build_indexes(store):
+    indexes = {
+        table: {record[id_field]: record for record in store[table]}
+        for table, id_field in ID_FIELDS.items()
+    }
+
+    for field in USER_KEYS:
+        indexes[field] = {}
+        for user in store['users']:
+            index_user_key(indexes, field, user)
+    # base handle -> lowest suffix that might be free, see next_handle()
+    indexes['handle_suffixes'] = {}
+
+    # session_id -> u_id of every live session, and opaque token ->
+    # (u_id, session_id) of every token issued for one
+    indexes['sessions'] = {}
+    indexes['tokens'] = {}
+    for user in store['users']:
+        index_sessions(indexes, user)
+
+    # reset_code -> code, and email -> codes sent to it
+    indexes['codes'] = {}
+    indexes['codes_by_email'] = {}
+    for code in store['codes']:
+        index_code(indexes, code)
+
+    indexes['messages'] = {}
+    # conversation id -> {message_id: position in its messages}, built for a
+    # conversation the first time it's needed and dropped when a message is
+    # removed from it, see message_position()
+    indexes['positions'] = {'channels': {}, 'dms': {}}
+    # conversation id -> set of member u_ids, and u_id -> set of conversation ids
+    indexes['members'] = {'channels': {}, 'dms': {}}
+    indexes['joined'] = {'channels': {}, 'dms': {}}
+    for kind in ('channels', 'dms'):
+        for conversation in store[kind]:
+            conversation_id = conversation[ID_FIELDS[kind]]
+            indexes['members'][kind][conversation_id] = set()
+            for u_id in conversation[MEMBER_FIELDS[kind]]:
+                index_member(indexes, kind, conversation_id, u_id)
+            for message in conversation['messages']:
+                # Skip anything that isn't a message, like the blank entry an
+                # empty standup leaves behind
+                if isinstance(message, dict):
+                    indexes['messages'][message['message_id']] = (kind, conversation_id, message)
+
+    return indexes
+
+def index_positions(messages):
+    return {
+        message['message_id']: position
+        for position, message in enumerate(messages)
+        if isinstance(message, dict)
+    }
+
+def index_sessions(indexes, user):
+    for session_id in user['session_id']:
+        indexes['sessions'][session_id] = user['u_id']
+    # Users saved before opaque tokens existed have no 'tokens'
+    for token, session_id in user.get('tokens', {}).items():
+        indexes['tokens'][token] = (user['u_id'], session_id)
+
+def index_code(indexes, code):
+    indexes['codes'][code['reset_code']] = code
+    indexes['codes_by_email'].setdefault(code['email'], []).append(code)
+
+def index_user_key(indexes, field, user):
+    # Removed users have their email and handle blanked so they can be reused
+    if user[field] != '':
+        indexes[field][user[field]] = user
+
+def release_handle(indexes, handle):
+    # handle is free again. If it could have been made by next_handle() from
+    # a base handle and a suffix, that suffix is the lowest free one again.
+    suffixes = indexes['handle_suffixes']
+    for split in range(1, len(handle)):
+        base, suffix = handle[:split], handle[split:]
+        if base in suffixes and suffix.isascii() and suffix.isdigit() and str(int(suffix)) == suffix:
+            suffixes[base] = min(suffixes[base], int(suffix))
+
+def index_member(indexes, kind, conversation_id, u_id):
+    indexes['members'][kind].setdefault(conversation_id, set()).add(u_id)
+    indexes['joined'][kind].setdefault(u_id, set()).add(conversation_id)
+
 print('Loading Datastore...')
 
 global data_store
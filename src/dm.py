@@ -1,6 +1,7 @@
 from src.data_store import data_store
 from src.error import InputError, AccessError
-from src.other import check_valid_token
+from src.other import check_valid_token, get_user, get_dm, user_details, check_is_dm_member, joined_dms
+from src.other import message_view, newest_first, messages_from_cursor, generate_dm_id
 from src.stats import increase_num_dms_joined, decrease_num_dms_joined
 from src.stats import increase_dms_exist, decrease_dms_exist, decrease_msgs_exist
 from src.notifications import update_notification_added_dm
@@ -27,32 +28,26 @@ def dm_create_v1(token, u_ids):
     dm_members = []
     dm_messages = []
 
-    dm_id = len(store['dms']) +1
-    
     # If token is invalid, AccessError is raised
     # else the payload is returned
     owner = check_valid_token(token)
     
     # Finding user of token (owner)
-    for user in store['users']:
-        for sess_id in user['session_id']:
-            if owner['u_id'] == user['u_id'] and owner['session_id'] == sess_id:
-                # Add the creator/owner's handle to name
-                name.append(user['handle_str'])
-                # Storing owner of dm
-                dm_dict['owner'] = user
-                # Adding owner to dm_members
-                dm_members.append(user)
-                break
+    user = get_user(owner['u_id'])
+    # Add the creator/owner's handle to name
+    name.append(user['handle_str'])
+    # Storing owner of dm
+    dm_dict['owner'] = owner['u_id']
+    # Adding owner to dm_members
+    dm_members.append(owner['u_id'])
     
     # Adds the users' handles in name
     for u_id in u_ids:
-        for user in store['users']:
-            if u_id == user['u_id']:
-                name.append(user['handle_str'])
-                # Adding valid user to dm_members
-                dm_members.append(user)
-                break
+        user = get_user(u_id)
+        if user is not None:
+            name.append(user['handle_str'])
+            # Adding valid user to dm_members
+            dm_members.append(u_id)
     
     # If there is an invalid u_id in u_ids then
     # length of name will be not equal length of u_ids
@@ -64,6 +59,7 @@ def dm_create_v1(token, u_ids):
     name.sort()
 
     # Creating and storing the dm_id
+    dm_id = generate_dm_id()
     dm_dict['dm_id'] = dm_id
 
     # Converting 'name' to str then storing
@@ -75,10 +71,14 @@ def dm_create_v1(token, u_ids):
     # Storing dm_messages to data store
     dm_dict['messages'] = dm_messages
 
+    # Messages waiting to be sent with message/sendlaterdm
+    dm_dict['scheduled'] = []
+
     # Append the dm's data to the data store
-    store['dms'].append(dm_dict)
+    data_store.insert('dms', dm_dict)
 
     data_store.set(store)
+    data_store.touch('dms', dm_id)
     
     # Increase dms joined for owner of dm
     increase_num_dms_joined(owner['u_id'])
@@ -111,17 +111,14 @@ def dm_list_v1(token):
         { dms }
     '''
 
-    store = data_store.get()
     dms = []
 
     # Finding user of token
     decoded_token = check_valid_token(token)
 
     # Find all the dms that user is in
-    for dm in store['dms']:
-        for user in dm['members']:
-            if decoded_token['u_id'] == user['u_id']:
-                dms.append({'dm_id': dm['dm_id'], 'name': dm['name']})
+    for dm in joined_dms(decoded_token['u_id']):
+        dms.append({'dm_id': dm['dm_id'], 'name': dm['name']})
 
     return {
         'dms': dms
@@ -150,11 +147,8 @@ def dm_remove_v1(token, dm_id):
     token_user = check_valid_token(token)
 
     # Raise an InputError if dm_id is invalid
-    valid_dm_id = False
-    for dm in store['dms']:
-        if dm_id == dm['dm_id']:
-            dm_details = dm
-            valid_dm_id = True
+    dm_details = get_dm(dm_id)
+    valid_dm_id = dm_details is not None
 
     if valid_dm_id == False:
         raise InputError(description="dm_id does not refer to a valid DM")
@@ -162,23 +156,23 @@ def dm_remove_v1(token, dm_id):
     # Raise an AccessError if dm_id is valid and user is not a owner of the DM
     # If user is owner then remove the DM
     valid_owner = False
-    for dm in store['dms']:
-        if token_user['u_id'] == dm['owner']['u_id'] and dm_id == dm['dm_id']:
-            valid_owner = True
-            store['dms'].remove(dm)
+    if token_user['u_id'] == dm_details['owner']:
+        valid_owner = True
+        data_store.delete('dms', dm_id)
 
     if valid_owner == False:
         raise AccessError(description="dm_id is valid and the authorised user is not the original DM creator")
 
     data_store.set(store)
+    data_store.touch('dms', dm_id)
     
     # Decrease dms joined for owner of dm
     decrease_num_dms_joined(token_user['u_id'])
     
     # Decrease dms joined for all other members of dm
-    for members in dm_details['members']:
-        if members['u_id'] != token_user['u_id']:
-            decrease_num_dms_joined(members['u_id'])
+    for member in dm_details['members']:
+        if member != token_user['u_id']:
+            decrease_num_dms_joined(member)
             
     # Decrease the number of dms that exist in workplace stats
     decrease_dms_exist()
@@ -206,34 +200,25 @@ def dm_details_v1(token, dm_id):
         { name, members }
     '''
 
-    store = data_store.get()
-
     # Finding user of token
     token_user = check_valid_token(token)
 
     # Raise an InputError if dm_id is invalid
-    valid_dm_id = False
-    for dm in store['dms']:
-        if dm_id == dm['dm_id']:
-            valid_dm_id = True
-            break
+    dm = get_dm(dm_id)
+    valid_dm_id = dm is not None
 
     if valid_dm_id == False:
         raise InputError(description="dm_id does not refer to a valid DM")
 
     # Raise an AccessError if dm_id is valid and user is not a member of the DM
-    valid_member = False
-    for member in dm['members']:
-        if token_user['u_id'] == member['u_id']:
-            valid_member = True
-            break
+    valid_member = check_is_dm_member(token_user['u_id'], dm['dm_id'])
 
     if valid_member == False:
         raise AccessError(description="dm_id is valid and the authorised user is not a member of the DM")
 
     return {
         'name': dm['name'],
-        'members': dm['members']
+        'members': [user_details(u_id) for u_id in dm['members']]
     }
 
 def dm_leave_v1(token, dm_id):
@@ -253,102 +238,99 @@ def dm_leave_v1(token, dm_id):
         { }
     '''
 
-    store = data_store.get()
-
     # Finding user of token
     token_user = check_valid_token(token)
 
     # Raise an InputError if dm_id is invalid
-    valid_dm_id = False
-    for dm in store['dms']:
-        if dm_id == dm['dm_id']:
-            valid_dm_id = True
-            break
+    dm = get_dm(dm_id)
+    valid_dm_id = dm is not None
 
     if valid_dm_id == False:
         raise InputError(description="dm_id does not refer to a valid DM")
 
     # Raise an AccessError if dm_id is valid and user is not a member of the DM
     valid_member = False
-    for member in dm['members']:
-        if token_user['u_id'] == member['u_id']:
-	        dm['members'].remove(member)
-	        valid_member = True
-	        break
+    if check_is_dm_member(token_user['u_id'], dm['dm_id']):
+        data_store.remove_member('dms', dm_id, token_user['u_id'])
+        valid_member = True
 
     if valid_member == False:
         raise AccessError(description="dm_id is valid and the authorised user is not a member of the DM")
 
-    if token_user['u_id'] == dm['owner']['u_id']:
+    if token_user['u_id'] == dm['owner']:
         dm['owner'] = None
     
+    data_store.touch('dms', dm_id)
+    
     # Decrease dms joined for user that left
     decrease_num_dms_joined(token_user['u_id'])
     
     return {
     }
     
-def dm_messages_v1(token, dm_id, start):
+def dm_messages_v1(token, dm_id, start, before_message_id=None, after_message_id=None):
     '''
-    Returns up to 50 messages in a given DM
+    Returns up to 50 messages in a given DM, starting start messages back from the
+    newest, or older than before_message_id, or newer than after_message_id
 
     Arguments:
         - token (sting)
         - dm_id (integer)
         - start (integer)
+        - before_message_id (integer, optional)
+        - after_message_id (integer, optional)
 
     Exceptions:
         InputError - when dm_id does not refer to a valid DM
         InputError - start is greater than the total number of messages in the channel
+        InputError - when both before_message_id and after_message_id are given
+        InputError - when the cursor does not refer to a message in the DM
         AccessError - when token is invalid
         AccessError - when dm_id is valid and the authorised user is not a member of the DM
 
     Return value:
         { messages, start, end }
+        { messages, before_message_id } when before_message_id is given
+        { messages, after_message_id } when after_message_id is given
     '''
 
-    store = data_store.get()
-    
     # Finding user of token
     token_user = check_valid_token(token)
     
     # Raise an InputError if dm_id is invalid
-    valid_dm_id = False
-    for dm in store['dms']:
-        if dm_id == dm['dm_id']:
-            valid_dm_id = True
-            break
+    dm = get_dm(dm_id)
+    valid_dm_id = dm is not None
     
     if valid_dm_id == False:
         raise InputError(description="dm_id does not refer to a valid DM")
     
     # Raise an AccessError if dm_id is valid and user is not a member of the DM
-    valid_member = False
-    for member in dm['members']:
-        if token_user['u_id'] == member['u_id']:
-	        valid_member = True
-	        break
+    valid_member = check_is_dm_member(token_user['u_id'], dm['dm_id'])
 
     if valid_member == False:
         raise AccessError(description="dm_id is valid and the authorised user is not a member of the DM")
     
+    # Page from a cursor
+    if before_message_id is not None or after_message_id is not None:
+        page, next_cursor = messages_from_cursor(
+            'dms', dm, before_message_id, after_message_id, 50
+        )
+        return {
+            'messages': [message_view(message, token_user['u_id']) for message in page],
+            'before_message_id' if before_message_id is not None else 'after_message_id': next_cursor
+        }
+    
     # Raise an InputError when start is greater than total number of messages in DM
     if start > len(dm['messages']):
         raise InputError(description="start is greater than the total number of messages in the DM")
     
-    messages = []
-    end = 0
-    
-    for message in dm['messages']:
-        if end < start:
-            end += 1
-        elif end == start + 50:
-            break
-        else:
-            messages.append(message)
-            end += 1
+    messages = [
+        message_view(message, token_user['u_id'])
+        for message in newest_first(dm['messages'], start, 50)
+    ]
     
-    if end == len(dm['messages']):
+    end = start + 50
+    if end >= len(dm['messages']):
         end = -1
     
     return {
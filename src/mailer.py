@@ -0,0 +1,163 @@
+'''
+mailer.py
+
+Sends email in the background. send_email() only queues the message and
+returns straight away; a worker thread takes messages off the queue in
+batches of up to config.mail_batch_size and hands them to the transport.
+
+The transport is chosen with config.mail_transport:
+
+    'smtp'  sends through config.smtp_host, keeping the connection open
+            between messages until the queue has been idle for
+            config.smtp_idle_timeout seconds
+    'file'  appends each message to config.mail_file as a line of JSON,
+            for running without a mail server (eg. in tests)
+
+Anything with send(message) and close() methods can be plugged in instead
+with set_transport(). A message that fails is retried up to
+config.mail_retries times, waiting config.mail_retry_delay seconds and
+doubling the wait after each failure, then dropped.
+'''
+
+from src import config
+
+import json
+import queue
+import smtplib
+import threading
+import time
+
+QUEUE = queue.Queue()
+
+WORKER = None
+WORKER_LOCK = threading.Lock()
+
+TRANSPORT = None
+
+# Counts since the server started
+MAIL_STATS = {
+    'sent': 0,
+    'retries': 0,
+    'failed': 0,
+}
+
+class SmtpTransport:
+    '''
+    Sends messages through config.smtp_host over one connection, opened when
+    the first message is sent and again after a failure or close()
+    '''
+    def __init__(self):
+        self.server = None
+
+    def send(self, message):
+        if self.server is None:
+            self.connect()
+        self.server.sendmail(message['from'], message['to'], message['body'])
+
+    def connect(self):
+        if config.smtp_ssl:
+            server = smtplib.SMTP_SSL(config.smtp_host, config.smtp_port, timeout=config.smtp_timeout)
+        else:
+            server = smtplib.SMTP(config.smtp_host, config.smtp_port, timeout=config.smtp_timeout)
+        server.ehlo()
+        if config.smtp_user is not None:
+            server.login(config.smtp_user, config.smtp_password)
+        self.server = server
+
+    def close(self):
+        server, self.server = self.server, None
+        if server is not None:
+            try:
+                server.quit()
+            except (smtplib.SMTPException, OSError):
+                server.close()
+
+class FileTransport:
+    '''
+    Appends messages to config.mail_file, one JSON object per line
+    '''
+    def send(self, message):
+        with open(config.mail_file, 'a') as FILE:
+            FILE.write(json.dumps(message) + '\n')
+
+    def close(self):
+        pass
+
+TRANSPORTS = {
+    'smtp': SmtpTransport,
+    'file': FileTransport,
+}
+
+def send_email(to, body):
+    '''
+    Queue an email to be sent from config.mail_sender
+    '''
+    start_worker()
+    QUEUE.put({'from': config.mail_sender, 'to': to, 'body': body})
+
+def set_transport(transport):
+    '''
+    Send with transport from now on instead of the one in config.mail_transport
+    '''
+    global TRANSPORT
+    old_transport, TRANSPORT = TRANSPORT, transport
+    if old_transport is not None:
+        old_transport.close()
+
+def get_transport():
+    global TRANSPORT
+    if TRANSPORT is None:
+        TRANSPORT = TRANSPORTS[config.mail_transport]()
+    return TRANSPORT
+
+def start_worker():
+    # Start the thread that sends queued mail, if it isn't running already
+    global WORKER
+    with WORKER_LOCK:
+        if WORKER is None:
+            WORKER = threading.Thread(target=send_loop, name='mailer', daemon=True)
+            WORKER.start()
+    return WORKER
+
+def send_loop():
+    while True:
+        try:
+            message = QUEUE.get(timeout=config.smtp_idle_timeout)
+        except queue.Empty:
+            # Don't hold a connection open while there is nothing to send
+            get_transport().close()
+            continue
+
+        batch = [message]
+        while len(batch) < config.mail_batch_size:
+            try:
+                batch.append(QUEUE.get_nowait())
+            except queue.Empty:
+                break
+
+        send_batch(batch)
+
+def send_batch(batch):
+    # Send each message in turn, retrying failures with backoff
+    failures = 0
+    while batch:
+        transport = get_transport()
+        try:
+            transport.send(batch[0])
+        except Exception as error:
+            # The connection may be broken, start a new one for the retry
+            transport.close()
+            failures += 1
+            if failures > config.mail_retries:
+                print(f"Failed to send email to {batch[0]['to']}:", error)
+                MAIL_STATS['failed'] += 1
+                batch.pop(0)
+                failures = 0
+            else:
+                MAIL_STATS['retries'] += 1
+                time.sleep(config.mail_retry_delay * 2 ** (failures - 1))
+            continue
+
+        MAIL_STATS['sent'] += 1
+        batch.pop(0)
+        failures = 0
@@ -1,6 +1,7 @@
 from src.data_store import data_store
 from src.error import InputError, AccessError
-from src.other import check_valid_token, generate_message_id, search_message
+from src.other import check_valid_token, generate_message_id, find_message, get_user, get_dm
+from src.other import check_is_member, check_is_dm_member
 from src.stats import increase_num_msgs_sent, increase_msgs_exist
 from datetime import datetime
 from src.notifications import update_notification_tagged, update_notification_react
@@ -32,21 +33,14 @@ def message_senddm_v1(token, dm_id, message):
     token_user = check_valid_token(token)
 
     # Raise an InputError if dm_id is invalid
-    valid_dm_id = False
-    for dm in store['dms']:
-        if dm_id == dm['dm_id']:
-            valid_dm_id = True
-            break
+    dm = get_dm(dm_id)
+    valid_dm_id = dm is not None
 
     if valid_dm_id == False:
         raise InputError(description="dm_id does not refer to a valid DM")
 
     # Raise an AccessError if dm_id is valid and user is not a member of the DM
-    valid_member = False
-    for member in dm['members']:
-        if token_user['u_id'] == member['u_id']:
-	        valid_member = True
-	        break
+    valid_member = check_is_dm_member(token_user['u_id'], dm['dm_id'])
     
     if valid_member == False:
         raise AccessError(description="dm_id is valid and the authorised user is not a member of the DM")
@@ -58,9 +52,7 @@ def message_senddm_v1(token, dm_id, message):
     message_id = generate_message_id()
     dm_messages_dict['message_id'] = message_id
     
-    for user in store['users']:
-        if token_user['u_id'] == user['u_id']:
-            dm_messages_dict['u_id'] = user['u_id']
+    dm_messages_dict['u_id'] = token_user['u_id']
     
     # Stores message to data store
     dm_messages_dict['message'] = message
@@ -68,13 +60,14 @@ def message_senddm_v1(token, dm_id, message):
     # Get current Unix timestamp then store
     timestamp = int(datetime.now().timestamp())
     dm_messages_dict['time_created'] = timestamp
-    dm_messages_dict['reacts'] = [{'react_id': 1, 'u_ids' : [], 'is_this_user_reacted' : False}]
+    dm_messages_dict['reacts'] = [{'react_id': 1, 'u_ids' : []}]
     dm_messages_dict['is_pinned'] = False
     
     # Stores the message into the correct dm
-    dm['messages'].insert(0, dm_messages_dict)
+    data_store.add_message('dms', dm_id, dm_messages_dict)
     
     data_store.set(store)
+    data_store.touch('messages', message_id, ('dms', dm_id))
     
     increase_num_msgs_sent(token_user['u_id'])
     increase_msgs_exist()
@@ -106,11 +99,8 @@ def message_react_v1(token, message_id, react_id):
     store = data_store.get()
     decode = check_valid_token(token)
     
-    user_details = {}
     # Fetches data of the user
-    for user in store['users']:
-        if user['u_id'] == decode['u_id']:
-            user_details = user
+    user_details = get_user(decode['u_id'])
     
     valid_react_id = [1]
     
@@ -118,19 +108,18 @@ def message_react_v1(token, message_id, react_id):
     if react_id not in valid_react_id:
         raise InputError(description="Invalid react id")
     
-    message_return = search_message(message_id)
+    message_return = find_message(message_id)
     
     # Error is message id is invalid
-    if message_return[0] == False:
+    if message_return is None:
         raise InputError(description="Invalid message id")
     else:
-        index = message_return[1] - 1
-        m_index = message_return[3] - 1 
-        if message_return[2] == 0:
-            channel_message_action(index, m_index, user_details, react_id, "react")
+        kind, conversation, message = message_return
+        if kind == 'channels':
+            channel_message_action(conversation, message, user_details, react_id, "react")
                     
-        if message_return[2] == 1:
-            dm_message_action(index, m_index, user_details, react_id, "react")
+        if kind == 'dms':
+            dm_message_action(conversation, message, user_details, react_id, "react")
            
     # Update notication for react
     update_notification_react(decode['u_id'], message_id)
@@ -158,11 +147,8 @@ def message_unreact_v1(token, message_id, react_id):
     store = data_store.get()
     decode = check_valid_token(token)
     
-    user_details = {}
     # Fetches data of the user
-    for user in store['users']:
-        if user['u_id'] == decode['u_id']:
-            user_details = user
+    user_details = get_user(decode['u_id'])
     
     valid_react_id = [1]
     
@@ -170,33 +156,30 @@ def message_unreact_v1(token, message_id, react_id):
     if react_id not in valid_react_id:
         raise InputError(description="Invalid react id")
     
-    message_return = search_message(message_id)
+    message_return = find_message(message_id)
     
     # Error is message id is invalid
-    if message_return[0] == False:
+    if message_return is None:
         raise InputError(description="Invalid message id")
     else:
-        index = message_return[1] - 1
-        m_index = message_return[3] - 1 
-        if message_return[2] == 0:
-            channel_message_action(index, m_index, user_details, react_id, "unreact")
+        kind, conversation, message = message_return
+        if kind == 'channels':
+            channel_message_action(conversation, message, user_details, react_id, "unreact")
                     
-        if message_return[2] == 1:
-            dm_message_action(index, m_index, user_details, react_id, "unreact")
+        if kind == 'dms':
+            dm_message_action(conversation, message, user_details, react_id, "unreact")
     data_store.set(store)
     return {}
 
 
 # A function which will react or unreact a message in a channel given the action,
 # message_id and react_id
-def channel_message_action(index, m_index, user_details, react_id, action):
+def channel_message_action(get_channel, get_message, user_details, react_id, action):
     store = data_store.get()
-    get_channel = store['channels'][index]
     # Error if user not in channel
-    if user_details not in get_channel['all_members']:
+    if not check_is_member(user_details['u_id'], get_channel['channel_id']):
         raise InputError(description="You are not in this channel")
     else:
-        get_message = get_channel['messages'][m_index]
         user_react = user_details['u_id']
         if action == "react": 
             reaction = get_message['reacts'][0]
@@ -204,14 +187,12 @@ def channel_message_action(index, m_index, user_details, react_id, action):
             if user_react in reaction['u_ids'] and reaction['react_id'] == react_id:
                 raise InputError(description="You have already react to this message with this reaction")
             reaction['u_ids'].append(user_react)
-            reaction['is_this_user_reacted'] = True
                 
         if action == "unreact":
             remove = False
             reaction = get_message['reacts'][0]
             if user_react in reaction['u_ids']:
                 reaction['u_ids'].remove(user_react)
-                reaction['is_this_user_reacted'] = False
                 remove = True
             if remove == False:
                 # Error if there is no reaction from the user
@@ -222,38 +203,37 @@ def channel_message_action(index, m_index, user_details, react_id, action):
             if get_message['is_pinned'] == True:
                 raise InputError(description="Message is already pinned")
             # Error if user does not have owner permission
-            if user_details not in get_channel['owner_members']:
+            if user_details['u_id'] not in get_channel['owner_members']:
                 raise InputError(description="You do not have permission to pin")
             get_message['is_pinned'] = True
             
         if action == "unpin":
             # Default is false hence already unpinned
-            if user_details not in get_channel['owner_members']:
+            if user_details['u_id'] not in get_channel['owner_members']:
                 raise InputError(description="You do not have permission to pin")
             if get_message['is_pinned'] == False:
                 raise InputError(description="Message is already unpinned")
             get_message['is_pinned'] = False
+        
+        data_store.touch('messages', get_message['message_id'], ('channels', get_channel['channel_id']))
             
     data_store.set(store)
     return {}
     
 # A function which will react or unreact a dm in a channel given the action,
 # message_id and react_id
-def dm_message_action(index, m_index, user_details, react_id, action):
+def dm_message_action(get_dms, get_message, user_details, react_id, action):
     store = data_store.get()
-    get_dms = store['dms'][index]
     # Error if user not in dms
-    if user_details not in get_dms['members']:
+    if not check_is_dm_member(user_details['u_id'], get_dms['dm_id']):
         raise InputError(description="You are not in this dm")
     else:
-        get_message = get_dms['messages'][m_index]
         user_react = user_details['u_id']
         if action == "react":
             reaction = get_message['reacts'][0]
             if user_react in reaction['u_ids'] and reaction['react_id'] == react_id:
                 raise InputError(description="You have already react to this message with this reaction")
             reaction['u_ids'].append(user_react)
-            reaction['is_this_user_reacted'] = True 
                 
         if action == "unreact":
             remove = False
@@ -261,23 +241,24 @@ def dm_message_action(index, m_index, user_details, react_id, action):
             if user_react in reaction['u_ids'] and reaction['react_id'] == react_id:
                 remove = True
                 reaction['u_ids'].remove(user_react)
-                reaction['is_this_user_reacted'] = False 
             if remove == False:
                 raise InputError(description="Message has no reaction of the reaction")
                     
         if action == "pin":
             if get_message['is_pinned'] == True:
                 raise InputError(description="Message is already pinned")
-            if user_details['u_id'] != get_dms['owner']['u_id']:
+            if user_details['u_id'] != get_dms['owner']:
                 raise InputError(description="You do not have permission to pin")
             get_message['is_pinned'] = True
             
         if action == "unpin":
-            if user_details['u_id'] != get_dms['owner']['u_id']:
+            if user_details['u_id'] != get_dms['owner']:
                 raise InputError(description="You do not have permission to pin")
             if get_message['is_pinned'] == False:
                 raise InputError(description="Message is already unpinned")
             get_message['is_pinned'] = False
+        
+        data_store.touch('messages', get_message['message_id'], ('dms', get_dms['dm_id']))
             
     data_store.set(store)
     return {}
@@ -302,25 +283,21 @@ def message_pin_v1(token, message_id):
     store = data_store.get()
     decode = check_valid_token(token)
     
-    user_details = {}
     # Fetches data of the user
-    for user in store['users']:
-        if user['u_id'] == decode['u_id']:
-            user_details = user
+    user_details = get_user(decode['u_id'])
 
-    message_return = search_message(message_id)
+    message_return = find_message(message_id)
     
     # Error is message id is invalid
-    if message_return[0] == False:
+    if message_return is None:
         raise InputError(description="Invalid message id")
     else:
-        index = message_return[1] - 1
-        m_index = message_return[3] - 1 
-        if message_return[2] == 0:
-            channel_message_action(index, m_index, user_details, -1, "pin")
+        kind, conversation, message = message_return
+        if kind == 'channels':
+            channel_message_action(conversation, message, user_details, -1, "pin")
                     
-        if message_return[2] == 1:
-            dm_message_action(index, m_index, user_details, -1, "pin")
+        if kind == 'dms':
+            dm_message_action(conversation, message, user_details, -1, "pin")
     return {} 
 
 def message_unpin_v1(token, message_id):
@@ -343,24 +320,20 @@ def message_unpin_v1(token, message_id):
     store = data_store.get()
     decode = check_valid_token(token)
     
-    user_details = {}
     # Fetches data of the user
-    for user in store['users']:
-        if user['u_id'] == decode['u_id']:
-            user_details = user
+    user_details = get_user(decode['u_id'])
 
-    message_return = search_message(message_id)
+    message_return = find_message(message_id)
     
     # Error is message id is invalid
-    if message_return[0] == False:
+    if message_return is None:
         raise InputError(description="Invalid message id")
     else:
-        index = message_return[1] - 1
-        m_index = message_return[3] - 1 
-        if message_return[2] == 0:
-            channel_message_action(index, m_index, user_details, -1, "unpin")
+        kind, conversation, message = message_return
+        if kind == 'channels':
+            channel_message_action(conversation, message, user_details, -1, "unpin")
                     
-        if message_return[2] == 1:
-            dm_message_action(index, m_index, user_details, -1, "unpin")
+        if kind == 'dms':
+            dm_message_action(conversation, message, user_details, -1, "unpin")
     data_store.set(store)
     return {}
@@ -1,12 +1,12 @@
 from src.data_store import data_store
 from src.error import InputError, AccessError
 from datetime import datetime
-from src.other import check_valid_token, generate_message_id
-from src.other import decode_jwt
+from src.other import check_valid_token, generate_message_id, get_channel, get_dm, find_message
+from src.other import decode_jwt, check_is_member, check_is_dm_member
 from src.stats import increase_num_msgs_sent, increase_msgs_exist, decrease_msgs_exist
 from src.message import message_senddm_v1
 from src.notifications import update_notification_tagged
-from time import sleep
+from src import scheduler
 
 def message_send_v1(token, channel_id, message):
     '''
@@ -51,14 +51,13 @@ def message_send_v1(token, channel_id, message):
         'u_id': decode['u_id'],
         'message': message,
         'time_created': time_created,
-        'reacts': [{'react_id': 1, 'u_ids' : [], 'is_this_user_reacted' : False}],
+        'reacts': [{'react_id': 1, 'u_ids' : []}],
         'is_pinned': False
     }
-    for channel in store['channels']:
-        if channel_id == channel['channel_id']:
-            channel['messages'].insert(0, new_message)
+    data_store.add_message('channels', channel_id, new_message)
 
     data_store.set(store)
+    data_store.touch('messages', message_id, ('channels', channel_id))
     
     increase_num_msgs_sent(decode['u_id'])
     increase_msgs_exist()
@@ -108,7 +107,7 @@ def message_edit_v1(token, message_id, message):
     in_channel, in_dm = check_messageid_valid(decode['u_id'], message_id)
     
     user_own_message = check_user_own_message(decode['u_id'], message_id, in_channel, in_dm)
-    user_is_owner = check_user_is_owner(decode['u_id'], in_channel, in_dm)
+    user_is_owner = check_user_is_owner(decode['u_id'], message_id, in_channel, in_dm)
     
     if user_own_message == False and user_is_owner == False:
         raise AccessError(description = 'Message not sent by requested user')
@@ -126,21 +125,17 @@ def message_edit_v1(token, message_id, message):
     chat_id = None
     in_channel = False
     in_dm = False
-    for channel in store['channels']:
-        for messages in channel['messages']:
-            if int(message_id) == int(messages['message_id']):
-                chat_id = channel['channel_id']
-                in_channel = True
-                messages['message'] = message
-                break
-                
-    for dm in store['dms']:
-        for messages in dm['messages']:
-            if int(message_id) == int(messages['message_id']):
-                chat_id = dm['dm_id']
-                in_dm = True
-                messages['message'] = message
-                break
+    message_return = find_message(message_id)
+    if message_return is not None:
+        kind, conversation, messages = message_return
+        if kind == 'channels':
+            chat_id = conversation['channel_id']
+            in_channel = True
+        else:
+            chat_id = conversation['dm_id']
+            in_dm = True
+        messages['message'] = message
+        data_store.touch('messages', messages['message_id'], (kind, chat_id))
     
     # Update notication for tagged
     update_notification_tagged(decode['u_id'], chat_id, message, in_channel, in_dm)
@@ -173,23 +168,16 @@ def message_remove_v1(token, message_id):
     in_channel, in_dm = check_messageid_valid(decode['u_id'], message_id)
     
     user_own_message = check_user_own_message(decode['u_id'], message_id, in_channel, in_dm)
-    user_is_owner = check_user_is_owner(decode['u_id'], in_channel, in_dm)
+    user_is_owner = check_user_is_owner(decode['u_id'], message_id, in_channel, in_dm)
         
     if user_own_message == False and user_is_owner == False:
         raise AccessError(description = 'Message not sent by requested user')
     
     # FUNCTION TO DELETE MESSAGE
-    for channel in store['channels']:
-        for messages in channel['messages']:
-            if int(message_id) == int(messages['message_id']):
-                channel['messages'].remove(messages)
-                break
-    
-    for dm in store['dms']:
-        for message in dm['messages']:
-            if int(message_id) == int(message['message_id']):
-                dm['messages'].remove(message)
-                break
+    location = data_store.remove_message(message_id)
+    if location is not None:
+        kind, conversation_id, message = location
+        data_store.touch('messages', message['message_id'], (kind, conversation_id))
     
     data_store.set(store)
     
@@ -199,7 +187,8 @@ def message_remove_v1(token, message_id):
 
 def message_sendlater_v1(token, channel_id, message, time_sent):
     '''
-    Given a user's token, channel_id, message, and time, sends message at specified time
+    Given a user's token, channel_id, message, and time, sends message at specified time.
+    Returns straight away with the message_id the message will have once it is sent.
 
     Arguments:
         - token,
@@ -228,7 +217,8 @@ def message_sendlater_v1(token, channel_id, message, time_sent):
         raise InputError(description = 'Message character count over 1000')
 
     # Check if time_sent is in the past
-    if int(time_sent) < int(datetime.now().timestamp()):
+    time_sent = int(time_sent)
+    if time_sent < int(datetime.now().timestamp()):
         raise InputError(description = 'Scheduled time cannot be in the past')
 
     # Check if user has access to the channel
@@ -236,10 +226,14 @@ def message_sendlater_v1(token, channel_id, message, time_sent):
 
     # FUNCTION IMPLEMENTATION
 
-    wait = time_sent - datetime.now().timestamp()
-    sleep(wait)
-
-    message_id = message_send_v1(token, channel_id, message)
+    # The message_id is reserved now and the message is sent at time_sent
+    message_id = generate_message_id()
+    schedule_message('channels', channel_id, {
+        'message_id': message_id,
+        'u_id': decode['u_id'],
+        'message': message,
+        'time_sent': time_sent
+    })
 
     return {
         'message_id': message_id
@@ -248,7 +242,8 @@ def message_sendlater_v1(token, channel_id, message, time_sent):
 
 def message_sendlaterdm_v1(token, dm_id, message, time_sent):
     '''
-    Given a user's token, dm_id, message, and time, sends message at specified time
+    Given a user's token, dm_id, message, and time, sends message at specified time.
+    Returns straight away with the message_id the message will have once it is sent.
 
     Arguments:
         - token,
@@ -277,7 +272,8 @@ def message_sendlaterdm_v1(token, dm_id, message, time_sent):
         raise InputError(description = 'Message character count over 1000')
 
     # Check if time_sent is in the past
-    if int(time_sent) < int(datetime.now().timestamp()):
+    time_sent = int(time_sent)
+    if time_sent < int(datetime.now().timestamp()):
         raise InputError(description = 'Scheduled time cannot be in the past')
 
     # Check if user has access to the channel
@@ -285,10 +281,14 @@ def message_sendlaterdm_v1(token, dm_id, message, time_sent):
 
     # FUNCTION IMPLEMENTATION
 
-    wait = time_sent - datetime.now().timestamp()
-    sleep(wait)
-
-    message_id = message_senddm_v1(token, dm_id, message)
+    # The message_id is reserved now and the message is sent at time_sent
+    message_id = generate_message_id()
+    schedule_message('dms', dm_id, {
+        'message_id': message_id,
+        'u_id': decode['u_id'],
+        'message': message,
+        'time_sent': time_sent
+    })
 
     return {
         'message_id': message_id
@@ -323,16 +323,8 @@ def message_share_v1(token, og_message_id, message, channel_id, dm_id):
     #check_valid_token(token)
 
     # Check if neither ids are valid
-    valid_channel = False
-    valid_dm = False
-    for channel in store['channels']:
-        if channel['channel_id'] == channel_id:
-            valid_channel = True
-            break
-    for dm in store['dms']:
-        if dm['dm_id'] == dm_id:
-            valid_dm = True
-            break
+    valid_channel = get_channel(channel_id) is not None
+    valid_dm = get_dm(dm_id) is not None
 
     if valid_channel == False and valid_dm == False:
         raise InputError(description = 'Both channel_id and dm_id are invalid')
@@ -343,20 +335,10 @@ def message_share_v1(token, og_message_id, message, channel_id, dm_id):
 
     # Check if og_message_id is valid, and if so, find the shared message
     message_found = False
-    for channel in store['channels']:
-        for messages in channel['messages']:
-            if og_message_id == messages['message_id']:
-                shared_message = messages['message']
-                message_found = True
-                break
-    
-    if message_found == False:
-        for dms in store['dms']:
-            for messages in dms['messages']:
-                if og_message_id == messages['message_id']:
-                    shared_message = messages['message']
-                    message_found = True
-                    break
+    message_return = find_message(og_message_id)
+    if message_return is not None:
+        shared_message = message_return[2]['message']
+        message_found = True
 
     if message_found == False:
         raise InputError(description = 'Invalid og_message_id in channel/DM')
@@ -390,109 +372,136 @@ def message_share_v1(token, og_message_id, message, channel_id, dm_id):
         }
  
 
+# Helper functions for scheduled messages ==============================================================
+
+def schedule_message(kind, conversation_id, scheduled):
+    # Keep a message waiting to be sent in its channel or dm, where it is
+    # saved along with the conversation, and have the scheduler send it
+    data_store.lookup(kind, conversation_id)['scheduled'].append(scheduled)
+    data_store.touch(kind, conversation_id)
+    scheduler.schedule(scheduled['time_sent'], send_scheduled, kind, conversation_id, scheduled['message_id'])
+
+def schedule_pending():
+    # Hand the messages still waiting in the store to the scheduler, when the
+    # server starts. Any that came due while it was stopped are sent now.
+    store = data_store.get()
+    for kind, id_field in (('channels', 'channel_id'), ('dms', 'dm_id')):
+        for conversation in store[kind]:
+            for scheduled in conversation['scheduled']:
+                # Saved before time_sent was always stored as a number
+                scheduled['time_sent'] = int(scheduled['time_sent'])
+                scheduler.schedule(scheduled['time_sent'], send_scheduled,
+                                   kind, conversation[id_field], scheduled['message_id'])
+
+def send_scheduled(kind, conversation_id, message_id):
+    # Called by the scheduler when a message is due. Nothing is sent if it has
+    # gone already (eg. the store was cleared), and it is dropped if the
+    # sender has left the conversation since.
+    conversation = data_store.lookup(kind, conversation_id)
+    if conversation is None:
+        return
+    scheduled = None
+    for waiting in conversation['scheduled']:
+        if waiting['message_id'] == message_id:
+            scheduled = waiting
+    if scheduled is None:
+        return
+
+    conversation['scheduled'].remove(scheduled)
+    data_store.touch(kind, conversation_id)
+    if not data_store.is_member(kind, conversation_id, scheduled['u_id']):
+        return
+
+    post_message(kind, conversation_id, scheduled['u_id'], message_id,
+                 scheduled['message'], scheduled['time_sent'])
+
+def post_message(kind, conversation_id, u_id, message_id, message, time_created):
+    # Add a message to a channel or dm on behalf of u_id without a token, for
+    # messages sent by the server when they are due (scheduled messages and
+    # standups)
+    new_message = {
+        'message_id': message_id,
+        'u_id': u_id,
+        'message': message,
+        'time_created': time_created,
+        'reacts': [{'react_id': 1, 'u_ids' : []}],
+        'is_pinned': False
+    }
+    data_store.add_message(kind, conversation_id, new_message)
+    data_store.touch('messages', message_id, (kind, conversation_id))
+
+    increase_num_msgs_sent(u_id)
+    increase_msgs_exist()
+
+    # Update notication for tagged
+    update_notification_tagged(u_id, conversation_id, message, kind == 'channels', kind == 'dms')
+
 # Helper functions to check validations ================================================================
 
 def check_valid_channel(channel_id):
     # Check if channel ID is valid
-    store = data_store.get()
-    valid_channel = False
-    for channel in store['channels']:
-        if channel['channel_id'] == channel_id:
-            valid_channel = True
-            break
+    valid_channel = get_channel(channel_id) is not None
     if valid_channel == False:
         raise InputError(description = "Channel id does not exist")
     return valid_channel
 
 def check_valid_dm(dm_id):
     # Check if channel ID is valid
-    store = data_store.get()
-    valid_dm = False
-    for dm in store['dms']:
-        if dm['dm_id'] == dm_id:
-            valid_dm = True
-            break
+    valid_dm = get_dm(dm_id) is not None
     if valid_dm == False:
         raise InputError(description = "DM id does not exist")
     return valid_dm
 
 def check_channel_access(decode, channel_id):
     # Check if user has access to the channel
-    store = data_store.get()
-    user_access = False
-    for channel in store['channels']:
-        for member in channel['all_members']:
-            if member['u_id'] == decode['u_id']:
-                user_access = True
-                break
+    user_access = check_is_member(decode['u_id'], channel_id)
     if user_access == False and check_valid_channel(channel_id) == True:
             raise AccessError(description = "User does not have access to the channel")
 
 def check_dm_access(decode, dm_id):
-    # Check if user has access to the channel
-    store = data_store.get()
-    user_access = False
-    for dm in store['dms']:
-        for member in dm['members']:
-            if member['u_id'] == decode['u_id']:
-                user_access = True
-                break
+    # Check if user has access to the dm
+    user_access = check_is_dm_member(decode['u_id'], dm_id)
     if user_access == False and check_valid_dm(dm_id) == True:
             raise AccessError(description = "User does not have access to the dm")
 
 def check_messageid_valid(u_id, message_id):
-    store = data_store.get()
+    # Check the message exists in a channel/dm the user is a member of
     message_valid = False
     in_channel = False
     in_dm = False
-    for channel in store['channels']:
-        for member in channel['all_members']:
-            if u_id == member['u_id']:
-                for message in channel['messages']:
-                    if message_id == message['message_id']:
-                        message_valid = True
-                        in_channel = True
-    
-    for dm in store['dms']:
-        for member in dm['members']:
-            if u_id == member['u_id']:
-                for message in dm['messages']:
-                    if message_id == message['message_id']:
-                        message_valid = True
-                        in_dm = True
+    message_return = find_message(message_id)
+    if message_return is not None:
+        kind, conversation, message = message_return
+        if kind == 'channels' and check_is_member(u_id, conversation['channel_id']):
+            message_valid = True
+            in_channel = True
+        if kind == 'dms' and check_is_dm_member(u_id, conversation['dm_id']):
+            message_valid = True
+            in_dm = True
     
     if message_valid == False:
         raise InputError(description = 'Invalid message_id in channel/DM')
         
     return (in_channel, in_dm)
 
-def check_user_is_owner(u_id, in_channel, in_dm):
-    store = data_store.get()
+def check_user_is_owner(u_id, message_id, in_channel, in_dm):
+    # Check if the user owns the channel/dm the message is in
+    kind, conversation, message = find_message(message_id)
     user_is_owner = False
     if in_channel:
-        for channel in store['channels']:
-            for owner in channel['owner_members']:
-                if u_id == owner['u_id']:
-                    user_is_owner = True
+        if u_id in conversation['owner_members']:
+            user_is_owner = True
     if in_dm:
-        for dm in store['dms']:
-            if u_id == dm['owner']['u_id']:
-                user_is_owner = True
+        if u_id == conversation['owner']:
+            user_is_owner = True
     
     return user_is_owner
     
 def check_user_own_message(u_id, message_id, in_channel, in_dm):
-    store = data_store.get()
     user_own_message = False
-    if in_channel:
-        for channel in store['channels']:
-            for message in channel['messages']:
-                if u_id == message['u_id'] and message_id == message['message_id']:
-                    user_own_message = True
-    if in_dm:
-        for dm in store['dms']:
-            for message in dm['messages']:
-                if u_id == message['u_id'] and message_id == message['message_id']:
-                    user_own_message = True
+    if in_channel or in_dm:
+        kind, conversation, message = find_message(message_id)
+        if u_id == message['u_id']:
+            user_own_message = True
                     
     return user_own_message
@@ -1,6 +1,6 @@
 from src.data_store import data_store
 from src.error import InputError, AccessError
-from src.other import check_valid_token
+from src.other import check_valid_token, get_user, get_channel, get_dm, find_message
 
 def notifications_get_v1(token):
     '''
@@ -21,79 +21,68 @@ def notifications_get_v1(token):
     decode = check_valid_token(token)
     notifications = []
     
-    for user in store['users']:
-        if decode['u_id'] == user['u_id']:
-            notifications = user['notifications'][:20]
+    notifications = get_user(decode['u_id'])['notifications'][:20]
     
     return {
         'notifications': notifications
     }
     
 def find_user_handle(u_id):
-    store = data_store.get()
-    
-    for user in store['users']:
-        if u_id == user['u_id']:
-            user_handle = user['handle_str']
-    
-    return user_handle
+    return get_user(u_id)['handle_str']
 
 def update_notification_added_channel(sender_id, receiver_id, channel_id):
     store = data_store.get()
     notification_dict = {}
     sender_handle = find_user_handle(sender_id)
     
-    for channel in store['channels']:
-        if channel_id == channel['channel_id']:
-            break
+    channel = get_channel(channel_id)
     
-    for user in store['users']:
-        if receiver_id == user['u_id']:
-            notification_dict['channel_id'] = channel_id
-            notification_dict['dm_id'] = -1
-            notification_dict['notification_message'] = f"{sender_handle} added you to {channel['name']}"
-            user['notifications'].insert(0, notification_dict)
+    user = get_user(receiver_id)
+    if user is not None:
+        notification_dict['channel_id'] = channel_id
+        notification_dict['dm_id'] = -1
+        notification_dict['notification_message'] = f"{sender_handle} added you to {channel['name']}"
+        user['notifications'].insert(0, notification_dict)
+        data_store.touch('users', user['u_id'])
 
 def update_notification_added_dm(sender_id, receiver_id, dm_id):
     store = data_store.get()
     notification_dict = {}
     sender_handle = find_user_handle(sender_id)
     
-    for dm in store['dms']:
-        if dm_id == dm['dm_id']:
-            break
+    dm = get_dm(dm_id)
     
-    for user in store['users']:
-        if receiver_id == user['u_id']:
-            notification_dict['channel_id'] = -1
-            notification_dict['dm_id'] = dm_id
-            notification_dict['notification_message'] = f"{sender_handle} added you to {dm['name']}"
-            user['notifications'].insert(0, notification_dict)
+    user = get_user(receiver_id)
+    if user is not None:
+        notification_dict['channel_id'] = -1
+        notification_dict['dm_id'] = dm_id
+        notification_dict['notification_message'] = f"{sender_handle} added you to {dm['name']}"
+        user['notifications'].insert(0, notification_dict)
+        data_store.touch('users', user['u_id'])
 
 def update_notification_react(sender_id, message_id):
-    store = data_store.get()
     notification_dict = {}
     sender_handle = find_user_handle(sender_id)
     
-    for channel in store['channels']:
-        for message in channel['messages']:
-            if message_id == message['message_id']:
-                for user in store['users']:
-                    if message['u_id'] == user['u_id']:
-                        notification_dict['channel_id'] = channel['channel_id']
-                        notification_dict['dm_id'] = -1
-                        notification_dict['notification_message'] = f"{sender_handle} reacted to your message in {channel['name']}"
-                        user['notifications'].insert(0, notification_dict)
+    message_return = find_message(message_id)
+    if message_return is None:
+        return
+    kind, conversation, message = message_return
+    
+    # The sender may have been removed since
+    user = get_user(message['u_id'])
+    if user is None:
+        return
     
-    for dm in store['dms']:
-        for message in dm['messages']:
-            if message_id == message['message_id']:
-                for user in store['users']:
-                    if message['u_id'] == user['u_id']:
-                        notification_dict['channel_id'] = -1
-                        notification_dict['dm_id'] = dm['dm_id']
-                        notification_dict['notification_message'] = f"{sender_handle} reacted to your message in {dm['name']}"
-                        user['notifications'].insert(0, notification_dict)
+    if kind == 'channels':
+        notification_dict['channel_id'] = conversation['channel_id']
+        notification_dict['dm_id'] = -1
+    else:
+        notification_dict['channel_id'] = -1
+        notification_dict['dm_id'] = conversation['dm_id']
+    notification_dict['notification_message'] = f"{sender_handle} reacted to your message in {conversation['name']}"
+    user['notifications'].insert(0, notification_dict)
+    data_store.touch('users', user['u_id'])
 
 def update_notification_tagged(sender_id, chat_id, message, in_channel, in_dm):
     store = data_store.get()
@@ -111,48 +100,44 @@ def update_notification_tagged(sender_id, chat_id, message, in_channel, in_dm):
         # When end of the handle is signified by the end of the message
         if index == len(message):
             if in_channel:
-                for channel in store['channels']:
-                    for member in channel['all_members']:
-                        if chat_id == channel['channel_id'] and receiver_handle == member['handle_str']:
-                            notification_dict['channel_id'] = chat_id
-                            notification_dict['dm_id'] = -1
-                            notification_dict['notification_message'] = f"{sender_handle} tagged you in {channel['name']}: {message[:20]}"
-                            # Finding who receiver_handle belongs to
-                            for user in store['users']:
-                                if receiver_handle == user['handle_str']:
-                                    user['notifications'].insert(0, notification_dict)
+                channel = get_channel(chat_id)
+                # Finding who receiver_handle belongs to
+                user = data_store.lookup_user('handle_str', receiver_handle)
+                if user is not None and data_store.is_member('channels', chat_id, user['u_id']):
+                    notification_dict['channel_id'] = chat_id
+                    notification_dict['dm_id'] = -1
+                    notification_dict['notification_message'] = f"{sender_handle} tagged you in {channel['name']}: {message[:20]}"
+                    user['notifications'].insert(0, notification_dict)
+                    data_store.touch('users', user['u_id'])
             elif in_dm:
-                for dm in store['dms']:
-                    for member in dm['members']:
-                        if chat_id == dm['dm_id'] and receiver_handle == member['handle_str']:
-                            notification_dict['channel_id'] = -1
-                            notification_dict['dm_id'] = chat_id
-                            notification_dict['notification_message'] = f"{sender_handle} tagged you in {dm['name']}: {message[:20]}"
-                            # Finding who receiver_handle belongs to
-                            for user in store['users']:
-                                if receiver_handle == user['handle_str']:
-                                    user['notifications'].insert(0, notification_dict)
+                dm = get_dm(chat_id)
+                # Finding who receiver_handle belongs to
+                user = data_store.lookup_user('handle_str', receiver_handle)
+                if user is not None and data_store.is_member('dms', chat_id, user['u_id']):
+                    notification_dict['channel_id'] = -1
+                    notification_dict['dm_id'] = chat_id
+                    notification_dict['notification_message'] = f"{sender_handle} tagged you in {dm['name']}: {message[:20]}"
+                    user['notifications'].insert(0, notification_dict)
+                    data_store.touch('users', user['u_id'])
         # When end of the handle is signified by a non-alphanumeric character
         elif message[index].isalnum() == False:
             if in_channel:
-                for channel in store['channels']:
-                    for member in channel['all_members']:
-                        if chat_id == channel['channel_id'] and receiver_handle == member['handle_str']:
-                            notification_dict['channel_id'] = chat_id
-                            notification_dict['dm_id'] = -1
-                            notification_dict['notification_message'] = f"{sender_handle} tagged you in {channel['name']}: {message[:20]}"
-                            # Finding who receiver_handle belongs to
-                            for user in store['users']:
-                                if receiver_handle == user['handle_str']:
-                                    user['notifications'].insert(0, notification_dict)
+                channel = get_channel(chat_id)
+                # Finding who receiver_handle belongs to
+                user = data_store.lookup_user('handle_str', receiver_handle)
+                if user is not None and data_store.is_member('channels', chat_id, user['u_id']):
+                    notification_dict['channel_id'] = chat_id
+                    notification_dict['dm_id'] = -1
+                    notification_dict['notification_message'] = f"{sender_handle} tagged you in {channel['name']}: {message[:20]}"
+                    user['notifications'].insert(0, notification_dict)
+                    data_store.touch('users', user['u_id'])
             elif in_dm:
-                for dm in store['dms']:
-                    for member in dm['members']:
-                        if chat_id == dm['dm_id'] and receiver_handle == member['handle_str']:
-                            notification_dict['channel_id'] = -1
-                            notification_dict['dm_id'] = chat_id
-                            notification_dict['notification_message'] = f"{sender_handle} tagged you in {dm['name']}: {message[:20]}"
-                            # Finding who receiver_handle belongs to
-                            for user in store['users']:
-                                if receiver_handle == user['handle_str']:
-                                    user['notifications'].insert(0, notification_dict)
+                dm = get_dm(chat_id)
+                # Finding who receiver_handle belongs to
+                user = data_store.lookup_user('handle_str', receiver_handle)
+                if user is not None and data_store.is_member('dms', chat_id, user['u_id']):
+                    notification_dict['channel_id'] = -1
+                    notification_dict['dm_id'] = chat_id
+                    notification_dict['notification_message'] = f"{sender_handle} tagged you in {dm['name']}: {message[:20]}"
+                    user['notifications'].insert(0, notification_dict)
+                    data_store.touch('users', user['u_id'])
@@ -1,12 +1,27 @@
-from src.data_store import data_store
+from src.data_store import data_store, reset_counters, ID_FIELDS
 from src.error import AccessError, InputError
+from src import config
+from src import scheduler
 
+from collections import OrderedDict
 import hashlib
 import jwt
 import json
-SESSION_ID_TRACKER = 0
+import secrets
+import threading
 SECRET = 'F13BCAMEL'
 
+# Payloads of recently decoded tokens, keyed on the token itself and kept in
+# least to most recently used order, see decode_jwt()
+JWT_LOCK = threading.Lock()
+JWT_CACHE = OrderedDict()
+JWT_CACHE_STATS = {'hits': 0, 'misses': 0}
+
+# Message and session ids are handed out from blocks reserved in the store's
+# counters, see next_id()
+ID_LOCK = threading.Lock()
+ID_BLOCKS = {}
+
 def clear_v1():
     store = data_store.get()
     
@@ -15,52 +30,46 @@ def clear_v1():
     store['dms'].clear()
     store['stats'].clear()
     store['codes'].clear()
+    reset_counters(store)
+    
+    with ID_LOCK:
+        ID_BLOCKS.clear()
+    clear_jwt_cache()
+    # Whatever was scheduled was for channels and messages that are gone, and
+    # their ids are about to be handed out again
+    scheduler.clear()
     
     data_store.set(store)
+    data_store.reindex()
+    data_store.touch('clear')
 
     return {
     }
 
 def check_global_owner(token):
-    data = data_store.get()
-    decode = decode_jwt(token)
+    decode = decode_token(token)
     
     global_owner = False
-    for user in data['users']:
-        if user['u_id'] == decode['u_id']:
-            if user['global_owner'] == True:
-                global_owner = True
-            else:
-                global_owner = False
+    user = get_user(decode['u_id'])
+    if user is not None and user['global_owner'] == True:
+        global_owner = True
      
     return global_owner           
             
 def check_is_member(u_id, channel_id):
-    data = data_store.get()
-    
-    for channel in data['channels']:
-        if channel['channel_id'] == channel_id:
-            break
-    
-    is_member = False
-    for member in channel['all_members']:
-        if member['u_id'] == u_id:
-            is_member = True
+    is_member = data_store.is_member('channels', channel_id, u_id)
+                
+    return is_member   
+
+def check_is_dm_member(u_id, dm_id):
+    is_member = data_store.is_member('dms', dm_id, u_id)
                 
     return is_member   
 
 def check_is_member_token(token, channel_id):
-    data = data_store.get()
-    decode = decode_jwt(token)
-    
-    for channel in data['channels']:
-        if channel['channel_id'] == channel_id:
-            break
+    decode = decode_token(token)
     
-    is_member = False
-    for member in channel['all_members']:
-        if member['u_id'] == decode['u_id']:
-            is_member = True
+    is_member = data_store.is_member('channels', channel_id, decode['u_id'])
                 
     return is_member        
     
@@ -70,15 +79,14 @@ def check_valid_token(token):
     if type(token) != str:
         raise AccessError("Invalid User Token") 
     
-    data = data_store.get()
-    decode = decode_jwt(token)
+    try:
+        decode = decode_token(token)
+    except jwt.InvalidTokenError:
+        raise AccessError("Invalid User Token")
     
     valid_user = False
-    for user in data['users']:
-        for sess_id in user['session_id']:
-            if decode['u_id'] == user['u_id'] and decode['session_id'] == sess_id:
-                valid_user = True
-                break
+    if data_store.lookup_session(decode['session_id']) == decode['u_id']:
+        valid_user = True
     
     if valid_user == False:
         raise AccessError("Invalid User Token")
@@ -86,103 +94,227 @@ def check_valid_token(token):
     return decode
 
 def check_valid_id(u_id):
-    data = data_store.get()
-    valid_user = False
-    for user in data['users']:
-        if u_id == user['u_id']:
-            valid_user = True
-            
-    return valid_user
+    return get_user(u_id) is not None
+
+def get_user(u_id):
+    # Finds the user with the given u_id, None if there isn't one
+    return data_store.lookup('users', u_id)
+
+def get_channel(channel_id):
+    # Finds the channel with the given channel_id, None if there isn't one
+    return data_store.lookup('channels', channel_id)
+
+def get_dm(dm_id):
+    # Finds the dm with the given dm_id, None if there isn't one
+    return data_store.lookup('dms', dm_id)
+
+def joined_channels(u_id):
+    # The channels the user is a member of, in the order they were made
+    return [get_channel(channel_id) for channel_id in sorted(data_store.joined('channels', u_id))]
+
+def joined_dms(u_id):
+    # The dms the user is a member of, in the order they were made
+    return [get_dm(dm_id) for dm_id in sorted(data_store.joined('dms', u_id))]
+
+def user_details(u_id):
+    # The details of a user that other users are shown, eg. as a channel member
+    user = get_user(u_id)
+    return {
+        'u_id': user['u_id'],
+        'email': user['email'],
+        'name_first': user['name_first'],
+        'name_last': user['name_last'],
+        'handle_str': user['handle_str'],
+        'profile_img_url': user['profile_img_url'],
+    }
 
 def check_valid_channel_id(channel_id):
-    data = data_store.get()
-    valid_channel = False
-    for channel in data['channels']:
-        if channel['channel_id'] == channel_id:
-            valid_channel = True
-    return valid_channel    
+    return get_channel(channel_id) is not None
 
 def check_get_channel(channel_id): 
-    data = data_store.get()
-    for channel in data['channels']:
-        if channel['channel_id'] == channel_id:
-            break
-            
-    return channel
+    return get_channel(channel_id)
         
 def hashing(string):
     # Hashes the input string with sha256, used to encrypt password
     return hashlib.sha256(string.encode()).hexdigest()
     
 def generate_session_id():
-    global SESSION_ID_TRACKER
-    SESSION_ID_TRACKER += 1
-    return SESSION_ID_TRACKER
+    # Session ids are unique across all users and never reused, including
+    # after a restart
+    return next_id('session_id')
+
+def count_live_sessions():
+    # The number of sessions that are logged in, across all users
+    return data_store.session_count()
     
+def create_token(user, session_id):
+    # Issue the token for a new session of user, in config.token_format
+    if config.token_format == 'opaque':
+        token = secrets.token_urlsafe(config.opaque_token_bytes)
+        data_store.add_token(user, token, session_id)
+        return token
+    return create_jwt(user['u_id'], session_id)
+
+def decode_token(token):
+    # The {'u_id', 'session_id'} a token was issued for. Opaque tokens are a
+    # single lookup; anything else is treated as a JWT, so tokens issued
+    # before config.token_format was changed keep working.
+    session = data_store.lookup_token(token) if type(token) == str else None
+    if session is not None:
+        return {'u_id': session[0], 'session_id': session[1]}
+    return decode_jwt(token)
+
 def create_jwt(u_id, session_id):
     # Generate a JWT 
     return jwt.encode({'u_id': u_id, 'session_id': session_id}, SECRET, algorithm='HS256')
 
 def decode_jwt(encoded_jwt):
-    # Decode a given JWT
-    return jwt.decode(encoded_jwt, SECRET, algorithms=['HS256'])
+    # Decode a given JWT. The payloads of the last config.jwt_cache_size
+    # tokens are cached so a token that is used again isn't verified again.
+    # Callers get their own copy of the payload.
+    if type(encoded_jwt) != str:
+        return jwt.decode(encoded_jwt, SECRET, algorithms=['HS256'])
+    
+    with JWT_LOCK:
+        payload = JWT_CACHE.get(encoded_jwt)
+        if payload is not None:
+            JWT_CACHE.move_to_end(encoded_jwt)
+            JWT_CACHE_STATS['hits'] += 1
+            return dict(payload)
+        JWT_CACHE_STATS['misses'] += 1
+    
+    # Invalid tokens raise here and are never cached
+    payload = jwt.decode(encoded_jwt, SECRET, algorithms=['HS256'])
+    
+    with JWT_LOCK:
+        JWT_CACHE[encoded_jwt] = payload
+        JWT_CACHE.move_to_end(encoded_jwt)
+        while len(JWT_CACHE) > max(0, config.jwt_cache_size):
+            JWT_CACHE.popitem(last=False)
+    
+    return dict(payload)
+
+def forget_token(encoded_jwt):
+    # Drop a token from the decoded token cache, eg. when it is logged out
+    with JWT_LOCK:
+        JWT_CACHE.pop(encoded_jwt, None)
+
+def forget_user_tokens(u_id):
+    # Drop every cached token belonging to a user, eg. when they are logged
+    # out of all their sessions
+    with JWT_LOCK:
+        for encoded_jwt in [encoded_jwt for encoded_jwt, payload in JWT_CACHE.items()
+                            if payload.get('u_id') == u_id]:
+            del JWT_CACHE[encoded_jwt]
+
+def clear_jwt_cache():
+    with JWT_LOCK:
+        JWT_CACHE.clear()
+        JWT_CACHE_STATS['hits'] = 0
+        JWT_CACHE_STATS['misses'] = 0
+
+def jwt_cache_stats():
+    # Hits, misses and the number of tokens currently in the decoded token cache
+    with JWT_LOCK:
+        return {
+            'hits': JWT_CACHE_STATS['hits'],
+            'misses': JWT_CACHE_STATS['misses'],
+            'size': len(JWT_CACHE),
+        }
 
 def generate_message_id():
-    store = data_store.get()
+    # Returns a message_id that has never been used before
+    return next_id('message_id')
 
-    message_id = 1
-    
-    for channel in store['channels']:
-        message_id += len(channel['messages'])
+def generate_dm_id():
+    # Returns a dm_id that has never been used before, even by a dm that has
+    # since been removed
+    return next_id('dm_id')
+
+def next_id(counter):
+    # Returns the next id from one of the store's counters ('message_id',
+    # 'session_id' or 'dm_id'). The store records the highest id reserved so
+    # far; ids are reserved config.id_block at a time, so the counter only has
+    # to be saved once per block. Ids left in a block when the server stops are
+    # skipped, never reused.
+    with ID_LOCK:
+        block = ID_BLOCKS.get(counter)
+        if block is None or block['next'] >= block['limit']:
+            counters = data_store.get()['counters']
+            block = {'next': counters[counter] + 1}
+            counters[counter] += max(1, config.id_block)
+            block['limit'] = counters[counter] + 1
+            ID_BLOCKS[counter] = block
+            data_store.touch('counters')
         
-    for dm in store['dms']:
-        message_id += len(dm['messages'])
+        new_id = block['next']
+        block['next'] += 1
     
-    return message_id
+    return new_id
 
-def search_message(message_id):
+def find_message(message_id):
     # Finds a message given an message_id
-    # Returns the message , index of the dm or channel in channel_list
-    # or dm_list and whether it is a channel or dm
-    # 0 = channel, 1 = dm
-    
-    store = data_store.get()
-    index = 0
-    for channel in store['channels']:
-        index += 1
-        m_index = 0
-        for message in channel['messages']:
-            m_index += 1
-            if message_id == message['message_id']:
-                return True, index, 0, m_index           
-    index = 0      
-    for dm in store['dms']:
-        index += 1
-        m_index = 0
-        for message in dm['messages']:
-            m_index += 1
-            if message_id == message['message_id']:
-                return True, index, 1, m_index
-    # Returns false if there exist no message with id
-    return False, 0, 0, 0      
-    
-def reaction_current_user(user_id):
-    # When user signs in or registers update what the react button would
-    # look like for them ie unlit when they havent react yet or lit when they
-    # have
-    store = data_store.get()
-    for channel in store['channels']:
-        for message in channel['messages']:
-                if user_id in message['reacts'][0]['u_ids']:
-                    message['reacts'][0]['is_this_user_reacted'] = True
-                else:
-                    message['reacts'][0]['is_this_user_reacted'] = False
-    for dm in store['dms']:
-        for message in dm['messages']:
-                if user_id in message['reacts'][0]['u_ids']:
-                    message['reacts'][0]['is_this_user_reacted'] = True
-                else:
-                    message['reacts'][0]['is_this_user_reacted'] = False
-    data_store.set(store)
+    # Returns the kind of conversation it is in ('channels' or 'dms'), the
+    # channel or dm itself and the message, or None if there is no such message
+    location = data_store.lookup_message(message_id)
+    if location is None:
+        return None
+    kind, conversation_id, message = location
+    return kind, data_store.lookup(kind, conversation_id), message
     
-    return True
+def newest_first(messages, start, count):
+    # Up to count messages, newest first, skipping the start newest ones.
+    # Conversations keep their messages oldest first, so this is a slice from
+    # the end and costs the same however far back start is.
+    stop = len(messages) - start
+    return messages[max(0, stop - count):stop][::-1]
+
+def messages_from_cursor(kind, conversation, before_message_id, after_message_id, count):
+    # Up to count messages, newest first, that are older than
+    # before_message_id or newer than after_message_id, and the cursor for
+    # the page after them. Going back, the cursor is the oldest message
+    # returned, or -1 once the first message has been reached. Going
+    # forward it's the newest message returned, or after_message_id again if
+    # there is nothing newer yet, so it can be polled. The page is found from
+    # where the cursor is rather than counting from the newest message, so it
+    # costs the same however far back it is and doesn't shift when messages
+    # are sent in the meantime.
+    if before_message_id is not None and after_message_id is not None:
+        raise InputError(description="Only one of before_message_id and after_message_id can be given")
+    cursor = before_message_id if before_message_id is not None else after_message_id
+    position = data_store.message_position(kind, conversation[ID_FIELDS[kind]], cursor)
+    if position is None:
+        raise InputError(description="Cursor does not refer to a message in this conversation")
+
+    messages = conversation['messages']
+    if before_message_id is not None:
+        first = max(0, position - count)
+        page = messages[first:position]
+        older = first > 0
+    else:
+        page = messages[position + 1:position + 1 + count]
+
+    # Anything that isn't a message has no id to carry on from
+    ids = [message['message_id'] for message in page if isinstance(message, dict)]
+    if before_message_id is not None:
+        next_cursor = ids[0] if older and ids else -1
+    else:
+        next_cursor = ids[-1] if ids else after_message_id
+    return page[::-1], next_cursor
+
+def message_view(message, u_id):
+    # The message as u_id sees it: a copy with is_this_user_reacted worked out
+    # for them, ie. the react button is lit when they have reacted and unlit
+    # when they haven't. Anything that isn't a message is returned as it is.
+    if not isinstance(message, dict):
+        return message
+    view = dict(message)
+    view['reacts'] = [
+        {
+            'react_id': react['react_id'],
+            'u_ids': react['u_ids'],
+            'is_this_user_reacted': u_id in react['u_ids'],
+        }
+        for react in message['reacts']
+    ]
+    return view
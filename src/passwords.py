@@ -0,0 +1,136 @@
+'''
+passwords.py
+
+Hashes and checks passwords with a deliberately slow key derivation function
+(scrypt or PBKDF2, chosen with config.password_kdf). Hashing runs in a pool
+of config.password_workers processes, so the request threads waiting on it
+don't hold the GIL and logins use every core. The server calls start() before
+any other threads are running, so the workers are forked cleanly. Where fork
+isn't available passwords are hashed on the request threads, since spawned
+workers would import the server module and load the store again.
+
+Stored hashes record everything needed to check them:
+
+    scrypt$<n>$<r>$<p>$<salt>$<key>
+    pbkdf2_sha256$<iterations>$<salt>$<key>
+
+Passwords saved before this were a bare sha256 hex digest. They are still
+accepted, and like hashes made with different settings they are replaced with
+one made with the current settings the next time the user logs in.
+'''
+
+from src import config
+
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import hashlib
+import hmac
+import multiprocessing
+import os
+import threading
+
+SALT_BYTES = 16
+
+POOL = None
+POOL_LOCK = threading.Lock()
+
+def hash_password(password):
+    '''
+    Hash password for storing, with the current settings
+    '''
+    return run(make_hash, password, current_settings())
+
+def check_password(password, stored):
+    '''
+    Whether password matches the stored hash, and the hash to store in its
+    place if it was made with old settings (None if it's up to date)
+    '''
+    return run(verify, password, stored, current_settings())
+
+def start():
+    '''
+    Start the worker processes now rather than on the first request
+    '''
+    if use_pool():
+        get_pool().submit(int).result()
+
+def current_settings():
+    # The settings new hashes are made with, passed to the workers since
+    # they don't see changes made to config after they start
+    if config.password_kdf == 'scrypt':
+        return ('scrypt', config.scrypt_n, config.scrypt_r, config.scrypt_p)
+    if config.password_kdf == 'pbkdf2_sha256':
+        return ('pbkdf2_sha256', config.pbkdf2_iterations)
+    raise ValueError(f'Unknown password_kdf {config.password_kdf}')
+
+def use_pool():
+    return config.password_workers != 0 and hasattr(os, 'fork')
+
+def run(function, *args):
+    # Run function in the pool, or in this thread if there are no workers
+    if not use_pool():
+        return function(*args)
+    try:
+        return get_pool().submit(function, *args).result()
+    except BrokenProcessPool:
+        # A worker died (eg. it was killed), start a new pool next time
+        shutdown()
+        return function(*args)
+
+def get_pool():
+    global POOL
+    with POOL_LOCK:
+        if POOL is None:
+            # Forked workers are all started together when the pool is first
+            # used, see start()
+            POOL = ProcessPoolExecutor(
+                max_workers=config.password_workers or os.cpu_count(),
+                mp_context=multiprocessing.get_context('fork'),
+            )
+        return POOL
+
+def shutdown():
+    # Stop the workers, a new pool is started when one is next needed
+    global POOL
+    with POOL_LOCK:
+        pool, POOL = POOL, None
+    if pool is not None:
+        pool.shutdown(wait=False)
+
+# The functions below run in the workers
+
+def make_hash(password, settings, salt=None):
+    if salt is None:
+        salt = os.urandom(SALT_BYTES)
+    key = derive(password, salt, settings)
+    return '$'.join([str(setting) for setting in settings] + [salt.hex(), key.hex()])
+
+def verify(password, stored, settings):
+    fields = stored.split('$')
+    if len(fields) == 1:
+        # A legacy unsalted sha256 hash
+        matches = hmac.compare_digest(hashlib.sha256(password.encode()).hexdigest(), stored)
+        stored_settings = None
+    else:
+        stored_settings = parse_settings(fields[:-2])
+        salt = bytes.fromhex(fields[-2])
+        matches = hmac.compare_digest(derive(password, salt, stored_settings).hex(), fields[-1])
+
+    if matches and stored_settings != settings:
+        return True, make_hash(password, settings)
+    return matches, None
+
+def parse_settings(fields):
+    return (fields[0],) + tuple(int(field) for field in fields[1:])
+
+def derive(password, salt, settings):
+    if settings[0] == 'scrypt':
+        _, n, r, p = settings
+        # scrypt needs about 128 * r * (n + p) bytes, more than the default
+        # limit once n is raised
+        return hashlib.scrypt(password.encode(), salt=salt, n=n, r=r, p=p,
+                              maxmem=128 * r * (n + p + 2) + 1024 * 1024)
+    if settings[0] == 'pbkdf2_sha256':
+        _, iterations = settings
+        return hashlib.pbkdf2_hmac('sha256', password.encode(), salt, iterations)
+    raise ValueError(f'Unknown password hash {settings[0]}')
@@ -0,0 +1,691 @@
+'''
+persistence.py
+
+Saves the data store to disk and loads it back when the server starts.
+
+Rather than dumping the whole store every second, handlers mark the records
+they change with data_store.touch(). commit() writes each of those records to
+an append-only log (one JSON object per line), so the cost of saving depends
+on how much was written rather than on the size of the store. Once the log
+grows past config.wal_snapshot_bytes, the whole store is written out as a
+snapshot and the log starts again from empty.
+
+Commits are made by a single flusher thread (see start_flusher()), which
+sleeps until something is touched and then waits up to config.flush_delay so
+that a burst of writes goes out as one append.
+
+Snapshots are JSON, or the faster loading binary format in snapshot_format.py
+with config.snapshot_format = 'binary'. They are either written inline or, with config.snapshot_mode = 'fork',
+by a forked child process working on a copy-on-write image of the store, so
+request threads aren't held up while a large store is serialised.
+
+At startup, load() reads the last snapshot and replays the log over it.
+
+config.storage_engine = 'sqlite' swaps the log and snapshots for a database
+(see sqlite_store.py), which is given the same records that would have gone
+into the log. config.storage_engine = 'sharded' saves each channel and dm to
+its own file instead (see shard_store.py) and only rewrites the ones touched.
+
+Log records look like:
+
+    {'op': 'clear'}
+    {'op': 'put', 'table': 'users', 'key': 1, 'value': {...}}
+    {'op': 'put', 'table': 'messages', 'key': 4, 'parent': ['channels', 1], 'value': {...}}
+    {'op': 'put', 'table': 'history', 'key': 7, 'parent': ['users', 1, 'notifications'], 'value': {...}}
+
+A value of None means the record was deleted. Channels and dms are logged
+without their 'messages', which are logged one message at a time instead.
+Likewise users and the workspace stats are logged without their histories
+(data_store.HISTORY_FIELDS); each entry added to one is logged on its own,
+keyed by its position in the history counting from the oldest.
+'''
+
+from src.data_store import data_store, initial_object, reset_counters
+from src.data_store import messages_oldest_first, SCHEMA_VERSION, HISTORY_FIELDS
+from src.data_store import history, new_history, add_history, without_history, with_history
+from src.data_store import history_lengths
+from src import config
+from src import sqlite_store
+from src import shard_store
+from src import snapshot_format
+
+import atexit
+import gc
+import json
+import os
+import shutil
+import threading
+import time
+
+# Serialises commits and snapshots, so a snapshot never races a log append
+LOCK = threading.RLock()
+
+WAL = None
+PREVIOUS_WAL_FILE = config.wal_file + '.1'
+
+FLUSHER = None
+
+# How many entries of each history are in the log or the snapshot already,
+# by (table, owner, path), so only the ones after them are logged. It may be
+# too low but never too high: an entry logged twice is only added once, since
+# its record says where in the history it goes.
+LOGGED_HISTORY = {}
+
+# pid of the process writing a background snapshot, and whether another
+# snapshot was asked for while it was running
+SNAPSHOT_CHILD = None
+SNAPSHOT_PENDING = False
+
+# Figures for the most recent snapshot
+SNAPSHOT_STATS = {
+    'count': 0,
+    'mode': None,
+    'duration': 0,
+    'pause': 0,
+    'size': 0,
+    'time_stamp': None,
+}
+
+ID_FIELDS = {
+    'users': 'u_id',
+    'channels': 'channel_id',
+    'dms': 'dm_id',
+}
+
+def load():
+    '''
+    Load the last snapshot, replay the log over it and put the result in
+    the data store. If the log had anything in it, a new snapshot is taken
+    straight away so the next start doesn't have to replay it again.
+
+    With config.storage_engine = 'sqlite' or 'sharded' the store is read
+    from the database or the shard files instead.
+
+    Stores saved by older versions (before membership was kept as u_ids, or
+    before the id counters) are upgraded as they are loaded, and
+    saved again in the new form.
+    '''
+    if config.storage_engine in ('sqlite', 'sharded'):
+        with LOCK:
+            if config.storage_engine == 'sqlite':
+                store = sqlite_store.load_store()
+            else:
+                store = shard_store.load_store()
+        upgraded = upgrade_store(store)
+        data_store.set(store)
+        data_store.pop_changes()
+        if upgraded:
+            data_store.touch('store')
+        return store
+
+    store = read_snapshot()
+
+    # The previous log is left behind if the server stopped while a
+    # background snapshot was being written
+    indexes = replay_indexes(store)
+    replayed = replay(store, PREVIOUS_WAL_FILE, indexes)
+    replayed += replay(store, config.wal_file, indexes)
+    upgraded = upgrade_store(store)
+    data_store.set(store)
+    # Everything in store is already on disk
+    data_store.pop_changes()
+
+    with LOCK:
+        LOGGED_HISTORY.clear()
+        LOGGED_HISTORY.update(history_lengths(store))
+        if replayed > 0 or upgraded:
+            inline_snapshot()
+        else:
+            open_wal()
+
+    return store
+
+def upgrade_store(store):
+    # Bring a store saved by an older version up to date. Returns whether
+    # anything had to be changed.
+    #
+    # Channel and dm members used to be stored as copies of the user
+    # dictionaries, replace them with their u_ids
+    def to_u_id(member):
+        return member['u_id'] if isinstance(member, dict) else member
+
+    upgraded = False
+    for channel in store['channels']:
+        for field in ('owner_members', 'all_members'):
+            if any(isinstance(member, dict) for member in channel[field]):
+                channel[field] = [to_u_id(member) for member in channel[field]]
+                upgraded = True
+    for dm in store['dms']:
+        if any(isinstance(member, dict) for member in dm['members']):
+            dm['members'] = [to_u_id(member) for member in dm['members']]
+            upgraded = True
+        if isinstance(dm['owner'], dict):
+            dm['owner'] = dm['owner']['u_id']
+            upgraded = True
+
+    # Message, session and dm ids used to be worked out as they were needed,
+    # start the counters after the highest ones in use
+    counters = store.setdefault('counters', {})
+    if 'message_id' not in counters:
+        counters['message_id'] = max([
+            message['message_id']
+            for kind in ('channels', 'dms')
+            for conversation in store[kind]
+            for message in conversation['messages']
+            if isinstance(message, dict)
+        ], default=0)
+        upgraded = True
+    if 'session_id' not in counters:
+        counters['session_id'] = max([
+            session_id for user in store['users'] for session_id in user['session_id']
+        ], default=0)
+        upgraded = True
+    if 'dm_id' not in counters:
+        counters['dm_id'] = max([dm['dm_id'] for dm in store['dms']], default=0)
+        upgraded = True
+
+    # Reset codes used to last forever, give them until config.reset_code_ttl
+    # from now
+    now = int(time.time())
+    for code in store['codes']:
+        if 'time_created' not in code:
+            code['time_created'] = now
+            upgraded = True
+
+    # Messages couldn't be scheduled before, so there is nothing waiting
+    for kind in ('channels', 'dms'):
+        for conversation in store[kind]:
+            if 'scheduled' not in conversation:
+                conversation['scheduled'] = []
+                upgraded = True
+
+    # Standups didn't record who started them, send their messages as the
+    # channel's first owner. Their buffered messages didn't record the
+    # sender's handle or count their size either.
+    handles = {user['u_id']: user['handle_str'] for user in store['users']}
+    for channel in store['channels']:
+        standup = channel['standup']
+        if standup != {} and 'u_id' not in standup:
+            owners = channel['owner_members']
+            standup['u_id'] = owners[0] if owners else None
+            upgraded = True
+        if standup != {} and 'bytes' not in standup:
+            for message in standup['messages']:
+                message['handle_str'] = handles.get(message['u_id'], '')
+            standup['bytes'] = sum(
+                len(f"{message['handle_str']}: {message['message']}".encode()) + 1
+                for message in standup['messages']
+            )
+            upgraded = True
+
+    # Messages used to be kept newest first
+    if not messages_oldest_first(store):
+        for kind in ('channels', 'dms'):
+            for conversation in store[kind]:
+                conversation['messages'].reverse()
+        counters['schema_version'] = SCHEMA_VERSION
+        upgraded = True
+    return upgraded
+
+def read_snapshot():
+    # Falls back to the JSON snapshot the first time the binary format is used
+    if config.snapshot_format == 'binary' and os.path.exists(config.binary_snapshot_file):
+        return snapshot_format.load_file(config.binary_snapshot_file)
+
+    if not os.path.exists(config.snapshot_file):
+        return json.loads(json.dumps(initial_object))
+
+    # The collector only slows down building a store that has no cycles
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        with open(config.snapshot_file, 'r') as FILE:
+            return json.load(FILE)
+    finally:
+        if gc_enabled:
+            gc.enable()
+
+def snapshot_path():
+    if config.snapshot_format == 'binary':
+        return config.binary_snapshot_file
+    return config.snapshot_file
+
+def commit():
+    '''
+    Append every record touched since the last commit to the log (or write
+    them to the database or shard files with the sqlite and sharded
+    engines). Returns the number of records written.
+    '''
+    with LOCK:
+        changes = data_store.pop_changes()
+        if changes == {}:
+            return 0
+
+        try:
+            return write_changes(data_store.get(), changes)
+        except Exception:
+            # Put the changes back so the next commit writes them. An append
+            # that failed part way may have left half a line at the end of
+            # the log (or the shards' history file), which would stop replay
+            # there, so everything is written out in full next time.
+            data_store.restore_changes(changes)
+            if config.storage_engine != 'sqlite':
+                data_store.touch('store')
+            raise
+
+def write_changes(store, changes):
+    # Write the changes taken from the data store with the configured engine
+    if config.storage_engine == 'sqlite':
+        if ('store', None, None) in changes:
+            sqlite_store.import_store(store)
+        else:
+            sqlite_store.write_records(
+                make_record(store, table, key, parent) for table, key, parent in changes
+            )
+        return len(changes)
+
+    if config.storage_engine == 'sharded':
+        shard_store.write_changes(store, changes)
+        return len(changes)
+
+    if ('store', None, None) in changes:
+        snapshot()
+        # A forked snapshot may not have every entry that's in the store
+        # by now, so count from nothing
+        LOGGED_HISTORY.clear()
+        return len(changes)
+
+    # A clear is always the first change, the histories are logged again
+    # from the start after it
+    cleared = ('clear', None, None) in changes
+    logged = {}
+    lines = []
+    for table, key, parent in changes:
+        for record in log_records(store, table, key, parent, logged, cleared):
+            lines.append(json.dumps(record) + '\n')
+
+    if WAL is None:
+        open_wal()
+    WAL.write(''.join(lines))
+    WAL.flush()
+    if config.wal_fsync:
+        os.fsync(WAL.fileno())
+
+    if cleared:
+        LOGGED_HISTORY.clear()
+    LOGGED_HISTORY.update(logged)
+
+    if WAL.tell() > config.wal_snapshot_bytes:
+        snapshot()
+
+    return len(lines)
+
+def start_flusher():
+    '''
+    Start the thread that commits changes in the background. Only one is ever
+    started, and whatever is still pending is committed when the server exits.
+    '''
+    global FLUSHER
+    if FLUSHER is not None:
+        return FLUSHER
+
+    FLUSHER = threading.Thread(target=flush_loop, name='persistence-flusher', daemon=True)
+    FLUSHER.start()
+    atexit.register(commit)
+
+    return FLUSHER
+
+def flush_loop():
+    while True:
+        data_store.wait_until_dirty()
+        # Let the rest of a burst of writes arrive so it's committed in one go
+        time.sleep(config.flush_delay)
+        try:
+            commit()
+        except Exception as error:
+            # Keep the thread alive, commit() put the changes back so the
+            # next one writes them
+            print('Failed to save data store:', error)
+
+def snapshot():
+    '''
+    Write the whole store to the snapshot file, using the method chosen by
+    config.snapshot_mode. Once the snapshot is on disk the log it replaces
+    is thrown away.
+    '''
+    with LOCK:
+        if config.snapshot_mode == 'fork' and hasattr(os, 'fork'):
+            fork_snapshot()
+        else:
+            inline_snapshot()
+
+def inline_snapshot():
+    # Serialise the store in this process. json.dumps encodes in a single call
+    # without releasing the GIL, so the store can't change size underneath it,
+    # but every other thread waits until it's done.
+    global SNAPSHOT_PENDING
+    with LOCK:
+        if SNAPSHOT_CHILD is not None:
+            # A forked snapshot would overwrite this one with an older copy
+            SNAPSHOT_PENDING = True
+            return
+
+        start = time.time()
+        write_snapshot(data_store.get())
+        truncate_wal()
+        if os.path.exists(PREVIOUS_WAL_FILE):
+            os.remove(PREVIOUS_WAL_FILE)
+        record_snapshot('inline', time.time() - start, 0)
+
+def fork_snapshot():
+    '''
+    Snapshot in the background, BGSAVE style. The child process gets a
+    copy-on-write image of the store frozen at the moment of the fork, so it
+    can serialise it while request threads carry on changing the original.
+
+    The log is rotated at the same moment: changes made before the fork are
+    in the old log (and the snapshot), changes made after are in the new one.
+    The old log is only deleted once the child has finished writing.
+    '''
+    global SNAPSHOT_CHILD, SNAPSHOT_PENDING
+    with LOCK:
+        if SNAPSHOT_CHILD is not None:
+            SNAPSHOT_PENDING = True
+            return
+        SNAPSHOT_PENDING = False
+
+        rotate_wal()
+
+        start = time.time()
+        pid = os.fork()
+        if pid == 0:
+            # Child, skip atexit handlers since they belong to the server
+            status = 1
+            try:
+                write_snapshot(data_store.get())
+                status = 0
+            finally:
+                os._exit(status)
+
+        fork_time = time.time() - start
+        open_wal()
+
+        SNAPSHOT_CHILD = pid
+        threading.Thread(target=wait_for_snapshot, args=[pid, start, fork_time],
+            name='persistence-snapshot', daemon=True).start()
+
+def wait_for_snapshot(pid, start, fork_time):
+    global SNAPSHOT_CHILD
+    _, status = os.waitpid(pid, 0)
+
+    with LOCK:
+        SNAPSHOT_CHILD = None
+        if status == 0:
+            if os.path.exists(PREVIOUS_WAL_FILE):
+                os.remove(PREVIOUS_WAL_FILE)
+            record_snapshot('fork', time.time() - start, fork_time)
+        else:
+            # Keep the old log, it's replayed at startup and merged into the
+            # next rotation
+            print('Background snapshot failed with status', status)
+
+        if SNAPSHOT_PENDING:
+            snapshot()
+
+def write_snapshot(store):
+    tmp_file = snapshot_path() + '.tmp'
+
+    if config.snapshot_format == 'binary':
+        with open(tmp_file, 'wb') as FILE:
+            snapshot_format.write(store, FILE)
+            FILE.flush()
+            os.fsync(FILE.fileno())
+    else:
+        data = json.dumps(store)
+        with open(tmp_file, 'w') as FILE:
+            FILE.write(data)
+            FILE.flush()
+            os.fsync(FILE.fileno())
+
+    os.replace(tmp_file, snapshot_path())
+
+def record_snapshot(mode, duration, pause):
+    # Keep the figures for the last snapshot and report them
+    SNAPSHOT_STATS['mode'] = mode
+    SNAPSHOT_STATS['duration'] = duration
+    SNAPSHOT_STATS['pause'] = pause
+    SNAPSHOT_STATS['size'] = os.path.getsize(snapshot_path())
+    SNAPSHOT_STATS['time_stamp'] = int(time.time())
+    SNAPSHOT_STATS['count'] += 1
+
+    print(f"Saved {mode} snapshot: {SNAPSHOT_STATS['size']} bytes in {duration:.3f}s "
+          f"(server paused {pause:.3f}s)")
+
+def open_wal():
+    global WAL
+    WAL = open(config.wal_file, 'a')
+
+def truncate_wal():
+    global WAL
+    if WAL is not None:
+        WAL.close()
+    WAL = open(config.wal_file, 'w')
+
+def rotate_wal():
+    # Move the current log out of the way so a new one can be started. If an
+    # earlier snapshot failed its log is still there, so add this one to it.
+    global WAL
+    if WAL is not None:
+        WAL.close()
+        WAL = None
+
+    if not os.path.exists(config.wal_file):
+        return
+    if os.path.exists(PREVIOUS_WAL_FILE):
+        with open(config.wal_file, 'r') as SOURCE, open(PREVIOUS_WAL_FILE, 'a') as TARGET:
+            shutil.copyfileobj(SOURCE, TARGET)
+        os.remove(config.wal_file)
+    else:
+        os.replace(config.wal_file, PREVIOUS_WAL_FILE)
+
+############################# LOG RECORD HELPERS ##############################
+# Build the log record for a touched record from its current value in the store
+def make_record(store, table, key, parent):
+    if table == 'clear':
+        return {'op': 'clear'}
+
+    record = {'op': 'put', 'table': table, 'key': key}
+
+    if table in ('stats', 'codes', 'counters'):
+        record['value'] = store[table]
+    elif table == 'messages':
+        record['parent'] = list(parent)
+        location = data_store.lookup_message(key)
+        record['value'] = None
+        if location is not None and tuple(location[:2]) == tuple(parent):
+            record['value'] = location[2]
+        else:
+            # Ids haven't always been unique, so the index may point at a
+            # different message with the same id
+            conversation = data_store.lookup(parent[0], parent[1])
+            if conversation is not None:
+                record['value'] = find_message(conversation, key)
+    else:
+        value = data_store.lookup(table, key)
+        if value is not None and 'messages' in value:
+            value = {field: value[field] for field in value if field != 'messages'}
+        record['value'] = value
+
+    return record
+
+# The log records for a touched record. Users and the workspace stats are
+# logged without their histories, followed by a record for each history
+# entry that isn't in the log yet; logged collects the new counts.
+def log_records(store, table, key, parent, logged, cleared):
+    record = make_record(store, table, key, parent)
+    if table not in HISTORY_FIELDS or record['value'] is None:
+        return [record]
+
+    if table == 'users':
+        owners = [(key, record['value'])]
+        record['value'] = without_history('users', record['value'])
+    else:
+        owners = list(enumerate(record['value']))
+        record['value'] = [without_history('stats', stats) for stats in record['value']]
+
+    records = [record]
+    for owner, value in owners:
+        for path in HISTORY_FIELDS[table]:
+            position = (table, owner, path)
+            count = logged.get(position, 0 if cleared else LOGGED_HISTORY.get(position, 0))
+            entries = new_history(value, path, count)
+            for offset, entry in enumerate(entries):
+                records.append({
+                    'op': 'put',
+                    'table': 'history',
+                    'key': count + offset,
+                    'parent': [table, owner, *path],
+                    'value': entry,
+                })
+            logged[position] = count + len(entries)
+    return records
+
+def find_message(conversation, message_id):
+    for message in conversation['messages']:
+        if isinstance(message, dict) and message['message_id'] == message_id:
+            return message
+    return None
+
+################################ LOG REPLAY ###################################
+# Apply every record in the log to store, returns the number of records applied.
+# indexes are the store's records by id (see replay_indexes()), kept up to date
+# as records are applied so a log can be replayed after another one.
+def replay(store, filename, indexes=None):
+    if not os.path.exists(filename):
+        return 0
+    if indexes is None:
+        indexes = replay_indexes(store)
+
+    applied = 0
+    with open(filename, 'r') as FILE:
+        for line in FILE:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # The last line is cut short if the server died mid-write
+                break
+            apply_record(store, record, indexes)
+            applied += 1
+
+    return applied
+
+def replay_indexes(store):
+    # id -> record for users, channels and dms, and (kind, conversation id) ->
+    # message_id -> message, so applying a record doesn't have to search the
+    # store. The store isn't in data_store yet, so its indexes can't be used.
+    # Ids haven't always been unique, the first record with an id wins.
+    indexes = {'messages': {}}
+    for table, id_field in ID_FIELDS.items():
+        indexes[table] = {}
+        for record in store[table]:
+            indexes[table].setdefault(record[id_field], record)
+    for kind in ('channels', 'dms'):
+        for conversation in store[kind]:
+            index_messages(indexes, kind, conversation)
+    return indexes
+
+def index_messages(indexes, kind, conversation):
+    messages = indexes['messages'].setdefault((kind, conversation[ID_FIELDS[kind]]), {})
+    for message in conversation['messages']:
+        if isinstance(message, dict):
+            messages.setdefault(message['message_id'], message)
+
+def apply_record(store, record, indexes):
+    if record['op'] == 'clear':
+        for table in store:
+            if table != 'counters':
+                store[table].clear()
+        reset_counters(store)
+        for table in indexes:
+            indexes[table].clear()
+        return
+
+    table = record['table']
+    value = record['value']
+
+    if table == 'stats':
+        # Logged without their histories, see log_records()
+        previous = list(store['stats'])
+        store['stats'][:] = [
+            with_history('stats', stats, previous[position] if position < len(previous) else None)
+            for position, stats in enumerate(value)
+        ]
+
+    elif table == 'codes':
+        store[table][:] = value
+
+    elif table == 'history':
+        owner_table, owner, *path = record['parent']
+        path = tuple(path)
+        if owner_table == 'users':
+            owner = indexes['users'].get(owner)
+        else:
+            owner = store['stats'][owner] if owner < len(store['stats']) else None
+        # Entries already in the snapshot may be logged again
+        if owner is not None and record['key'] >= len(history(owner, path)):
+            add_history(owner, path, [value])
+
+    elif table == 'counters':
+        # Logs written before there was a schema_version don't have one, the
+        # store keeps the one it has
+        schema_version = store.get('counters', {}).get('schema_version')
+        store['counters'] = dict(value)
+        if schema_version is not None:
+            store['counters'].setdefault('schema_version', schema_version)
+
+    elif table == 'messages':
+        kind, conversation_id = record['parent']
+        conversation = indexes[kind].get(conversation_id)
+        if conversation is None:
+            return
+        messages = indexes['messages'][(kind, conversation_id)]
+        message = messages.get(record['key'])
+        if value is None:
+            if message is not None:
+                conversation['messages'].remove(message)
+                del messages[record['key']]
+        elif message is not None:
+            message.clear()
+            message.update(value)
+        else:
+            if messages_oldest_first(store):
+                conversation['messages'].append(value)
+            else:
+                # Replaying a log written by an older version over its snapshot,
+                # upgrade_store() reverses them afterwards
+                conversation['messages'].insert(0, value)
+            messages[record['key']] = value
+
+    else:
+        existing = indexes[table].get(record['key'])
+        if value is None:
+            if existing is not None:
+                store[table].remove(existing)
+                del indexes[table][record['key']]
+                indexes['messages'].pop((table, record['key']), None)
+        elif existing is not None:
+            if table == 'users':
+                with_history('users', value, existing)
+            messages = existing.get('messages')
+            existing.clear()
+            existing.update(value)
+            if messages is not None:
+                existing['messages'] = messages
+        else:
+            if table == 'users':
+                with_history('users', value)
+            store[table].append(value)
+            indexes[table][record['key']] = value
+            if table in ('channels', 'dms'):
+                value['messages'] = []
+                index_messages(indexes, table, value)
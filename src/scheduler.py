@@ -0,0 +1,99 @@
+'''
+scheduler.py
+
+Calls functions at a given time, eg. to send a message that was scheduled
+with message/sendlater. Pending calls are kept in a min-heap ordered by when
+they are due and a single dispatcher thread sleeps until the earliest one, so
+however many are waiting they cost one thread, and scheduling another is
+O(log n).
+
+Nothing is saved here. Whatever a call is for is kept in the data store by
+the caller, which schedules it again when the server starts (see
+messages.schedule_pending()). Calls are made one at a time on the dispatcher
+thread, so they should be quick; one that raises is reported and the rest
+carry on.
+'''
+
+import heapq
+import itertools
+import threading
+import time
+
+# (when, sequence number, function, args); the sequence number keeps calls
+# due at the same time in the order they were scheduled
+HEAP = []
+HEAP_CONDITION = threading.Condition()
+SEQUENCE = itertools.count()
+
+DISPATCHER = None
+DISPATCHER_LOCK = threading.Lock()
+
+# Counts since the server started. Lag is how many seconds after it was due
+# a call was made.
+SCHEDULER_STATS = {
+    'dispatched': 0,
+    'failed': 0,
+    'last_lag': 0,
+    'max_lag': 0,
+}
+
+def schedule(when, function, *args):
+    '''
+    Call function(*args) at the Unix timestamp when, or as soon as possible if
+    it has already passed. Raises TypeError or ValueError if when isn't a
+    number, rather than leaving it on the heap for the dispatcher to trip over.
+    '''
+    when = float(when)
+    start_dispatcher()
+    with HEAP_CONDITION:
+        heapq.heappush(HEAP, (when, next(SEQUENCE), function, args))
+        # It may be due before whatever the dispatcher is waiting for
+        HEAP_CONDITION.notify()
+
+def clear():
+    '''
+    Drop every call that is waiting, eg. when the data store they were
+    scheduled for has been cleared
+    '''
+    with HEAP_CONDITION:
+        HEAP.clear()
+        HEAP_CONDITION.notify()
+
+def scheduler_stats():
+    '''
+    The number of calls waiting (depth), and the number made, the number that
+    raised and the latest and largest lag in seconds since the server started
+    '''
+    with HEAP_CONDITION:
+        return dict(SCHEDULER_STATS, depth=len(HEAP))
+
+def start_dispatcher():
+    # Start the thread that makes the calls, if it isn't running already
+    global DISPATCHER
+    with DISPATCHER_LOCK:
+        if DISPATCHER is None:
+            DISPATCHER = threading.Thread(target=dispatch_loop, name='scheduler', daemon=True)
+            DISPATCHER.start()
+    return DISPATCHER
+
+def dispatch_loop():
+    while True:
+        with HEAP_CONDITION:
+            while not HEAP or HEAP[0][0] > time.time():
+                HEAP_CONDITION.wait(HEAP[0][0] - time.time() if HEAP else None)
+            when, _, function, args = heapq.heappop(HEAP)
+
+        lag = max(0, time.time() - when)
+        failed = False
+        try:
+            function(*args)
+        except Exception as error:
+            print(f'Scheduled call to {function.__name__} failed:', error)
+            failed = True
+
+        with HEAP_CONDITION:
+            if failed:
+                SCHEDULER_STATS['failed'] += 1
+            SCHEDULER_STATS['dispatched'] += 1
+            SCHEDULER_STATS['last_lag'] = lag
+            SCHEDULER_STATS['max_lag'] = max(SCHEDULER_STATS['max_lag'], lag)
@@ -1,6 +1,6 @@
 from src.data_store import data_store
 from src.error import InputError, AccessError
-from src.other import check_valid_token
+from src.other import check_valid_token, joined_channels, joined_dms, message_view
 
 def search_v1(token, query_str):
     '''
@@ -28,29 +28,26 @@ def search_v1(token, query_str):
     if len(query_str) < 1 or len(query_str) > 1000:
         raise InputError(description="Length of query_str is less than 1 or over 1000 characters")
     
-    # Find all the dms that user is in
-    for dm in store['dms']:
-        for member in dm['members']:
-            if decoded_token['u_id'] == member['u_id']:
-                # When user is in the dm find all the messages associated with user
-                for message in dm['messages']:
-                    # Find if the query_str is in the message
-                    # If query_str is not in the message -1 is returned
-                    if message['message'].find(query_str) != -1:
-                        messages.insert(0, message)
-                break
+    # Results are the user's channels, most recently made first, then their
+    # dms the same way, each with its messages oldest first
     
     # Find all the channels that user is in
-    for channel in store['channels']:
-        for member in channel['all_members']:
-            if decoded_token['u_id'] == member['u_id']:
-                # When user is in the channel find all the messages associated with user
-                for message in channel['messages']:
-                    # Find if the query_str is in the message
-                    # If query_str is not in the message -1 is returned
-                    if message['message'].find(query_str) != -1:
-                        messages.insert(0, message)
-                break
+    for channel in reversed(joined_channels(decoded_token['u_id'])):
+        # When user is in the channel find all the messages associated with user
+        for message in channel['messages']:
+            # Find if the query_str is in the message
+            # If query_str is not in the message -1 is returned
+            if message['message'].find(query_str) != -1:
+                messages.append(message_view(message, decoded_token['u_id']))
+    
+    # Find all the dms that user is in
+    for dm in reversed(joined_dms(decoded_token['u_id'])):
+        # When user is in the dm find all the messages associated with user
+        for message in dm['messages']:
+            # Find if the query_str is in the message
+            # If query_str is not in the message -1 is returned
+            if message['message'].find(query_str) != -1:
+                messages.append(message_view(message, decoded_token['u_id']))
 
     return {
         'messages': messages
@@ -6,12 +6,14 @@ from flask_cors import CORS
 from src.error import InputError
 from src import config
 
-import threading
 from src.data_store import data_store
+from src import persistence
+from src import passwords
 import json
 
 from src.channel import channel_join_v1, channel_leave_v1, channel_addowner_v1, channel_details_v1, channel_invite_v1, channel_messages_v1
 from src.messages import message_send_v1, message_edit_v1, message_remove_v1, message_sendlater_v1, message_sendlaterdm_v1, message_share_v1
+from src.messages import schedule_pending
 from src.channel import channel_removeowner_v1
 from src.channels import channels_create_v1, channels_list_v1, channels_listall_v1
 from src.auth import auth_register_v1, auth_login_v1, auth_logout_v1, auth_passwordreset_request_v1, auth_passwordreset_reset_v1
@@ -21,10 +23,10 @@ from src.user_profile import user_profile_v1, user_profile_setname_v1, user_prof
 from src.user_profile import user_profile_uploadphoto_v1
 from src.users_all import users_all_v1
 from src.message import message_senddm_v1, message_react_v1, message_unreact_v1, message_pin_v1, message_unpin_v1
-from src.admin import admin_userpermission_change_v1, admin_user_remove_v1
+from src.admin import admin_userpermission_change_v1, admin_user_remove_v1, admin_metrics_v1
 from src.stats import user_stats_v1, users_stats_v1
 from src.search import search_v1
-from src.standup import standup_start_v1, standup_active_v1, standup_send_v1
+from src.standup import standup_start_v1, standup_active_v1, standup_send_v1, schedule_standups
 from src.notifications import notifications_get_v1
 
 def quit_gracefully(*args):
@@ -50,17 +52,11 @@ APP.register_error_handler(Exception, defaultHandler)
 
 #### NO NEED TO MODIFY ABOVE THIS POINT, EXCEPT IMPORTS
 
-with open('data_store.json', 'r') as FILE:
-    datastore = json.load(FILE)
-    data_store.set(datastore)
-
-def save():
-    store = data_store.get()
-    threading.Timer(1.0, save).start()
-    with open('data_store.json', 'w') as FILE:
-        json.dump(store, FILE)
-
-save()
+persistence.load()
+passwords.start()
+persistence.start_flusher()
+schedule_pending()
+schedule_standups()
 
 # Example
 @APP.route("/echo", methods=['GET'])
@@ -192,15 +188,14 @@ def dm_leave():
 def dm_messages():
     token = request.args.get('token')
     dm_id = int(request.args.get('dm_id'))
-    start = int(request.args.get('start'))
+    start = request.args.get('start', type=int)
+    before_message_id = request.args.get('before_message_id', type=int)
+    after_message_id = request.args.get('after_message_id', type=int)
 
-    dm_messages_return = dm_messages_v1(token, dm_id, start)
+    dm_messages_return = dm_messages_v1(token, dm_id, start, before_message_id, after_message_id)
     
-    return dumps({
-        'messages': dm_messages_return['messages'],
-        'start': dm_messages_return['start'],
-        'end': dm_messages_return['end']
-    })
+    # { messages, start, end }, or the messages and the next cursor
+    return dumps(dm_messages_return)
 
 # MESSAGE
 @APP.route("/message/senddm/v1", methods=['POST'])
@@ -345,6 +340,11 @@ def admin_remove_user():
     admin_user_remove_v1(request_data['token'], request_data['u_id'])
     return dumps({})
 
+@APP.route("/admin/metrics/v1", methods=['GET'])
+def admin_metrics():
+    token = request.args.get('token')
+    return dumps(admin_metrics_v1(token))
+
 @APP.route("/channel/invite/v2", methods=['POST'])
 def invite():
     data = request.get_json()
@@ -355,13 +355,12 @@ def invite():
 def messages():
     token = request.args.get('token')
     channel_id = request.args.get('channel_id')
-    start = request.args.get('start')
-    messages_return = channel_messages_v1(token, int(channel_id), int(start))
-    return dumps({
-        'messages': messages_return['messages'],
-        'start': messages_return['start'],
-        'end': messages_return['end']
-    })
+    start = request.args.get('start', type=int)
+    before_message_id = request.args.get('before_message_id', type=int)
+    after_message_id = request.args.get('after_message_id', type=int)
+    messages_return = channel_messages_v1(token, int(channel_id), start, before_message_id, after_message_id)
+    # { messages, start, end }, or the messages and the next cursor
+    return dumps(messages_return)
     
 # MESSAGES
 @APP.route('/message/send/v1', methods=['POST'])
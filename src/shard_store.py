@@ -0,0 +1,246 @@
+'''
+shard_store.py
+
+Saves the data store as one file per user and conversation, selected with
+config.storage_engine = 'sharded'.
+
+    <config.shard_dir>/core.json            stats, codes and counters
+    <config.shard_dir>/users/<id>.json      a user and their sessions
+    <config.shard_dir>/channels/<id>.json   a channel and all of its messages
+    <config.shard_dir>/dms/<id>.json        a dm and all of its messages
+    <config.shard_dir>/history.jsonl        entries in the users' and stats' histories
+
+A commit only rewrites the files for the records touched since the last one,
+so sending a message rewrites that conversation and nothing else, no matter
+how many other channels and dms there are. The histories in users and the
+workspace stats (data_store.HISTORY_FIELDS) only ever grow, so they are left
+out of those files and their new entries appended to history.jsonl instead,
+one per line, keyed by their position in the history counting from the
+oldest.
+'''
+
+from src.data_store import data_store, initial_object, HISTORY_FIELDS
+from src.data_store import history, new_history, add_history, without_history, with_history
+from src.data_store import history_lengths
+from src import config
+
+import gc
+import json
+import os
+
+CORE_TABLES = ['stats', 'codes', 'counters']
+
+ID_FIELDS = {
+    'users': 'u_id',
+    'channels': 'channel_id',
+    'dms': 'dm_id',
+}
+
+# How many entries of each history are in history.jsonl, by (table, owner,
+# path) as in data_store.history_lengths()
+SAVED_HISTORY = {}
+
+def load_store():
+    '''
+    Build the data store dictionary from the shard files
+    '''
+    store = json.loads(json.dumps(initial_object))
+    rewrite = False
+
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        core_file = os.path.join(config.shard_dir, 'core.json')
+        if os.path.exists(core_file):
+            with open(core_file, 'r') as FILE:
+                core = json.load(FILE)
+            for table in CORE_TABLES:
+                if table in core:
+                    store[table] = core[table]
+                else:
+                    # Saved before the table existed, persistence.upgrade_store()
+                    # fills it in
+                    del store[table]
+            if 'users' in core:
+                # Saved before users had files of their own
+                store['users'] = core['users']
+                rewrite = True
+
+        for table in ID_FIELDS:
+            directory = os.path.join(config.shard_dir, table)
+            if not os.path.isdir(directory):
+                continue
+            shards = [name for name in os.listdir(directory) if name.endswith('.json')]
+            # Ordered by id, the order they were created in
+            for name in sorted(shards, key=lambda name: int(name[:-len('.json')])):
+                with open(os.path.join(directory, name), 'r') as FILE:
+                    store[table].append(json.load(FILE))
+
+        if not load_history(store):
+            rewrite = True
+    finally:
+        if gc_enabled:
+            gc.enable()
+
+    if rewrite:
+        write_all(store)
+
+    return store
+
+def load_history(store):
+    # Add the entries in history.jsonl to the users and stats in store.
+    # Returns False if the file ends part way through an entry.
+    users = {user['u_id']: user for user in store['users']}
+    for user in store['users']:
+        with_history('users', user)
+    for stats in store.get('stats', []):
+        with_history('stats', stats)
+
+    complete = True
+    path = history_path()
+    if os.path.exists(path):
+        with open(path, 'r') as FILE:
+            for line in FILE:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # The server died part way through appending
+                    complete = False
+                    break
+                table, owner, *field = record['parent']
+                field = tuple(field)
+                if table == 'users':
+                    owner = users.get(owner)
+                else:
+                    owner = store['stats'][owner] if owner < len(store['stats']) else None
+                if owner is not None and record['key'] >= len(history(owner, field)):
+                    add_history(owner, field, [record['value']])
+
+    SAVED_HISTORY.clear()
+    SAVED_HISTORY.update(history_lengths(store))
+    return complete
+
+def write_changes(store, changes):
+    '''
+    Rewrite the shards holding the records in changes, a collection of
+    (table, key, parent) as returned by data_store.pop_changes(), and append
+    any new history entries
+    '''
+    if ('clear', None, None) in changes or ('store', None, None) in changes:
+        write_all(store)
+        return
+
+    core_dirty = False
+    shards = set()
+    owners = []
+    for table, key, parent in changes:
+        if table in CORE_TABLES:
+            core_dirty = True
+            if table == 'stats':
+                owners += [('stats', position, stats) for position, stats in enumerate(store['stats'])]
+        elif table == 'messages':
+            shards.add(tuple(parent))
+        else:
+            shards.add((table, key))
+
+    if core_dirty:
+        write_core(store)
+
+    for table, key in shards:
+        record = data_store.lookup(table, key)
+        if record is None:
+            remove_file(shard_path(table, key))
+        else:
+            write_shard(table, record)
+            if table == 'users':
+                owners.append(('users', key, record))
+
+    append_history(owners)
+
+def write_all(store):
+    # Rewrite every shard and the history file, and remove the shards for
+    # records that are gone
+    write_core(store)
+    for table, id_field in ID_FIELDS.items():
+        directory = os.path.join(config.shard_dir, table)
+        existing = set(os.listdir(directory)) if os.path.isdir(directory) else set()
+        for record in store[table]:
+            path = shard_path(table, record[id_field])
+            write_shard(table, record)
+            existing.discard(os.path.basename(path))
+        for name in existing:
+            remove_file(os.path.join(directory, name))
+
+    SAVED_HISTORY.clear()
+    lines, saved = history_lines(
+        [('users', user['u_id'], user) for user in store['users']] +
+        [('stats', position, stats) for position, stats in enumerate(store['stats'])]
+    )
+    write_file(history_path(), ''.join(lines))
+    SAVED_HISTORY.update(saved)
+
+def write_core(store):
+    core = {table: store[table] for table in CORE_TABLES}
+    core['stats'] = [without_history('stats', stats) for stats in store['stats']]
+    write_json(os.path.join(config.shard_dir, 'core.json'), core)
+
+def write_shard(table, record):
+    if table == 'users':
+        record = without_history('users', record)
+    write_json(shard_path(table, record[ID_FIELDS[table]]), record)
+
+def append_history(owners):
+    # Append the entries in the histories of owners, a list of (table, owner
+    # id, record), that aren't in history.jsonl yet
+    lines, saved = history_lines(owners)
+    if lines:
+        os.makedirs(config.shard_dir, exist_ok=True)
+        with open(history_path(), 'a') as FILE:
+            FILE.write(''.join(lines))
+            FILE.flush()
+            if config.wal_fsync:
+                os.fsync(FILE.fileno())
+    SAVED_HISTORY.update(saved)
+
+def history_lines(owners):
+    # The lines for the entries not in SAVED_HISTORY, and the new counts
+    lines = []
+    saved = {}
+    for table, owner, record in owners:
+        for path in HISTORY_FIELDS[table]:
+            position = (table, owner, path)
+            count = SAVED_HISTORY.get(position, 0)
+            entries = new_history(record, path, count)
+            for offset, entry in enumerate(entries):
+                lines.append(json.dumps({
+                    'parent': [table, owner, *path],
+                    'key': count + offset,
+                    'value': entry,
+                }) + '\n')
+            saved[position] = count + len(entries)
+    return lines, saved
+
+def history_path():
+    return os.path.join(config.shard_dir, 'history.jsonl')
+
+def shard_path(table, key):
+    return os.path.join(config.shard_dir, table, f'{key}.json')
+
+def write_json(path, value):
+    write_file(path, json.dumps(value))
+
+def write_file(path, data):
+    # Write to a temporary file first so a shard is never left half written
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    tmp_file = path + '.tmp'
+    with open(tmp_file, 'w') as FILE:
+        FILE.write(data)
+        FILE.flush()
+        if config.wal_fsync:
+            os.fsync(FILE.fileno())
+    os.replace(tmp_file, path)
+
+def remove_file(path):
+    if os.path.exists(path):
+        os.remove(path)
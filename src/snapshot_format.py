@@ -0,0 +1,207 @@
+'''
+snapshot_format.py
+
+A compact binary format for data store snapshots, used instead of JSON when
+config.snapshot_format = 'binary'.
+
+The file is a header followed by length-prefixed records:
+
+    b'DSNAP'                      magic
+    version (u16), marshal version (u16)
+    for each table in TABLES:
+        record count (u32)
+        for each record:
+            length (u32), marshal encoded record
+
+users, stats and codes are one record per entry and counters is a single
+record holding the whole dictionary (version 2 onwards). Channels and dms are one
+record each without their messages; their messages follow in a 'messages'
+section as (table, index of the conversation, [up to MESSAGE_CHUNK messages])
+records, in the order the conversation keeps them.
+
+Records are decoded one at a time, so loading never holds more than one
+record's bytes alongside the store, and marshal decodes far faster than
+json. Strings that repeat across records (handles, emails, names, urls) are
+interned when written, so after loading every copy shares one object.
+
+To convert between formats:
+
+    python3 -m src.snapshot_format to-binary data_store.json data_store.snap
+    python3 -m src.snapshot_format to-json data_store.snap data_store.json
+'''
+
+from src.data_store import initial_object
+
+import gc
+import json
+import marshal
+import os
+import struct
+import sys
+
+MAGIC = b'DSNAP'
+VERSION = 2
+
+TABLES = ['users', 'channels', 'dms', 'messages', 'stats', 'codes', 'counters']
+
+# The tables written by each version that can still be read
+VERSION_TABLES = {
+    1: TABLES[:-1],
+    2: TABLES,
+}
+
+# Messages per record in the messages section
+MESSAGE_CHUNK = 1000
+
+# Strings at most this long are interned, longer ones are mostly message text
+INTERN_LENGTH = 100
+
+HEADER = struct.Struct('>HH')
+LENGTH = struct.Struct('>I')
+
+def write(store, FILE):
+    '''
+    Write store to the binary file object FILE
+    '''
+    FILE.write(MAGIC)
+    FILE.write(HEADER.pack(VERSION, marshal.version))
+
+    for table in TABLES:
+        records = table_records(store, table)
+        FILE.write(LENGTH.pack(len(records)))
+        for record in records:
+            if table == 'messages':
+                # Message text is rarely repeated, so only the keys are worth
+                # interning and walking every value would make saving slow
+                kind, index, messages = record
+                record = (kind, index, [
+                    intern_keys(message) if isinstance(message, dict) else message
+                    for message in messages
+                ])
+            else:
+                record = intern_strings(record)
+            data = marshal.dumps(record)
+            FILE.write(LENGTH.pack(len(data)))
+            FILE.write(data)
+
+def read(FILE):
+    '''
+    Read a store written by write() from the binary file object FILE
+    '''
+    if FILE.read(len(MAGIC)) != MAGIC:
+        raise ValueError('Not a data store snapshot')
+    version, marshal_version = HEADER.unpack(FILE.read(HEADER.size))
+    if version not in VERSION_TABLES:
+        raise ValueError(f'Unsupported snapshot version {version}')
+    if marshal_version != marshal.version:
+        raise ValueError(f'Snapshot was written with marshal version {marshal_version}, '
+                         f'convert it to JSON with the Python that wrote it')
+
+    store = json.loads(json.dumps(initial_object))
+    if 'counters' not in VERSION_TABLES[version]:
+        # persistence.upgrade_store() fills them in
+        del store['counters']
+
+    # Nothing loaded here can form a reference cycle, and the collector
+    # repeatedly scanning a store that is only growing slows loading down a lot
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for table in VERSION_TABLES[version]:
+            (count,) = LENGTH.unpack(FILE.read(LENGTH.size))
+            for _ in range(count):
+                (length,) = LENGTH.unpack(FILE.read(LENGTH.size))
+                record = marshal.loads(FILE.read(length))
+                if table == 'messages':
+                    kind, index, messages = record
+                    store[kind][index]['messages'].extend(messages)
+                elif table in ('channels', 'dms'):
+                    record['messages'] = []
+                    store[table].append(record)
+                elif table == 'counters':
+                    store[table] = record
+                else:
+                    store[table].append(record)
+    finally:
+        if gc_enabled:
+            gc.enable()
+
+    return store
+
+def dump_file(store, filename):
+    with open(filename, 'wb') as FILE:
+        write(store, FILE)
+
+def load_file(filename):
+    with open(filename, 'rb') as FILE:
+        return read(FILE)
+
+def table_records(store, table):
+    # The records that make up a table's section of the file
+    if table == 'messages':
+        records = []
+        for kind in ('channels', 'dms'):
+            for index, conversation in enumerate(store[kind]):
+                messages = conversation['messages']
+                for start in range(0, len(messages), MESSAGE_CHUNK):
+                    records.append((kind, index, messages[start:start + MESSAGE_CHUNK]))
+        return records
+
+    if table in ('channels', 'dms'):
+        return [
+            {field: conversation[field] for field in conversation if field != 'messages'}
+            for conversation in store[table]
+        ]
+
+    if table == 'counters':
+        return [store[table]]
+
+    return store[table]
+
+def intern_strings(value):
+    # Copy of value with its short strings interned. marshal writes interned
+    # strings so that they are interned again when read back.
+    if isinstance(value, str):
+        return sys.intern(value) if len(value) <= INTERN_LENGTH else value
+    if isinstance(value, dict):
+        return {sys.intern(key): intern_strings(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return type(value)(intern_strings(item) for item in value)
+    return value
+
+def intern_keys(value):
+    return {sys.intern(key): item for key, item in value.items()}
+
+def convert(command, source, target):
+    # Convert between the formats, bringing stores saved by older versions up
+    # to date on the way since neither format can hold them as they are.
+    # The target is only replaced once the new file is complete.
+    from src import persistence
+
+    if command == 'to-binary':
+        with open(source, 'r') as FILE:
+            store = json.load(FILE)
+    elif command == 'to-json':
+        store = load_file(source)
+    else:
+        raise ValueError(f'Unknown command {command}')
+    persistence.upgrade_store(store)
+
+    tmp_file = target + '.tmp'
+    try:
+        if command == 'to-binary':
+            dump_file(store, tmp_file)
+        else:
+            with open(tmp_file, 'w') as FILE:
+                json.dump(store, FILE)
+    except BaseException:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+        raise
+    os.replace(tmp_file, target)
+
+if __name__ == '__main__':
+    if len(sys.argv) != 4 or sys.argv[1] not in ('to-binary', 'to-json'):
+        print('Usage: python3 -m src.snapshot_format (to-binary | to-json) <source> <target>')
+        sys.exit(1)
+    convert(sys.argv[1], sys.argv[2], sys.argv[3])
@@ -0,0 +1,397 @@
+'''
+sqlite_store.py
+
+Keeps the data store in an SQLite database instead of a JSON file, selected
+with config.storage_engine = 'sqlite'.
+
+The server still works on the dictionary returned by data_store.get(); this
+is where it is saved to and loaded from, and nothing else. Lookups by email,
+handle, session or message id are all served from the indexes data_store
+keeps in memory, so the database is only ever read in full when the server
+starts and has no indexes beyond the primary keys its writes go through.
+Each table holds one row per record, so saving a change only touches the
+rows for the records that changed. The histories in users and the workspace
+stats (data_store.HISTORY_FIELDS) are kept in a table of their own, a row
+per entry, so saving one of them only inserts the entries that are new.
+
+To move an existing data_store.json into a database:
+
+    python3 -m src.sqlite_store data_store.json data_store.db
+'''
+
+from src.data_store import initial_object, SCHEMA_VERSION, HISTORY_FIELDS
+from src.data_store import new_history, add_history, without_history, with_history
+from src import config
+
+import json
+import sqlite3
+import sys
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS users (
+    u_id INTEGER PRIMARY KEY,
+    email TEXT,
+    handle_str TEXT,
+    data TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS sessions (
+    session_id INTEGER NOT NULL,
+    u_id INTEGER NOT NULL,
+    PRIMARY KEY (u_id, session_id)
+);
+
+CREATE TABLE IF NOT EXISTS channels (
+    channel_id INTEGER PRIMARY KEY,
+    data TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS dms (
+    dm_id INTEGER PRIMARY KEY,
+    data TEXT NOT NULL
+);
+
+-- rowid keeps the order messages were sent in, upserts leave it unchanged
+CREATE TABLE IF NOT EXISTS messages (
+    kind TEXT NOT NULL,
+    conversation_id INTEGER NOT NULL,
+    message_id INTEGER NOT NULL,
+    u_id INTEGER,
+    data TEXT NOT NULL,
+    PRIMARY KEY (kind, conversation_id, message_id)
+);
+
+CREATE TABLE IF NOT EXISTS stats (
+    position INTEGER PRIMARY KEY,
+    data TEXT NOT NULL
+);
+
+-- Entries in the lists in data_store.HISTORY_FIELDS, oldest first. owner is
+-- the u_id for users and the position in the stats table for stats, field
+-- is the path to the list joined with dots.
+CREATE TABLE IF NOT EXISTS history (
+    kind TEXT NOT NULL,
+    owner INTEGER NOT NULL,
+    field TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (kind, owner, field, position)
+);
+
+CREATE TABLE IF NOT EXISTS codes (
+    position INTEGER PRIMARY KEY,
+    reset_code TEXT NOT NULL,
+    email TEXT NOT NULL,
+    time_created INTEGER
+);
+
+CREATE TABLE IF NOT EXISTS counters (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+'''
+
+TABLES = ['users', 'sessions', 'channels', 'dms', 'messages', 'stats', 'history', 'codes', 'counters']
+
+UNUSED_INDEXES = [
+    'users_email', 'users_handle_str', 'sessions_session_id',
+    'messages_message_id', 'messages_u_id', 'codes_reset_code',
+]
+
+# PRAGMA user_version of the database, see upgrade_schema()
+DATABASE_VERSION = 1
+
+CONNECTION = None
+
+def connect(filename=None):
+    # Open the database (once), creating the tables if they don't exist yet
+    global CONNECTION
+    if CONNECTION is None:
+        CONNECTION = sqlite3.connect(filename or config.sqlite_file, check_same_thread=False)
+        CONNECTION.execute('PRAGMA journal_mode = WAL')
+        CONNECTION.execute('PRAGMA synchronous = ' + ('FULL' if config.wal_fsync else 'NORMAL'))
+        CONNECTION.executescript(SCHEMA)
+        upgrade_schema(CONNECTION)
+    return CONNECTION
+
+def upgrade_schema(db):
+    # Add the columns that databases made by older versions are missing.
+    # Codes from before time_created are left NULL, and
+    # persistence.upgrade_store() gives them one.
+    columns = [row[1] for row in db.execute('PRAGMA table_info(codes)')]
+    if 'time_created' not in columns:
+        with db:
+            db.execute('ALTER TABLE codes ADD COLUMN time_created INTEGER')
+
+    # Older versions indexed columns that nothing looks records up by, which
+    # only slowed down writes
+    with db:
+        for index in UNUSED_INDEXES:
+            db.execute(f'DROP INDEX IF EXISTS {index}')
+
+    # Users and stats used to be saved with their histories in them, move
+    # those into the history table
+    if db.execute('PRAGMA user_version').fetchone()[0] < 1:
+        with db:
+            for u_id, data in list(db.execute('SELECT u_id, data FROM users')):
+                user = with_history('users', json.loads(data))
+                db.execute(
+                    'UPDATE users SET data = ? WHERE u_id = ?',
+                    (json.dumps(without_history('users', user)), u_id)
+                )
+                write_history(db, 'users', u_id, user)
+            for position, data in list(db.execute('SELECT position, data FROM stats')):
+                stats = with_history('stats', json.loads(data))
+                db.execute(
+                    'UPDATE stats SET data = ? WHERE position = ?',
+                    (json.dumps(without_history('stats', stats)), position)
+                )
+                write_history(db, 'stats', position, stats)
+            db.execute(f'PRAGMA user_version = {DATABASE_VERSION}')
+
+def load_store():
+    '''
+    Build the data store dictionary from the database
+    '''
+    db = connect()
+    store = json.loads(json.dumps(initial_object))
+
+    sessions = {}
+    for u_id, session_id in db.execute('SELECT u_id, session_id FROM sessions ORDER BY rowid'):
+        sessions.setdefault(u_id, []).append(session_id)
+
+    histories = {}
+    for kind, owner, field, data in db.execute(
+        'SELECT kind, owner, field, data FROM history ORDER BY kind, owner, field, position'
+    ):
+        histories.setdefault((kind, owner, field), []).append(json.loads(data))
+
+    for u_id, data in db.execute('SELECT u_id, data FROM users ORDER BY u_id'):
+        user = json.loads(data)
+        user['session_id'] = sessions.get(u_id, [])
+        store['users'].append(load_history(histories, 'users', u_id, user))
+
+    conversations = {}
+    for channel_id, data in db.execute('SELECT channel_id, data FROM channels ORDER BY channel_id'):
+        channel = json.loads(data)
+        channel['messages'] = []
+        conversations[('channels', channel_id)] = channel
+        store['channels'].append(channel)
+
+    for dm_id, data in db.execute('SELECT dm_id, data FROM dms ORDER BY dm_id'):
+        dm = json.loads(data)
+        dm['messages'] = []
+        conversations[('dms', dm_id)] = dm
+        store['dms'].append(dm)
+
+    # Oldest first, the order conversations keep their messages in
+    for kind, conversation_id, data in db.execute(
+        'SELECT kind, conversation_id, data FROM messages ORDER BY rowid'
+    ):
+        conversation = conversations.get((kind, conversation_id))
+        if conversation is not None:
+            conversation['messages'].append(json.loads(data))
+
+    for position, data in db.execute('SELECT position, data FROM stats ORDER BY position'):
+        store['stats'].append(load_history(histories, 'stats', position, json.loads(data)))
+
+    for reset_code, email, time_created in db.execute(
+        'SELECT reset_code, email, time_created FROM codes ORDER BY position'
+    ):
+        code = {'reset_code': reset_code, 'email': email}
+        if time_created is not None:
+            code['time_created'] = time_created
+        store['codes'].append(code)
+
+    counters = dict(db.execute('SELECT name, value FROM counters'))
+    # Saved before there were counters if it's empty, persistence.upgrade_store()
+    # sets them. Messages come out in the order they were sent whatever
+    # version wrote them.
+    counters['schema_version'] = SCHEMA_VERSION
+    store['counters'] = counters
+
+    return store
+
+def load_history(histories, kind, owner, record):
+    # Put the entries from the history table back in record
+    with_history(kind, record)
+    for path in HISTORY_FIELDS[kind]:
+        add_history(record, path, histories.get((kind, owner, '.'.join(path)), []))
+    return record
+
+def write_records(records):
+    '''
+    Apply log records (see persistence.py) to the database in one transaction
+    '''
+    db = connect()
+    with db:
+        for record in records:
+            write_record(db, record)
+
+def import_store(store):
+    '''
+    Replace everything in the database with the contents of store
+    '''
+    db = connect()
+    with db:
+        write_record(db, {'op': 'clear'})
+        for table in ('users', 'channels', 'dms'):
+            for value in store[table]:
+                write_record(db, {'op': 'put', 'table': table, 'key': None, 'value': value})
+
+        for table, id_field in (('channels', 'channel_id'), ('dms', 'dm_id')):
+            for conversation in store[table]:
+                # Oldest first, so rowids come out in the order they were sent
+                for message in conversation['messages']:
+                    if isinstance(message, dict):
+                        write_record(db, {
+                            'op': 'put',
+                            'table': 'messages',
+                            'key': message['message_id'],
+                            'parent': [table, conversation[id_field]],
+                            'value': message,
+                        })
+
+        for table in ('stats', 'codes', 'counters'):
+            write_record(db, {'op': 'put', 'table': table, 'key': None, 'value': store[table]})
+
+def write_record(db, record):
+    if record['op'] == 'clear':
+        for table in TABLES:
+            db.execute(f'DELETE FROM {table}')
+        return
+
+    table = record['table']
+    value = record['value']
+
+    if table == 'users':
+        write_user(db, record['key'], value)
+
+    elif table in ('channels', 'dms'):
+        id_field = 'channel_id' if table == 'channels' else 'dm_id'
+        if value is None:
+            db.execute(f'DELETE FROM {table} WHERE {id_field} = ?', (record['key'],))
+            db.execute('DELETE FROM messages WHERE kind = ? AND conversation_id = ?', (table, record['key']))
+        else:
+            value = {field: value[field] for field in value if field != 'messages'}
+            db.execute(
+                f'INSERT INTO {table} ({id_field}, data) VALUES (?, ?) '
+                f'ON CONFLICT ({id_field}) DO UPDATE SET data = excluded.data',
+                (value[id_field], json.dumps(value))
+            )
+
+    elif table == 'messages':
+        kind, conversation_id = record['parent']
+        if value is None:
+            db.execute(
+                'DELETE FROM messages WHERE kind = ? AND conversation_id = ? AND message_id = ?',
+                (kind, conversation_id, record['key'])
+            )
+        else:
+            u_id = value['u_id'] if isinstance(value['u_id'], int) else None
+            db.execute(
+                'INSERT INTO messages (kind, conversation_id, message_id, u_id, data) VALUES (?, ?, ?, ?, ?) '
+                'ON CONFLICT (kind, conversation_id, message_id) DO UPDATE SET u_id = excluded.u_id, data = excluded.data',
+                (kind, conversation_id, record['key'], u_id, json.dumps(value))
+            )
+
+    elif table == 'stats':
+        for position, stats in enumerate(value):
+            db.execute(
+                'INSERT INTO stats (position, data) VALUES (?, ?) '
+                'ON CONFLICT (position) DO UPDATE SET data = excluded.data',
+                (position, json.dumps(without_history('stats', stats)))
+            )
+            write_history(db, 'stats', position, stats)
+        db.execute('DELETE FROM stats WHERE position >= ?', (len(value),))
+        db.execute("DELETE FROM history WHERE kind = 'stats' AND owner >= ?", (len(value),))
+
+    elif table == 'codes':
+        db.execute('DELETE FROM codes')
+        db.executemany(
+            'INSERT INTO codes (position, reset_code, email, time_created) VALUES (?, ?, ?, ?)',
+            [
+                (position, code['reset_code'], code['email'], code.get('time_created'))
+                for position, code in enumerate(value)
+            ]
+        )
+
+    elif table == 'counters':
+        db.executemany(
+            'INSERT INTO counters (name, value) VALUES (?, ?) '
+            'ON CONFLICT (name) DO UPDATE SET value = excluded.value',
+            list(value.items())
+        )
+
+def write_user(db, u_id, user):
+    if user is None:
+        db.execute('DELETE FROM users WHERE u_id = ?', (u_id,))
+        db.execute('DELETE FROM sessions WHERE u_id = ?', (u_id,))
+        db.execute("DELETE FROM history WHERE kind = 'users' AND owner = ?", (u_id,))
+        return
+
+    # Sessions and histories live in their own tables
+    data = without_history('users', user)
+    del data['session_id']
+    db.execute(
+        'INSERT INTO users (u_id, email, handle_str, data) VALUES (?, ?, ?, ?) '
+        'ON CONFLICT (u_id) DO UPDATE SET email = excluded.email, '
+        'handle_str = excluded.handle_str, data = excluded.data',
+        (user['u_id'], user['email'], user['handle_str'], json.dumps(data))
+    )
+
+    db.execute('DELETE FROM sessions WHERE u_id = ?', (user['u_id'],))
+    db.executemany(
+        'INSERT OR IGNORE INTO sessions (session_id, u_id) VALUES (?, ?)',
+        [(session_id, user['u_id']) for session_id in user['session_id']]
+    )
+    write_history(db, 'users', user['u_id'], user)
+
+def write_history(db, kind, owner, record):
+    # Insert the entries in record's histories that aren't in the database
+    # yet. Entries are only ever added, so the ones already saved are left
+    # as they are and only the count of them is read.
+    saved = dict(db.execute(
+        'SELECT field, COUNT(*) FROM history WHERE kind = ? AND owner = ? GROUP BY field',
+        (kind, owner)
+    ))
+    for path in HISTORY_FIELDS[kind]:
+        field = '.'.join(path)
+        count = saved.get(field, 0)
+        db.executemany(
+            'INSERT INTO history (kind, owner, field, position, data) VALUES (?, ?, ?, ?, ?)',
+            [
+                (kind, owner, field, count + offset, json.dumps(entry))
+                for offset, entry in enumerate(new_history(record, path, count))
+            ]
+        )
+
+def migrate(json_file, db_file):
+    '''
+    Import a data_store.json snapshot into a database. If it's the snapshot
+    the server is configured to use, the log next to it is replayed first so
+    nothing written since the snapshot is lost.
+    '''
+    from src import persistence
+
+    with open(json_file, 'r') as FILE:
+        store = json.load(FILE)
+
+    if json_file == config.snapshot_file:
+        indexes = persistence.replay_indexes(store)
+        persistence.replay(store, persistence.PREVIOUS_WAL_FILE, indexes)
+        persistence.replay(store, config.wal_file, indexes)
+    # The database keeps messages in the order they were sent
+    persistence.upgrade_store(store)
+
+    connect(db_file)
+    import_store(store)
+
+    print(f"Imported {len(store['users'])} users, {len(store['channels'])} channels "
+          f"and {len(store['dms'])} dms into {db_file}")
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3:
+        print('Usage: python3 -m src.sqlite_store <data_store.json> <data_store.db>')
+        sys.exit(1)
+    migrate(sys.argv[1], sys.argv[2])
@@ -1,13 +1,11 @@
 from src.data_store import data_store
 from src.error import InputError, AccessError
-from src.other import check_valid_token
-from src.messages import message_send_v1
-from src.stats import increase_num_msgs_sent
+from src.other import check_valid_token, get_user, get_channel, check_is_member, generate_message_id
+from src.messages import post_message
+from src import config
+from src import scheduler
 from datetime import datetime
 
-import threading
-import time
-
 def standup_start_v1(token, channel_id, length):
     '''
     Starts a standup for "length" seconds in a given channel
@@ -35,11 +33,8 @@ def standup_start_v1(token, channel_id, length):
     decode = check_valid_token(token)
     
     # Check if valid channel_id exists
-    valid_channel = False
-    for channel in store['channels']:
-        if channel_id == channel['channel_id']:
-            valid_channel = True
-            break
+    channel = get_channel(channel_id)
+    valid_channel = channel is not None
     
     if valid_channel == False:
         raise InputError(description="Channel id does not exist")
@@ -47,9 +42,8 @@ def standup_start_v1(token, channel_id, length):
     # Check if user is part of that channel
     valid_user = False
     
-    for users in channel['all_members']:
-        if users['u_id'] == decode['u_id']:
-            valid_user = True
+    if check_is_member(decode['u_id'], channel['channel_id']):
+        valid_user = True
 
     if valid_user == False:
         raise AccessError(description="User not authorised access to channel")
@@ -62,45 +56,100 @@ def standup_start_v1(token, channel_id, length):
     if channel['standup'] != {}:
         raise InputError(description="An active standup is currently running in the channel")
     
-    standup = threading.Timer(length, standup_end_v1, [token, channel, channel_id])
-    standup.start()
-    
-    # Get current datatime, convert to Unix timestamp
-    timestamp = int(datetime.now().timestamp() + length)
+    # Get current datatime, convert to Unix timestamp. The standup ends at the
+    # exact deadline, time_finish is only the whole second it is reported as.
+    deadline = datetime.now().timestamp() + length
+    timestamp = int(deadline)
     
+    # The packaged message is sent as the user starting the standup
     channel['standup']['time_finish'] = timestamp
+    channel['standup']['deadline'] = deadline
+    channel['standup']['u_id'] = decode['u_id']
     channel['standup']['messages'] = []
+    channel['standup']['bytes'] = 0
     
     data_store.set(store)
+    data_store.touch('channels', channel_id)
+    
+    # The standup is saved with the channel, so it still ends if the server
+    # restarts before then, see schedule_standups()
+    scheduler.schedule(deadline, standup_end_v1, channel_id, timestamp)
     
     return {
         'time_finish': timestamp
     }
     
-def standup_end_v1(token, channel, channel_id):
+def standup_end_v1(channel_id, time_finish):
+    # Called by the scheduler when the standup finishing at time_finish is
+    # due to end. Does nothing if that standup is no longer running, eg. the
+    # store was cleared.
     store = data_store.get()
+    
+    channel = get_channel(channel_id)
+    if channel is None or channel['standup'].get('time_finish') != time_finish:
+        return
 
     standup_msg = channel['standup']['messages']
-    buffered_messages(channel, token, channel_id, standup_msg)
+    buffered_messages(channel, channel['standup']['u_id'], channel_id, standup_msg)
     channel['standup'] = {}        
     
     data_store.set(store)
+    data_store.touch('channels', channel_id)
 
-def buffered_messages(channel, token, channel_id, standup_msg):
+def schedule_standups():
+    # Have the scheduler end the standups still running in the store, when the
+    # server starts. Any that finished while it was stopped are ended now.
     store = data_store.get()
-    packaged_msg = []
-    
-    for message in standup_msg:
-        for user in store['users']:
-            if user['u_id'] == message['u_id']:
-                packaged_msg.append(f"{user['handle_str']}: {message['message']}")
-   
-    packaged_msg = "\n".join(packaged_msg)
+    for channel in store['channels']:
+        if channel['standup'] != {}:
+            time_finish = channel['standup']['time_finish']
+            # Standups saved before the deadline was kept end on time_finish
+            deadline = channel['standup'].get('deadline', time_finish)
+            scheduler.schedule(deadline, standup_end_v1, channel['channel_id'], time_finish)
+
+def buffered_messages(channel, u_id, channel_id, standup_msg):
+    # Each message was stored with its sender's handle, so this is a single join
+    packaged_msg = "\n".join(
+        f"{message['handle_str']}: {message['message']}" for message in standup_msg
+    )
     
     if standup_msg == []:
-        channel['messages'].insert(0, "\n")
-    else:
-        message_send_v1(token, channel_id, packaged_msg)
+        channel['messages'].append("\n")
+        return
+    
+    # Sent as whoever started the standup, or the first owner still in the
+    # channel if they have left since. It's dropped if there is no one.
+    if u_id is None or not check_is_member(u_id, channel_id):
+        owners = [owner for owner in channel['owner_members'] if check_is_member(owner, channel_id)]
+        u_id = owners[0] if owners else None
+    if u_id is None:
+        return
+    
+    for part in split_message(packaged_msg):
+        post_message('channels', channel_id, u_id, generate_message_id(),
+                     part, channel['standup']['time_finish'])
+
+def split_message(message, length=1000):
+    # Split a packaged message into messages of at most length characters,
+    # between lines where it can be and within a line that is too long
+    parts = []
+    part = None
+    for line in message.split("\n"):
+        while len(line) > length:
+            if part is not None:
+                parts.append(part)
+                part = None
+            parts.append(line[:length])
+            line = line[length:]
+        if part is not None and len(part) + 1 + len(line) <= length:
+            part += "\n" + line
+        else:
+            if part is not None:
+                parts.append(part)
+            part = line
+    if part is not None:
+        parts.append(part)
+    return parts
         
 def standup_active_v1(token, channel_id):
     '''
@@ -126,11 +175,8 @@ def standup_active_v1(token, channel_id):
     decode = check_valid_token(token)
     
     # Check if valid channel_id exists
-    valid_channel = False
-    for channel in store['channels']:
-        if channel_id == channel['channel_id']:
-            valid_channel = True
-            break
+    channel = get_channel(channel_id)
+    valid_channel = channel is not None
     
     if valid_channel == False:
         raise InputError(description="Channel id does not exist")
@@ -138,9 +184,8 @@ def standup_active_v1(token, channel_id):
     # Check if user is part of that channel
     valid_user = False
     
-    for users in channel['all_members']:
-        if users['u_id'] == decode['u_id']:
-            valid_user = True
+    if check_is_member(decode['u_id'], channel['channel_id']):
+        valid_user = True
 
     if valid_user == False:
         raise AccessError(description="User not authorised access to channel")
@@ -170,6 +215,7 @@ def standup_send_v1(token, channel_id, message):
         InputError - channel_id does not refer to a valid channel
         InputError - length of message is over 1000 characters
         inputError - an active standup is currently running in the channel
+        InputError - the standup's buffer has no room for the message
         AccessError - channel_id is valid and the authorised user is not a member of the channel
         AccessError - when token is invalid
 
@@ -185,11 +231,8 @@ def standup_send_v1(token, channel_id, message):
     decode = check_valid_token(token)
     
     # Check if valid channel_id exists
-    valid_channel = False
-    for channel in store['channels']:
-        if channel_id == channel['channel_id']:
-            valid_channel = True
-            break
+    channel = get_channel(channel_id)
+    valid_channel = channel is not None
     
     if valid_channel == False:
         raise InputError(description="Channel id does not exist")
@@ -197,10 +240,8 @@ def standup_send_v1(token, channel_id, message):
     # Check if user is part of that channel
     valid_user = False
     
-    for users in channel['all_members']:
-        if users['u_id'] == decode['u_id']:
-            valid_user = True
-            break
+    if check_is_member(decode['u_id'], channel['channel_id']):
+        valid_user = True
 
     if valid_user == False:
         raise AccessError(description="User not authorised access to channel")
@@ -213,12 +254,23 @@ def standup_send_v1(token, channel_id, message):
     if channel['standup'] == {}:
         raise InputError(description="An active standup is not currently running in the channel")
     
+    # The handle is recorded now so the packaged message doesn't have to look
+    # up every sender when the standup ends. Each message takes up its line
+    # in the packaged message and the newline after it.
+    handle = get_user(decode['u_id'])['handle_str']
+    size = len(f"{handle}: {message}".encode()) + 1
+    if channel['standup']['bytes'] + size > config.standup_buffer_bytes:
+        raise InputError(description="The standup has no room for any more messages")
+    
     standup_messages_dict['u_id'] = decode['u_id']
+    standup_messages_dict['handle_str'] = handle
     standup_messages_dict['message'] = message
     
     channel['standup']['messages'].append(standup_messages_dict)
+    channel['standup']['bytes'] += size
     
     data_store.set(store)
+    data_store.touch('channels', channel_id)
     
     return {
     }
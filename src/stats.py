@@ -1,5 +1,5 @@
 from src.data_store import data_store
-from src.other import check_valid_token
+from src.other import check_valid_token, get_user
 from datetime import datetime, timezone
 
 def user_stats_v1(token):
@@ -22,9 +22,7 @@ def user_stats_v1(token):
     store = data_store.get()
     
     # Get the user stats of the user
-    for user in store['users']:
-        if user['u_id'] == user_token_data['u_id']:
-            user_stats = user['user_stats']
+    user_stats = get_user(user_token_data['u_id'])['user_stats']
             
     num_channels_joined = user_stats['channels_joined'][-1]['num_channels_joined']
     num_dms_joined = user_stats['dms_joined'][-1]['num_dms_joined']
@@ -137,21 +135,8 @@ def update_utilization_rate():
     # Get num users who have joined at least one channel or dm
     for user in store['users']:
         u_id = user['u_id']
-        user_has_joined_channel = False
-        for channel in store['channels']:
-            for member in channel['all_members']:
-                if u_id == member['u_id'] and user_has_joined_channel == False:
-                    user_has_joined_channel = True
-                    counter += 1
-                
-        # If they haven't joined a channel, check if they have joined a dm
-        user_has_joined_dm = False
-        if user_has_joined_channel == False:
-            for dm in store['dms']:
-                for dm_member in dm['members']:
-                    if u_id == dm_member['u_id'] and user_has_joined_dm == False:
-                        user_has_joined_dm = True
-                        counter += 1
+        if data_store.joined('channels', u_id) or data_store.joined('dms', u_id):
+            counter += 1
     
     rate = counter / num_users_counter
     
@@ -162,10 +147,9 @@ def update_utilization_rate():
 def increase_num_channels_joined(u_id):
     store = data_store.get()
     
+    user = get_user(u_id)
     # Find the number of channels the user has already joined
-    for user in store['users']:
-        if u_id == user['u_id']:
-            num_channels_joined = user['user_stats']['channels_joined'][-1]['num_channels_joined']
+    num_channels_joined = user['user_stats']['channels_joined'][-1]['num_channels_joined']
     
     # Increment num_channels_joined
     num_channels_joined += 1
@@ -176,9 +160,8 @@ def increase_num_channels_joined(u_id):
     user_stats = {'num_channels_joined': num_channels_joined, 'time_stamp': timestamp}
 
     # Append the new user_stats to the list of channels joined
-    for user in store['users']:
-        if u_id == user['u_id']:
-            user['user_stats']['channels_joined'].append(user_stats)
+    user['user_stats']['channels_joined'].append(user_stats)
+    data_store.touch('users', u_id)
     
     data_store.set(store)
 
@@ -190,10 +173,9 @@ def increase_num_channels_joined(u_id):
 def increase_num_dms_joined(u_id):  
     store = data_store.get() 
     
+    user = get_user(u_id)
     # Find the number of dms the user has already joined
-    for user in store['users']:
-        if u_id == user['u_id']:
-            num_dms_joined = user['user_stats']['dms_joined'][-1]['num_dms_joined']
+    num_dms_joined = user['user_stats']['dms_joined'][-1]['num_dms_joined']
             
     # Increment num_dms_joined
     num_dms_joined += 1
@@ -204,9 +186,8 @@ def increase_num_dms_joined(u_id):
     user_stats = {'num_dms_joined': num_dms_joined, 'time_stamp': timestamp}
     
     # Append the new user_stats to the list of channels joined
-    for user in store['users']:
-        if u_id == user['u_id']:   
-            user['user_stats']['dms_joined'].append(user_stats)
+    user['user_stats']['dms_joined'].append(user_stats)
+    data_store.touch('users', u_id)
     
     data_store.set(store)
 
@@ -218,10 +199,9 @@ def increase_num_dms_joined(u_id):
 def increase_num_msgs_sent(u_id): 
     store = data_store.get() 
     
+    user = get_user(u_id)
     # Find the number of messages the user has sent
-    for user in store['users']:
-        if u_id == user['u_id']:
-            num_msgs_sent = user['user_stats']['messages_sent'][-1]['num_messages_sent']
+    num_msgs_sent = user['user_stats']['messages_sent'][-1]['num_messages_sent']
     
     # Increment num_msgs_sent
     num_msgs_sent += 1
@@ -232,9 +212,8 @@ def increase_num_msgs_sent(u_id):
     user_stats = {'num_messages_sent': num_msgs_sent, 'time_stamp': timestamp}
     
     # Append the new user_stats to the list of messages sent
-    for user in store['users']:
-        if u_id == user['u_id']:
-            user['user_stats']['messages_sent'].append(user_stats)
+    user['user_stats']['messages_sent'].append(user_stats)
+    data_store.touch('users', u_id)
     
     data_store.set(store)
 
@@ -246,10 +225,9 @@ def increase_num_msgs_sent(u_id):
 def decrease_num_channels_joined(u_id):
     store = data_store.get()
     
+    user = get_user(u_id)
     # Find the number of channels the user has already joined
-    for user in store['users']:
-        if u_id == user['u_id']:
-            num_channels_joined = user['user_stats']['channels_joined'][-1]['num_channels_joined']
+    num_channels_joined = user['user_stats']['channels_joined'][-1]['num_channels_joined']
     
     # Decrease num_channels_joined
     num_channels_joined -= 1
@@ -260,9 +238,8 @@ def decrease_num_channels_joined(u_id):
     user_stats = {'num_channels_joined': num_channels_joined, 'time_stamp': timestamp}
 
     # Append the new user_stats to the list of channels joined
-    for user in store['users']:
-        if u_id == user['u_id']:
-            user['user_stats']['channels_joined'].append(user_stats)
+    user['user_stats']['channels_joined'].append(user_stats)
+    data_store.touch('users', u_id)
     
     data_store.set(store)
 
@@ -274,10 +251,9 @@ def decrease_num_channels_joined(u_id):
 def decrease_num_dms_joined(u_id):
     store = data_store.get()
     
+    user = get_user(u_id)
     # Find the number of dms the user has already joined
-    for user in store['users']:
-        if u_id == user['u_id']:
-            num_dms_joined = user['user_stats']['dms_joined'][-1]['num_dms_joined']
+    num_dms_joined = user['user_stats']['dms_joined'][-1]['num_dms_joined']
             
     # Decrease num_dms_joined
     num_dms_joined -= 1
@@ -288,9 +264,8 @@ def decrease_num_dms_joined(u_id):
     user_stats = {'num_dms_joined': num_dms_joined, 'time_stamp': timestamp}
     
     # Append the new user_stats to the list of channels joined
-    for user in store['users']:
-        if u_id == user['u_id']:   
-            user['user_stats']['dms_joined'].append(user_stats)
+    user['user_stats']['dms_joined'].append(user_stats)
+    data_store.touch('users', u_id)
 
     data_store.set(store)
 
@@ -312,6 +287,7 @@ def increase_channels_exist():
     # Create new dictionary with new stats
     new_stats = {'num_channels_exist': num_channels_exist, 'time_stamp': timestamp}
     store['stats'][0]['channels_exist'].append(new_stats)
+    data_store.touch('stats')
     
     data_store.set(store)
     
@@ -332,6 +308,7 @@ def increase_dms_exist():
     # Create new dictionary with new stats
     new_stats = {'num_dms_exist': num_dms_exist, 'time_stamp': timestamp}
     store['stats'][0]['dms_exist'].append(new_stats)
+    data_store.touch('stats')
     
     data_store.set(store)
     
@@ -352,6 +329,7 @@ def decrease_dms_exist():
     # Create new dictionary with new stats
     new_stats = {'num_dms_exist': num_dms_exist, 'time_stamp': timestamp}
     store['stats'][0]['dms_exist'].append(new_stats)
+    data_store.touch('stats')
     
     data_store.set(store)
     
@@ -372,6 +350,7 @@ def increase_msgs_exist():
     # Create new dictionary with new stats
     new_stats = {'num_messages_exist': num_msgs_exist, 'time_stamp': timestamp}
     store['stats'][0]['messages_exist'].append(new_stats)
+    data_store.touch('stats')
     
     data_store.set(store)
     
@@ -392,6 +371,7 @@ def decrease_msgs_exist(num_msgs_removed):
     # Create new dictionary with new stats
     new_stats = {'num_messages_exist': num_msgs_exist, 'time_stamp': timestamp}
     store['stats'][0]['messages_exist'].append(new_stats)
+    data_store.touch('stats')
     
     data_store.set(store)
     
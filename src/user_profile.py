@@ -1,6 +1,6 @@
 from src.data_store import data_store
 from src.error import InputError
-from src.other import decode_jwt, check_valid_token
+from src.other import decode_jwt, check_valid_token, get_user
 from src import config
 
 from PIL import Image
@@ -34,13 +34,9 @@ def user_profile_v1(token, u_id):
     
     store = data_store.get()    
 
-    valid_user = False  
-
     # Check if u_id refers to a valid user, otherwise raise InputError
-    for user in store['users']:
-        if user['u_id'] == u_id:
-            valid_user = True
-            break
+    user = get_user(u_id)
+    valid_user = user is not None
     
     if valid_user == False:
         raise InputError(description="Invalid User ID")
@@ -74,21 +70,22 @@ def user_profile_setname_v1(token, name_first, name_last):
     store = data_store.get()
     
     # Get the user
-    for user in store['users']:
-        if user['u_id'] == decoded_token['u_id']:
-            # Check if new first name is valid
-            if len(name_first) < 1 or len(name_first) > 50:
-                raise InputError(description="First name must be between 1 to 50 characters")
-            else:
-                user['name_first'] = name_first
-                
-            # Check if new last name is valid
-            if len(name_last) < 1 or len(name_last) > 50:
-                raise InputError(description="Last name must be between 1 to 50 characters")
-            else:
-                user['name_last'] = name_last
+    user = get_user(decoded_token['u_id'])
+
+    # Check if new first name is valid
+    if len(name_first) < 1 or len(name_first) > 50:
+        raise InputError(description="First name must be between 1 to 50 characters")
+    else:
+        user['name_first'] = name_first
+        
+    # Check if new last name is valid
+    if len(name_last) < 1 or len(name_last) > 50:
+        raise InputError(description="Last name must be between 1 to 50 characters")
+    else:
+        user['name_last'] = name_last
     
     data_store.set(store)
+    data_store.touch('users', decoded_token['u_id'])
 
     return {
     }    
@@ -118,17 +115,16 @@ def user_profile_setemail_v1(token, email):
         raise InputError(description="Invalid email")
     
     # Check if email is already in use
-    for user in store['users']:
-        if user['email'] == email:
-            raise InputError(description="Email already in use")
+    if data_store.lookup_user('email', email) is not None:
+        raise InputError(description="Email already in use")
             
     # Get the user   
-    for user in store['users']:
-        if user['u_id'] == decoded_token['u_id']:
-            # Change the user's email
-            user['email'] = email
+    user = get_user(decoded_token['u_id'])
+    # Change the user's email
+    data_store.set_user_key(user, 'email', email)
     
     data_store.set(store)         
+    data_store.touch('users', decoded_token['u_id'])
             
     return {
     }
@@ -162,16 +158,14 @@ def user_profile_sethandle_v1(token, handle_str):
         raise InputError(description="Display name must be alphanumeric only")
         
     # Check if the display name is already taken
-    for user in store['users']:
-        if user['handle_str'] == handle_str:
-            raise InputError(description="Display name is already taken")
+    if data_store.lookup_user('handle_str', handle_str) is not None:
+        raise InputError(description="Display name is already taken")
     
     # Change the users display name
-    for user in store['users']:
-        if user['u_id'] == decoded_token['u_id']: 
-            user['handle_str'] = handle_str
+    data_store.set_user_key(get_user(decoded_token['u_id']), 'handle_str', handle_str)
 
     data_store.set(store)
+    data_store.touch('users', decoded_token['u_id'])
     
     return {
     }
@@ -232,11 +226,10 @@ def user_profile_uploadphoto_v1(token, img_url, x_start, y_start, x_end, y_end):
     profile_img_url = f'{BASE_URL}static/{u_id}.jpg'
     
     # Change the user's profile img url
-    for user in store['users']:
-        if user['u_id'] == user_data['u_id']:
-            user['profile_img_url'] = profile_img_url
+    get_user(user_data['u_id'])['profile_img_url'] = profile_img_url
             
     data_store.set(store)
+    data_store.touch('users', u_id)
         
     return {
     }
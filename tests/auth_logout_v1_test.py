@@ -2,6 +2,10 @@ import pytest
 import requests
 
 from src import config
+from src.auth import auth_register_v1, auth_login_v1, auth_logout_v1
+from src import other
+from src.other import clear_v1, check_valid_token, jwt_cache_stats
+from src.data_store import data_store
 
 BASE_URL = config.url
 
@@ -83,3 +87,49 @@ def test_check_invalid_token(clear_data):
     })
     
     assert response.status_code == AccessError.code
+
+# A token that has been used (so its payload is cached) is dropped from the
+# cache and stops working once it is logged out, and the user's other
+# sessions stay cached
+def test_logout_used_token(monkeypatch):
+    monkeypatch.setattr(config, 'token_format', 'jwt')
+    clear_v1()
+    
+    auth_register_v1('new@email.com', 'password', 'abc', 'def')
+    token = auth_login_v1('new@email.com', 'password')['token']
+    other_token = auth_login_v1('new@email.com', 'password')['token']
+    for _ in range(2):
+        check_valid_token(token)
+    check_valid_token(other_token)
+    assert token in other.JWT_CACHE
+    size = jwt_cache_stats()['size']
+    
+    auth_logout_v1(token)
+    
+    assert token not in other.JWT_CACHE
+    assert other_token in other.JWT_CACHE
+    assert jwt_cache_stats()['size'] == size - 1
+    with pytest.raises(AccessError):
+        check_valid_token(token)
+    check_valid_token(other_token)
+
+# Opaque tokens stop working once they are logged out, and the user's other
+# sessions carry on
+def test_logout_opaque_token(monkeypatch):
+    monkeypatch.setattr(config, 'token_format', 'opaque')
+    clear_v1()
+    
+    auth_register_v1('new@email.com', 'password', 'abc', 'def')
+    token = auth_login_v1('new@email.com', 'password')['token']
+    other_token = auth_login_v1('new@email.com', 'password')['token']
+    check_valid_token(token)
+    assert data_store.lookup_token(token) is not None
+    
+    auth_logout_v1(token)
+    
+    with pytest.raises(AccessError):
+        check_valid_token(token)
+    with pytest.raises(AccessError):
+        auth_logout_v1(token)
+    assert data_store.lookup_token(token) is None
+    check_valid_token(other_token)
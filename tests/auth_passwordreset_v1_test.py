@@ -1,10 +1,16 @@
 import pytest
 import requests
 from src import config
+from src import auth
+from src.auth import auth_register_v1, auth_login_v1, auth_passwordreset_request_v1
+from src.auth import auth_passwordreset_reset_v1
+from src.data_store import data_store
+from src import other
+from src.other import clear_v1, check_valid_token, jwt_cache_stats
 
 BASE_URL = config.url
 
-from src.error import InputError
+from src.error import InputError, AccessError
 
 @pytest.fixture
 def clear_data():
@@ -69,3 +75,122 @@ def test_invalid_code(clear_data):
     })
     
     assert response.status_code == InputError.code
+
+def test_request_logs_out_used_tokens(clear_data):
+    ''' test tokens that have been used stop working once a reset is requested '''
+    
+    register = requests.post(BASE_URL + 'auth/register/v2', json = {
+        'email': 'john@gmail.com', 'password': 'password',
+        'name_first': 'abc', 'name_last': 'def'
+    })
+    login = requests.post(BASE_URL + 'auth/login/v2', json = {
+        'email': 'john@gmail.com', 'password': 'password'
+    })
+    tokens = [register.json()['token'], login.json()['token']]
+    
+    for token in tokens:
+        response = requests.get(BASE_URL + 'channels/list/v2', params = {'token': token})
+        assert response.status_code == 200
+    
+    requests.post(BASE_URL + 'auth/passwordreset/request/v1', json = {
+        'email': 'john@gmail.com'
+    })
+    
+    for token in tokens:
+        response = requests.get(BASE_URL + 'channels/list/v2', params = {'token': token})
+        assert response.status_code == AccessError.code
+
+def test_request_logs_out_opaque_tokens(monkeypatch):
+    ''' test opaque tokens stop working once a reset is requested '''
+    monkeypatch.setattr(config, 'token_format', 'opaque')
+    monkeypatch.setattr(auth, 'send_email', lambda to, body: None)
+    clear_v1()
+    
+    tokens = [
+        auth_register_v1('john@gmail.com', 'password', 'abc', 'def')['token'],
+        auth_login_v1('john@gmail.com', 'password')['token'],
+    ]
+    for token in tokens:
+        check_valid_token(token)
+    
+    auth_passwordreset_request_v1('john@gmail.com')
+    
+    for token in tokens:
+        with pytest.raises(AccessError):
+            check_valid_token(token)
+
+def test_request_drops_cached_tokens(monkeypatch):
+    ''' test the user's used tokens are dropped from the decoded token cache once a reset is requested '''
+    monkeypatch.setattr(config, 'token_format', 'jwt')
+    monkeypatch.setattr(auth, 'send_email', lambda to, body: None)
+    clear_v1()
+    
+    tokens = [
+        auth_register_v1('john@gmail.com', 'password', 'abc', 'def')['token'],
+        auth_login_v1('john@gmail.com', 'password')['token'],
+    ]
+    other_token = auth_register_v1('jane@gmail.com', 'password', 'ghi', 'jkl')['token']
+    for token in tokens + [other_token]:
+        check_valid_token(token)
+    assert jwt_cache_stats()['size'] == 3
+    
+    auth_passwordreset_request_v1('john@gmail.com')
+    
+    assert jwt_cache_stats()['size'] == 1
+    assert all(token not in other.JWT_CACHE for token in tokens)
+    assert other_token in other.JWT_CACHE
+
+@pytest.fixture
+def reset_user(monkeypatch):
+    ''' a registered user, with reset emails not sent anywhere '''
+    monkeypatch.setattr(auth, 'send_email', lambda to, body: None)
+    clear_v1()
+    auth_register_v1('john@gmail.com', 'password', 'abc', 'def')
+
+def newest_code(email):
+    return data_store.codes_for(email)[-1]['reset_code']
+
+def test_reset_changes_password(reset_user):
+    ''' test the code sent can be used to set a new password '''
+    auth_passwordreset_request_v1('john@gmail.com')
+    auth_passwordreset_reset_v1(newest_code('john@gmail.com'), 'newpassword')
+    
+    auth_login_v1('john@gmail.com', 'newpassword')
+    with pytest.raises(InputError):
+        auth_login_v1('john@gmail.com', 'password')
+
+def test_reused_code(reset_user):
+    ''' test a code can only be used once '''
+    auth_passwordreset_request_v1('john@gmail.com')
+    reset_code = newest_code('john@gmail.com')
+    auth_passwordreset_reset_v1(reset_code, 'newpassword')
+    
+    with pytest.raises(InputError):
+        auth_passwordreset_reset_v1(reset_code, 'otherpassword')
+    auth_login_v1('john@gmail.com', 'newpassword')
+
+def test_expired_code(reset_user):
+    ''' test a code older than config.reset_code_ttl is refused '''
+    auth_passwordreset_request_v1('john@gmail.com')
+    reset_code = newest_code('john@gmail.com')
+    code = data_store.lookup_code(reset_code)
+    code['time_created'] -= config.reset_code_ttl
+    
+    with pytest.raises(InputError):
+        auth_passwordreset_reset_v1(reset_code, 'newpassword')
+    assert data_store.lookup_code(reset_code) is None
+    auth_login_v1('john@gmail.com', 'password')
+
+def test_codes_per_email(reset_user, monkeypatch):
+    ''' test only the newest config.reset_codes_per_email codes are kept '''
+    monkeypatch.setattr(config, 'reset_codes_per_email', 3)
+    codes = []
+    for _ in range(4):
+        auth_passwordreset_request_v1('john@gmail.com')
+        codes.append(newest_code('john@gmail.com'))
+    
+    assert [code['reset_code'] for code in data_store.codes_for('john@gmail.com')] == codes[1:]
+    with pytest.raises(InputError):
+        auth_passwordreset_reset_v1(codes[0], 'newpassword')
+    auth_passwordreset_reset_v1(codes[1], 'newpassword')
+    auth_login_v1('john@gmail.com', 'newpassword')
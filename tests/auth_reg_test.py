@@ -1,6 +1,9 @@
 import pytest
+import threading
+import time
 
-from src.auth import auth_register_v1, create_jwt
+from src import auth
+from src.auth import auth_register_v1
 from src.error import InputError
 from src.other import clear_v1
 from src.data_store import data_store
@@ -60,4 +63,28 @@ def test_correct_handle():
     
     for user in store['users']:
         if user['u_id'] == user2:
-            assert user['handle_str'] == 'abcdef0'   
+            assert user['handle_str'] == 'abcdef0'
+
+# Users registering at the same time each get their own u_id, even when one
+# is given its handle while another is being added
+def test_reg_concurrent(monkeypatch):
+    clear_v1()
+    # Hashed straight away so the registrations all reach the store together
+    monkeypatch.setattr(auth, 'hash_password', lambda password: password)
+    next_handle = data_store.next_handle
+    def slow_next_handle(base):
+        time.sleep(0.05)
+        return next_handle(base)
+    monkeypatch.setattr(data_store, 'next_handle', slow_next_handle)
+
+    results = []
+    def register(number):
+        results.append(auth_register_v1(f'user{number}@email.com', 'password', 'abc', 'def'))
+    threads = [threading.Thread(target=register, args=(number,)) for number in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(result['auth_user_id'] for result in results) == [1, 2, 3, 4, 5]
+    assert sorted(user['u_id'] for user in data_store.get()['users']) == [1, 2, 3, 4, 5]
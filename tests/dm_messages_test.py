@@ -247,3 +247,63 @@ def test_start_not_zero(clear_data):
     response_data = response.json()
 
     assert response_data['end'] == 54
+
+# Paging back from a cursor still lines up after a message is removed
+def test_before_message_id(clear_data, dm_create_single):
+    token = requests.post(BASE_URL + 'auth/login/v2', json = {
+        'email': 'new@gmail.com', 'password': 'password'
+    }).json()['token']
+
+    message_ids = []
+    for i in range(60):
+        message_ids.append(requests.post(BASE_URL + 'message/senddm/v1', json = {
+            'token': token,
+            'dm_id': 1,
+            'message': f"hi {i}"
+        }).json()['message_id'])
+
+    response_data = requests.get(BASE_URL + 'dm/messages/v1', params = {
+        'token': token,
+        'dm_id': 1,
+        'before_message_id': message_ids[55]
+    }).json()
+
+    assert [message['message'] for message in response_data['messages']] == [f"hi {i}" for i in range(54, 4, -1)]
+    assert response_data['before_message_id'] == message_ids[5]
+
+    requests.delete(BASE_URL + 'message/remove/v1', json = {
+        'token': token,
+        'message_id': message_ids[1]
+    })
+
+    response_data = requests.get(BASE_URL + 'dm/messages/v1', params = {
+        'token': token,
+        'dm_id': 1,
+        'before_message_id': response_data['before_message_id']
+    }).json()
+
+    assert [message['message'] for message in response_data['messages']] == ["hi 4", "hi 3", "hi 2", "hi 0"]
+    assert response_data['before_message_id'] == -1
+
+    response_data = requests.get(BASE_URL + 'dm/messages/v1', params = {
+        'token': token,
+        'dm_id': 1,
+        'after_message_id': message_ids[57]
+    }).json()
+
+    assert [message['message'] for message in response_data['messages']] == ["hi 59", "hi 58"]
+    assert response_data['after_message_id'] == message_ids[59]
+
+# Raises an InputError when the cursor is not a message in the DM
+def test_invalid_cursor(clear_data, dm_create_single):
+    token = requests.post(BASE_URL + 'auth/login/v2', json = {
+        'email': 'new@gmail.com', 'password': 'password'
+    }).json()['token']
+
+    response = requests.get(BASE_URL + 'dm/messages/v1', params = {
+        'token': token,
+        'dm_id': 1,
+        'after_message_id': 12345
+    })
+
+    assert response.status_code == InputError.code
@@ -104,3 +104,29 @@ def test_owner_remove_dm(clear_data):
     response_data = response.json()
     
     assert response_data['dms'] == []
+
+# A dm made after the newest one was removed gets an id of its own, rather
+# than the removed dm's
+def test_remove_newest_dm_id_not_reused(clear_data):
+    requests.post(BASE_URL + 'auth/register/v2', json = {
+        'email': 'email@gmail.com', 'password': 'password', 
+        'name_first': 'Eugene', 'name_last': 'Gush'
+    })
+    response = requests.post(BASE_URL + 'auth/register/v2', json = {
+        'email': 'new@gmail.com', 'password': 'password', 
+        'name_first': 'John', 'name_last': 'Smith'
+    })
+    token = response.json()['token']
+    
+    dm_ids = [
+        requests.post(BASE_URL + 'dm/create/v1', json = {'token': token, 'u_ids': [1]}).json()['dm_id']
+        for _ in range(2)
+    ]
+    requests.delete(BASE_URL + 'dm/remove/v1', json = {'token': token, 'dm_id': dm_ids[1]})
+    
+    response = requests.post(BASE_URL + 'dm/create/v1', json = {'token': token, 'u_ids': [1]})
+    new_dm_id = response.json()['dm_id']
+    assert new_dm_id not in dm_ids
+    
+    response = requests.get(BASE_URL + 'dm/list/v1', params = {'token': token})
+    assert sorted(dm['dm_id'] for dm in response.json()['dms']) == [dm_ids[0], new_dm_id]
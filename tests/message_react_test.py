@@ -340,3 +340,48 @@ def test_react_login_dm(clear_data):
     })  
     assert message_react.status_code == 400
     
+
+def test_reacted_shown_per_user_channel(clear_data):
+    get_token = dummy_user_channels()
+    user2 = new_user("user1@email.com", "password", "abc", "def").json()
+    
+    requests.post(BASE_URL + 'channel/join/v2', json = {
+        'token': user2['token'],
+        'channel_id': 1
+    })
+    
+    requests.post(BASE_URL + 'message/react/v1', json = {
+        'token': get_token,
+        'message_id': 1,
+        'react_id': 1
+    })
+    
+    # Only the user who reacted sees the react as theirs
+    messages1 = requests.get(BASE_URL + 'channel/messages/v2', params = {
+        'token': get_token, 'channel_id': 1, 'start': 0
+    }).json()['messages']
+    messages2 = requests.get(BASE_URL + 'channel/messages/v2', params = {
+        'token': user2['token'], 'channel_id': 1, 'start': 0
+    }).json()['messages']
+    
+    assert messages1[0]['reacts'] == [{'react_id': 1, 'u_ids': [1], 'is_this_user_reacted': True}]
+    assert messages2[0]['reacts'] == [{'react_id': 1, 'u_ids': [1], 'is_this_user_reacted': False}]
+
+def test_reacted_shown_per_user_dm_and_search(clear_data):
+    member, owner = dummy_user_dms()
+    
+    requests.post(BASE_URL + 'message/react/v1', json = {
+        'token': member['token'],
+        'message_id': 2,
+        'react_id': 1
+    })
+    
+    dm_messages = requests.get(BASE_URL + 'dm/messages/v1', params = {
+        'token': owner['token'], 'dm_id': 1, 'start': 0
+    }).json()['messages']
+    found = requests.get(BASE_URL + 'search/v1', params = {
+        'token': member['token'], 'query_str': 'hey'
+    }).json()['messages']
+    
+    assert dm_messages[0]['reacts'][0]['is_this_user_reacted'] == False
+    assert found[0]['reacts'][0]['is_this_user_reacted'] == True
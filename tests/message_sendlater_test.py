@@ -7,6 +7,7 @@ from flask_cors import CORS
 from src import config
 from src.error import InputError
 from datetime import datetime
+from time import sleep
 
 BASE_URL = config.url
 
@@ -35,13 +36,26 @@ def test_sendlater_working(clear_data):
     })
     channel_make_response = channel_make.json()
 
-    requests.post(BASE_URL + 'message/sendlater/v1', json = {
+    time_sent = int(datetime.now().timestamp() + 2)
+    message_send = requests.post(BASE_URL + 'message/sendlater/v1', json = {
         'token': user_1_data['token'],
         'channel_id': channel_make_response['channel_id'],
         'message': 'hello',
-        'time_sent': int(datetime.now().timestamp() + 10)
+        'time_sent': time_sent
+    })
+    message_id = message_send.json()['message_id']
+
+    # The request returns straight away, before the message is sent
+    channel_messages = requests.get(BASE_URL + 'channel/messages/v2', params = {
+        'token': user_1_data['token'],
+        'channel_id': channel_make_response['channel_id'],
+        'start': 0
     })
 
+    assert channel_messages.json()['messages'] == []
+
+    sleep(time_sent - datetime.now().timestamp() + 1)
+
     channel_messages = requests.get(BASE_URL + 'channel/messages/v2', params = {
         'token': user_1_data['token'],
         'channel_id': channel_make_response['channel_id'],
@@ -50,7 +64,9 @@ def test_sendlater_working(clear_data):
 
     response = channel_messages.json()
 
-    assert int(response['messages'][0]['time_created']) == int(datetime.now().timestamp())
+    assert response['messages'][0]['message_id'] == message_id
+    assert response['messages'][0]['message'] == 'hello'
+    assert int(response['messages'][0]['time_created']) == time_sent
 
 # channel_id does not refer to a valid channel
 def test_invalid_channel_id(clear_data):
@@ -166,3 +182,94 @@ def test_user_not_channel_member(clear_data):
     })
 
     assert message_send.status_code == AccessError.code
+
+# Messages scheduled before a clear are never sent, even though the new
+# channel and message have the same ids
+def test_sendlater_after_clear(clear_data):
+    def setup():
+        token = requests.post(BASE_URL + 'auth/register/v2', json = {
+            'email': 'john@gmail.com',
+            'password': 'password2',
+            'name_first' : 'John',
+            'name_last' : 'Smith',
+        }).json()['token']
+        channel_id = requests.post(BASE_URL + 'channels/create/v2', json = {
+            'token': token,
+            'name': 'General',
+            'is_public': True
+        }).json()['channel_id']
+        return token, channel_id
+
+    def messages(token, channel_id):
+        return requests.get(BASE_URL + 'channel/messages/v2', params = {
+            'token': token,
+            'channel_id': channel_id,
+            'start': 0
+        }).json()['messages']
+
+    token, channel_id = setup()
+    start = datetime.now().timestamp()
+    requests.post(BASE_URL + 'message/sendlater/v1', json = {
+        'token': token,
+        'channel_id': channel_id,
+        'message': 'before the clear',
+        'time_sent': int(start + 2)
+    })
+
+    requests.delete(BASE_URL + 'clear/v1')
+    token, channel_id = setup()
+    time_sent = int(start + 4)
+    message_id = requests.post(BASE_URL + 'message/sendlater/v1', json = {
+        'token': token,
+        'channel_id': channel_id,
+        'message': 'after the clear',
+        'time_sent': time_sent
+    }).json()['message_id']
+
+    sleep(max(0, start + 3 - datetime.now().timestamp()))
+    assert messages(token, channel_id) == []
+
+    sleep(time_sent - datetime.now().timestamp() + 1)
+    response = messages(token, channel_id)
+    assert [message['message_id'] for message in response] == [message_id]
+    assert response[0]['message'] == 'after the clear'
+    assert int(response[0]['time_created']) == time_sent
+
+# time_sent given as a string is sent like any other, and doesn't stop the
+# messages scheduled after it from being sent
+def test_sendlater_time_sent_string(clear_data):
+    token = requests.post(BASE_URL + 'auth/register/v2', json = {
+        'email': 'john@gmail.com',
+        'password': 'password2',
+        'name_first' : 'John',
+        'name_last' : 'Smith',
+    }).json()['token']
+    channel_id = requests.post(BASE_URL + 'channels/create/v2', json = {
+        'token': token,
+        'name': 'General',
+        'is_public': True
+    }).json()['channel_id']
+
+    def send_later(message, time_sent):
+        response = requests.post(BASE_URL + 'message/sendlater/v1', json = {
+            'token': token,
+            'channel_id': channel_id,
+            'message': message,
+            'time_sent': time_sent
+        })
+        assert response.status_code == SUCCESS
+        return response.json()['message_id']
+
+    send_later('far off', '9999999999')
+    time_sent = int(datetime.now().timestamp() + 2)
+    first_id = send_later('as a string', str(time_sent))
+    second_id = send_later('as a number', time_sent)
+
+    sleep(time_sent - datetime.now().timestamp() + 1)
+    response = requests.get(BASE_URL + 'channel/messages/v2', params = {
+        'token': token,
+        'channel_id': channel_id,
+        'start': 0
+    }).json()['messages']
+    assert sorted(message['message_id'] for message in response) == sorted([first_id, second_id])
+    assert [message['time_created'] for message in response] == [time_sent, time_sent]
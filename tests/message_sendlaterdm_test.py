@@ -8,6 +8,7 @@ from src import config
 from src.error import InputError
 from datetime import datetime
 from datetime import timezone
+from time import sleep
 
 BASE_URL = config.url
 
@@ -35,12 +36,25 @@ def test_sendlaterdm_working(clear_data):
     })
     dm_make_response = dm_make.json()
     
-    requests.post(BASE_URL + 'message/sendlaterdm/v1', json = {
+    time_sent = int(datetime.now().timestamp() + 2)
+    message_send = requests.post(BASE_URL + 'message/sendlaterdm/v1', json = {
         'token': user_1_data['token'],
         'dm_id': dm_make_response['dm_id'],
         'message': 'hello',
-        'time_sent': int(datetime.now().timestamp() + 10)
+        'time_sent': time_sent
     })
+    message_id = message_send.json()['message_id']
+
+    # The request returns straight away, before the message is sent
+    dm_messages = requests.get(BASE_URL + 'dm/messages/v1', params = {
+        'token': user_1_data['token'],
+        'dm_id': dm_make_response['dm_id'],
+        'start': 0
+    })
+
+    assert dm_messages.json()['messages'] == []
+
+    sleep(time_sent - datetime.now().timestamp() + 1)
 
     dm_messages = requests.get(BASE_URL + 'dm/messages/v1', params = {
         'token': user_1_data['token'],
@@ -50,7 +64,9 @@ def test_sendlaterdm_working(clear_data):
 
     response = dm_messages.json()
 
-    assert int(response['messages'][0]['time_created']) == int(datetime.now().timestamp())
+    assert response['messages'][0]['message_id'] == message_id
+    assert response['messages'][0]['message'] == 'hello'
+    assert int(response['messages'][0]['time_created']) == time_sent
 
 # dm_id does not refer to a valid DM
 def test_invalid_dm(clear_data):
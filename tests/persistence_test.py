@@ -0,0 +1,372 @@
+import json
+import os
+import shutil
+import pytest
+
+from src import config
+from src import other
+from src import persistence
+from src import snapshot_format
+from src import sqlite_store
+from src.data_store import data_store, initial_object
+from src.auth import auth_register_v1, auth_login_v1, auth_logout_v1
+from src.channels import channels_create_v1
+from src.channel import channel_join_v1, channel_leave_v1
+from src.dm import dm_create_v1
+from src.message import message_senddm_v1, message_react_v1
+from src.messages import message_send_v1, message_edit_v1, message_remove_v1
+from src.user_profile import user_profile_setname_v1
+
+# These run against the functions directly rather than the server, since they
+# have to stop and start the persistence layer
+
+@pytest.fixture
+def storage(tmp_path, monkeypatch):
+    # Save the data store under tmp_path instead of next to the server's files
+    monkeypatch.setattr(config, 'snapshot_file', str(tmp_path / 'data_store.json'))
+    monkeypatch.setattr(config, 'binary_snapshot_file', str(tmp_path / 'data_store.snap'))
+    monkeypatch.setattr(config, 'wal_file', str(tmp_path / 'data_store.wal'))
+    monkeypatch.setattr(persistence, 'PREVIOUS_WAL_FILE', str(tmp_path / 'data_store.wal.1'))
+    monkeypatch.setattr(config, 'sqlite_file', str(tmp_path / 'data_store.db'))
+    monkeypatch.setattr(config, 'shard_dir', str(tmp_path / 'data_store'))
+    monkeypatch.setattr(config, 'snapshot_mode', 'inline')
+    # Hashing isn't what's being tested
+    monkeypatch.setattr(config, 'password_workers', 0)
+    monkeypatch.setattr(config, 'password_kdf', 'pbkdf2_sha256')
+    monkeypatch.setattr(config, 'pbkdf2_iterations', 1)
+    yield tmp_path
+    stop()
+    data_store.set(json.loads(json.dumps(initial_object)))
+
+def stop():
+    # Close everything the server had open, as if its process had gone
+    if persistence.WAL is not None:
+        persistence.WAL.close()
+        persistence.WAL = None
+    if sqlite_store.CONNECTION is not None:
+        sqlite_store.CONNECTION.close()
+        sqlite_store.CONNECTION = None
+    with other.ID_LOCK:
+        other.ID_BLOCKS.clear()
+    other.clear_jwt_cache()
+
+def restart():
+    # Start again from what was saved
+    stop()
+    data_store.set(json.loads(json.dumps(initial_object)))
+    persistence.load()
+    return saved()
+
+def saved():
+    return json.loads(json.dumps(data_store.get()))
+
+def make_changes():
+    # A bit of everything that is saved
+    user1 = auth_register_v1('ann@gmail.com', 'password', 'Ann', 'Lee')
+    user2 = auth_register_v1('bob@gmail.com', 'password', 'Bob', 'Lee')
+    auth_register_v1('cat@gmail.com', 'password', 'Cat', 'Lee')
+
+    channel_id = channels_create_v1(user1['token'], 'general', True)['channel_id']
+    channel_join_v1(user2['token'], channel_id)
+    first = message_send_v1(user1['token'], channel_id, 'hello @boblee')['message_id']
+    second = message_send_v1(user2['token'], channel_id, 'hi')['message_id']
+    message_edit_v1(user1['token'], first, 'hello again @boblee')
+    message_react_v1(user2['token'], first, 1)
+    message_remove_v1(user2['token'], second)
+
+    dm_id = dm_create_v1(user1['token'], [user2['auth_user_id']])['dm_id']
+    message_senddm_v1(user2['token'], dm_id, 'hey @annlee')
+
+    user_profile_setname_v1(user2['token'], 'Robert', 'Lee')
+    channel_leave_v1(user2['token'], channel_id)
+    auth_logout_v1(user2['token'])
+
+ENGINES = [
+    ('wal', 'json'),
+    ('wal', 'binary'),
+    ('sqlite', 'json'),
+    ('sharded', 'json'),
+]
+
+# Everything committed is there after a restart
+@pytest.mark.parametrize('storage_engine, snapshot_format', ENGINES)
+def test_restart_round_trip(storage, monkeypatch, storage_engine, snapshot_format):
+    monkeypatch.setattr(config, 'storage_engine', storage_engine)
+    monkeypatch.setattr(config, 'snapshot_format', snapshot_format)
+    restart()
+
+    make_changes()
+    persistence.commit()
+    before = saved()
+
+    assert before['users'] != []
+    assert restart() == before
+
+# Changes made after a restart are saved on top of what was loaded, and the
+# log is replayed over a snapshot
+@pytest.mark.parametrize('storage_engine, snapshot_format', ENGINES)
+def test_restart_twice(storage, monkeypatch, storage_engine, snapshot_format):
+    monkeypatch.setattr(config, 'storage_engine', storage_engine)
+    monkeypatch.setattr(config, 'snapshot_format', snapshot_format)
+    restart()
+
+    make_changes()
+    persistence.commit()
+    restart()
+
+    token = auth_register_v1('dan@gmail.com', 'password', 'Dan', 'Lee')['token']
+    channel_id = channels_create_v1(token, 'random', False)['channel_id']
+    message_send_v1(token, channel_id, 'after the restart')
+    persistence.commit()
+    before = saved()
+
+    assert restart() == before
+
+# Nothing is lost when the store is cleared and filled again between commits
+@pytest.mark.parametrize('storage_engine, snapshot_format', ENGINES)
+def test_restart_after_clear(storage, monkeypatch, storage_engine, snapshot_format):
+    monkeypatch.setattr(config, 'storage_engine', storage_engine)
+    monkeypatch.setattr(config, 'snapshot_format', snapshot_format)
+    restart()
+
+    make_changes()
+    persistence.commit()
+    other.clear_v1()
+    token = auth_register_v1('dan@gmail.com', 'password', 'Dan', 'Lee')['token']
+    channels_create_v1(token, 'random', True)
+    persistence.commit()
+    before = saved()
+
+    assert len(before['users']) == 1
+    assert restart() == before
+
+# Saving the workspace stats only inserts the entries added since they were
+# last saved
+def test_sqlite_history_append_only(storage, monkeypatch):
+    monkeypatch.setattr(config, 'storage_engine', 'sqlite')
+    restart()
+
+    make_changes()
+    persistence.commit()
+
+    statements = []
+    db = sqlite_store.connect()
+    db.set_trace_callback(statements.append)
+    token = auth_register_v1('dan@gmail.com', 'password', 'Dan', 'Lee')['token']
+    channels_create_v1(token, 'random', True)
+    persistence.commit()
+    db.set_trace_callback(None)
+
+    assert 'DELETE FROM stats' not in statements
+    stats = data_store.get()['stats'][0]
+    inserted = [
+        statement for statement in statements
+        if statement.startswith('INSERT INTO history') and "'stats'" in statement
+    ]
+    assert len(inserted) == 1
+    rows = db.execute(
+        "SELECT COUNT(*) FROM history WHERE kind = 'stats' AND field = 'channels_exist'"
+    ).fetchone()[0]
+    assert rows == len(stats['channels_exist'])
+
+    before = saved()
+    assert restart() == before
+
+# Databases saved with the histories inside users and stats are moved over
+# to the history table when they are opened
+def test_sqlite_history_upgrade(storage, monkeypatch):
+    monkeypatch.setattr(config, 'storage_engine', 'sqlite')
+    restart()
+
+    make_changes()
+    persistence.commit()
+    before = saved()
+
+    db = sqlite_store.connect()
+    with db:
+        for user in before['users']:
+            data = {field: user[field] for field in user if field != 'session_id'}
+            db.execute('UPDATE users SET data = ? WHERE u_id = ?', (json.dumps(data), user['u_id']))
+        db.execute('UPDATE stats SET data = ? WHERE position = 0', (json.dumps(before['stats'][0]),))
+        db.execute('DELETE FROM history')
+        db.execute('PRAGMA user_version = 0')
+
+    assert restart() == before
+    assert sqlite_store.connect().execute('SELECT COUNT(*) FROM history').fetchone()[0] > 0
+
+# Users and the workspace stats are logged without their histories, and only
+# the entries added since the last commit are logged
+def test_wal_logs_history_entries(storage, monkeypatch):
+    monkeypatch.setattr(config, 'storage_engine', 'wal')
+    monkeypatch.setattr(config, 'snapshot_format', 'json')
+    restart()
+
+    make_changes()
+    persistence.commit()
+    start = persistence.WAL.tell()
+
+    token = auth_login_v1('bob@gmail.com', 'password')['token']
+    dm_id = data_store.get()['dms'][0]['dm_id']
+    message_senddm_v1(token, dm_id, 'hello again @annlee')
+    persistence.commit()
+
+    with open(config.wal_file, 'r') as FILE:
+        FILE.seek(start)
+        records = [json.loads(line) for line in FILE]
+
+    for record in records:
+        if record.get('table') == 'users':
+            assert 'notifications' not in record['value']
+            assert 'messages_sent' not in record['value']['user_stats']
+        if record.get('table') == 'stats':
+            assert 'messages_exist' not in record['value'][0]
+    history = [record['parent'][2:] for record in records if record.get('table') == 'history']
+    assert sorted(history) == [['messages_exist'], ['notifications'], ['user_stats', 'messages_sent']]
+
+    before = saved()
+    assert restart() == before
+
+def fail_once(monkeypatch, module, name):
+    # Make module.name raise the next time it's called, as if the disk were full
+    original = getattr(module, name)
+    def failing(*args):
+        monkeypatch.setattr(module, name, original)
+        raise OSError('No space left on device')
+    monkeypatch.setattr(module, name, failing)
+
+# Changes that couldn't be written are written by the next commit
+@pytest.mark.parametrize('storage_engine, snapshot_format', ENGINES)
+def test_failed_commit_retried(storage, monkeypatch, storage_engine, snapshot_format):
+    monkeypatch.setattr(config, 'storage_engine', storage_engine)
+    monkeypatch.setattr(config, 'snapshot_format', snapshot_format)
+    restart()
+
+    make_changes()
+    persistence.commit()
+
+    token = auth_register_v1('dan@gmail.com', 'password', 'Dan', 'Lee')['token']
+    channel_id = channels_create_v1(token, 'random', True)['channel_id']
+    message_send_v1(token, channel_id, 'saved eventually')
+
+    if storage_engine == 'sqlite':
+        fail_once(monkeypatch, sqlite_store, 'write_records')
+    elif storage_engine == 'sharded':
+        fail_once(monkeypatch, persistence.shard_store, 'write_changes')
+    else:
+        # Half a line makes it into the log before the write fails
+        persistence.WAL.write('{"op": "put", "tab')
+        persistence.WAL.flush()
+        persistence.WAL.close()
+        persistence.WAL = open(config.wal_file, 'r')
+
+    with pytest.raises(Exception):
+        persistence.commit()
+    persistence.commit()
+    before = saved()
+
+    assert restart() == before
+    assert [user['email'] for user in before['users']][-1] == 'dan@gmail.com'
+
+# Sending a message rewrites the conversation, the sender and the small core
+# file, and appends the new history entries
+def test_sharded_send_writes(storage, monkeypatch):
+    monkeypatch.setattr(config, 'storage_engine', 'sharded')
+    restart()
+
+    make_changes()
+    persistence.commit()
+
+    written = []
+    write_json = persistence.shard_store.write_json
+    monkeypatch.setattr(persistence.shard_store, 'write_json',
+        lambda path, value: written.append(os.path.relpath(path, config.shard_dir)) or write_json(path, value))
+    history_file = os.path.join(config.shard_dir, 'history.jsonl')
+    start = os.path.getsize(history_file)
+
+    token = auth_login_v1('ann@gmail.com', 'password')['token']
+    channel_id = data_store.get()['channels'][0]['channel_id']
+    message_send_v1(token, channel_id, 'one more')
+    persistence.commit()
+
+    assert set(written) <= {'core.json', os.path.join('channels', f'{channel_id}.json'), os.path.join('users', '1.json')}
+    with open(os.path.join(config.shard_dir, 'core.json'), 'r') as FILE:
+        core = json.load(FILE)
+    assert 'users' not in core
+    assert 'messages_exist' not in core['stats'][0]
+    with open(history_file, 'r') as FILE:
+        FILE.seek(start)
+        assert len(FILE.readlines()) == 2
+
+    before = saved()
+    assert restart() == before
+
+# Shards saved with the users and their histories in core.json are moved
+# into the new layout when they are loaded
+def test_sharded_upgrade(storage, monkeypatch):
+    monkeypatch.setattr(config, 'storage_engine', 'sharded')
+    restart()
+
+    make_changes()
+    persistence.commit()
+    before = saved()
+
+    with open(os.path.join(config.shard_dir, 'core.json'), 'w') as FILE:
+        json.dump({table: before[table] for table in ('users', 'stats', 'codes', 'counters')}, FILE)
+    shutil.rmtree(os.path.join(config.shard_dir, 'users'))
+    os.remove(os.path.join(config.shard_dir, 'history.jsonl'))
+
+    assert restart() == before
+    assert os.path.exists(os.path.join(config.shard_dir, 'users', '1.json'))
+    assert restart() == before
+
+# A JSON snapshot saved before the counters (with messages newest first) is
+# upgraded as it's converted to the binary format
+def test_convert_old_snapshot(storage, monkeypatch):
+    monkeypatch.setattr(config, 'storage_engine', 'wal')
+    restart()
+
+    make_changes()
+    persistence.commit()
+    before = saved()
+
+    old = json.loads(json.dumps(before))
+    del old['counters']
+    for kind in ('channels', 'dms'):
+        for conversation in old[kind]:
+            conversation['messages'].reverse()
+    source = str(storage / 'old.json')
+    target = str(storage / 'old.snap')
+    with open(source, 'w') as FILE:
+        json.dump(old, FILE)
+
+    snapshot_format.convert('to-binary', source, target)
+    converted = snapshot_format.load_file(target)
+
+    counters = converted.pop('counters')
+    assert converted == {table: before[table] for table in converted}
+    assert counters['schema_version'] == before['counters']['schema_version']
+    assert counters['message_id'] >= max(
+        message['message_id'] for kind in ('channels', 'dms')
+        for conversation in before[kind] for message in conversation['messages']
+    )
+
+# A conversion that fails part way leaves the target as it was
+def test_convert_failed(storage, monkeypatch):
+    source = str(storage / 'data_store.json')
+    target = str(storage / 'data_store.snap')
+    with open(source, 'w') as FILE:
+        json.dump(initial_object, FILE)
+    with open(target, 'w') as FILE:
+        FILE.write('old')
+
+    def write(store, FILE):
+        FILE.write(snapshot_format.MAGIC)
+        raise OSError('No space left on device')
+    monkeypatch.setattr(snapshot_format, 'write', write)
+
+    with pytest.raises(OSError):
+        snapshot_format.convert('to-binary', source, target)
+
+    with open(target, 'r') as FILE:
+        assert FILE.read() == 'old'
+    assert not os.path.exists(target + '.tmp')
@@ -0,0 +1,84 @@
+import pytest
+import requests
+
+from datetime import datetime
+from time import sleep
+
+from src import config
+from src.error import AccessError
+
+BASE_URL = config.url
+
+@pytest.fixture
+def clear_data():
+    requests.delete(BASE_URL + 'clear/v1')
+
+def new_user(email, password, fname, lname):
+    user = requests.post(BASE_URL + 'auth/register/v2', json = {
+        'email' : email,
+        'password' : password,
+        'name_first': fname,
+        'name_last': lname,
+    })
+    return user
+
+def test_metrics(clear_data):
+    user1 = new_user("John@gmail.com", "password", "John", "Smith").json()
+    new_user("Tony@gmail.com", "1password1", "Tony", "Stark")
+    requests.post(BASE_URL + 'auth/login/v2', json = {
+        'email': "John@gmail.com",
+        'password': "password",
+    })
+
+    metrics = requests.get(BASE_URL + 'admin/metrics/v1', params = {'token': user1['token']})
+    assert metrics.status_code == 200
+    metrics = metrics.json()
+    assert metrics['live_sessions'] == 3
+    assert set(metrics['jwt_cache']) == {'hits', 'misses', 'size'}
+    assert set(metrics['mail']) == {'sent', 'retries', 'failed'}
+    assert 'count' in metrics['snapshots']
+
+def test_scheduler_metrics(clear_data):
+    user1 = new_user("John@gmail.com", "password", "John", "Smith").json()
+    channel_id = requests.post(BASE_URL + 'channels/create/v2', json = {
+        'token': user1['token'],
+        'name': 'General',
+        'is_public': True,
+    }).json()['channel_id']
+
+    before = requests.get(BASE_URL + 'admin/metrics/v1', params = {'token': user1['token']}).json()
+    time_sent = int(datetime.now().timestamp() + 1)
+    requests.post(BASE_URL + 'message/sendlater/v1', json = {
+        'token': user1['token'],
+        'channel_id': channel_id,
+        'message': 'hello',
+        'time_sent': time_sent,
+    })
+
+    metrics = requests.get(BASE_URL + 'admin/metrics/v1', params = {'token': user1['token']}).json()
+    assert metrics['scheduler']['depth'] == before['scheduler']['depth'] + 1
+
+    sleep(time_sent - datetime.now().timestamp() + 1)
+    metrics = requests.get(BASE_URL + 'admin/metrics/v1', params = {'token': user1['token']}).json()
+    assert metrics['scheduler']['depth'] == before['scheduler']['depth']
+    assert metrics['scheduler']['dispatched'] == before['scheduler']['dispatched'] + 1
+    assert metrics['scheduler']['failed'] == before['scheduler']['failed']
+
+def test_live_sessions_logout(clear_data):
+    user1 = new_user("John@gmail.com", "password", "John", "Smith").json()
+    user2 = new_user("Tony@gmail.com", "1password1", "Tony", "Stark").json()
+    requests.post(BASE_URL + 'auth/logout/v1', json = {'token': user2['token']})
+
+    metrics = requests.get(BASE_URL + 'admin/metrics/v1', params = {'token': user1['token']}).json()
+    assert metrics['live_sessions'] == 1
+
+def test_metrics_not_global_owner(clear_data):
+    new_user("John@gmail.com", "password", "John", "Smith")
+    user2 = new_user("Tony@gmail.com", "1password1", "Tony", "Stark").json()
+
+    metrics = requests.get(BASE_URL + 'admin/metrics/v1', params = {'token': user2['token']})
+    assert metrics.status_code == AccessError.code
+
+def test_metrics_invalid_token(clear_data):
+    metrics = requests.get(BASE_URL + 'admin/metrics/v1', params = {'token': 'invalid'})
+    assert metrics.status_code == AccessError.code
@@ -243,3 +243,124 @@ def test_start_not_zero(clear_data):
     assert response_data['end'] == 54
         
     
+
+# Paging back from a cursor isn't shifted by messages sent in between
+def test_before_message_id(clear_data):
+    user1_data = requests.post(BASE_URL + 'auth/register/v2', json = {
+        'email': 'john@gmail.com', 'password': 'password2',
+        'name_first' : 'John', 'name_last' : 'Smith',
+    }).json()
+    
+    channel_data = requests.post(BASE_URL + 'channels/create/v2', json = {
+        'token': user1_data['token'],
+        'name': 'General',
+        'is_public': True
+    }).json()
+    
+    message_ids = []
+    for i in range(120):
+        message_ids.append(requests.post(BASE_URL + 'message/send/v1', json = {
+            'token': user1_data['token'],
+            'channel_id': channel_data['channel_id'],
+            'message': f'hello {i}'
+        }).json()['message_id'])
+    
+    response_data = requests.get(BASE_URL + 'channel/messages/v2', params = {
+        'token': user1_data['token'],
+        'channel_id': channel_data['channel_id'],
+        'before_message_id': message_ids[100]
+    }).json()
+    
+    assert [message['message'] for message in response_data['messages']] == [f'hello {i}' for i in range(99, 49, -1)]
+    assert response_data['before_message_id'] == message_ids[50]
+    
+    requests.post(BASE_URL + 'message/send/v1', json = {
+        'token': user1_data['token'],
+        'channel_id': channel_data['channel_id'],
+        'message': 'new'
+    })
+    
+    response_data = requests.get(BASE_URL + 'channel/messages/v2', params = {
+        'token': user1_data['token'],
+        'channel_id': channel_data['channel_id'],
+        'before_message_id': response_data['before_message_id']
+    }).json()
+    
+    assert [message['message'] for message in response_data['messages']] == [f'hello {i}' for i in range(49, -1, -1)]
+    assert response_data['before_message_id'] == -1
+
+def test_after_message_id(clear_data):
+    user1_data = requests.post(BASE_URL + 'auth/register/v2', json = {
+        'email': 'john@gmail.com', 'password': 'password2',
+        'name_first' : 'John', 'name_last' : 'Smith',
+    }).json()
+    
+    channel_data = requests.post(BASE_URL + 'channels/create/v2', json = {
+        'token': user1_data['token'],
+        'name': 'General',
+        'is_public': True
+    }).json()
+    
+    message_ids = []
+    for i in range(3):
+        message_ids.append(requests.post(BASE_URL + 'message/send/v1', json = {
+            'token': user1_data['token'],
+            'channel_id': channel_data['channel_id'],
+            'message': f'hello {i}'
+        }).json()['message_id'])
+    
+    response_data = requests.get(BASE_URL + 'channel/messages/v2', params = {
+        'token': user1_data['token'],
+        'channel_id': channel_data['channel_id'],
+        'after_message_id': message_ids[0]
+    }).json()
+    
+    assert [message['message'] for message in response_data['messages']] == ['hello 2', 'hello 1']
+    assert response_data['after_message_id'] == message_ids[2]
+    
+    # Nothing newer yet, the same cursor comes back to poll with
+    response_data = requests.get(BASE_URL + 'channel/messages/v2', params = {
+        'token': user1_data['token'],
+        'channel_id': channel_data['channel_id'],
+        'after_message_id': message_ids[2]
+    }).json()
+    
+    assert response_data == {'messages': [], 'after_message_id': message_ids[2]}
+
+def test_cursor_not_in_channel(clear_data):
+    user1_data = requests.post(BASE_URL + 'auth/register/v2', json = {
+        'email': 'john@gmail.com', 'password': 'password2',
+        'name_first' : 'John', 'name_last' : 'Smith',
+    }).json()
+    
+    channel_1 = requests.post(BASE_URL + 'channels/create/v2', json = {
+        'token': user1_data['token'],
+        'name': 'General',
+        'is_public': True
+    }).json()
+    channel_2 = requests.post(BASE_URL + 'channels/create/v2', json = {
+        'token': user1_data['token'],
+        'name': 'Random',
+        'is_public': True
+    }).json()
+    
+    message_id = requests.post(BASE_URL + 'message/send/v1', json = {
+        'token': user1_data['token'],
+        'channel_id': channel_1['channel_id'],
+        'message': 'hello'
+    }).json()['message_id']
+    
+    response = requests.get(BASE_URL + 'channel/messages/v2', params = {
+        'token': user1_data['token'],
+        'channel_id': channel_2['channel_id'],
+        'before_message_id': message_id
+    })
+    assert response.status_code == InputError.code
+    
+    response = requests.get(BASE_URL + 'channel/messages/v2', params = {
+        'token': user1_data['token'],
+        'channel_id': channel_1['channel_id'],
+        'before_message_id': message_id,
+        'after_message_id': message_id
+    })
+    assert response.status_code == InputError.code
@@ -109,6 +109,42 @@ def test_standup_active(clear_data):
     assert response_data['is_active'] == True
     assert response_data['time_finish'] == timestamp_data['time_finish']
 
+# A short standup lasts its whole length, not just to the whole second before
+# it ends
+def test_short_standup_active(clear_data):
+    user1 = requests.post(BASE_URL + 'auth/register/v2', json = {
+        'email': 'joebrown@gmail.com', 'password': 'password', 
+        'name_first': 'Joe', 'name_last': 'Brown'
+    })
+    user1_data = user1.json()
+
+    requests.post(BASE_URL + 'channels/create/v2', json = {
+        'token': user1_data['token'], 'name': 'abc', 
+        'is_public': 'True'
+    })
+    
+    # Start late in a second, when rounding down would end it soonest
+    time.sleep((0.8 - time.time() % 1) % 1)
+    requests.post(BASE_URL + 'standup/start/v1', json = {
+        'token': user1_data['token'], 
+        'channel_id': 1,
+        'length': 1
+    })
+    time.sleep(0.4)
+    
+    response = requests.get(BASE_URL + 'standup/active/v1', params = {
+        'token': user1_data['token'], 
+        'channel_id': 1
+    })
+    assert response.json()['is_active'] == True
+    
+    time.sleep(1)
+    response = requests.get(BASE_URL + 'standup/active/v1', params = {
+        'token': user1_data['token'], 
+        'channel_id': 1
+    })
+    assert response.json()['is_active'] == False
+
 # When standup is inactive
 def test_standup_inactive(clear_data):
     user1 = requests.post(BASE_URL + 'auth/register/v2', json = {
@@ -238,3 +238,186 @@ def test_standup_send_successful_multiple_users(clear_data):
     response_data = response.json()
     
     assert response_data['messages'][0]['message'] == "johnsmith: hi\njoebrown: hey"
+
+# Raises an InputError once the standup's buffer is full
+def test_standup_send_buffer_full(clear_data):
+    user1 = requests.post(BASE_URL + 'auth/register/v2', json = {
+        'email': 'joebrown@gmail.com', 'password': 'password', 
+        'name_first': 'Joe', 'name_last': 'Brown'
+    })
+    user1_data = user1.json()
+
+    requests.post(BASE_URL + 'channels/create/v2', json = {
+        'token': user1_data['token'], 'name': 'abc', 
+        'is_public': 'True'
+    })
+    
+    requests.post(BASE_URL + 'standup/start/v1', json = {
+        'token': user1_data['token'], 
+        'channel_id': 1,
+        'length': 30
+    })
+    
+    # Each message takes "joebrown: " and the message, plus a newline
+    message = "a" * 1000
+    fits = config.standup_buffer_bytes // len(f"joebrown: {message}\n")
+    for _ in range(fits):
+        response = requests.post(BASE_URL + 'standup/send/v1', json = {
+            'token': user1_data['token'], 
+            'channel_id': 1,
+            'message': message
+        })
+        assert response.status_code == 200
+    
+    response = requests.post(BASE_URL + 'standup/send/v1', json = {
+        'token': user1_data['token'], 
+        'channel_id': 1,
+        'message': message
+    })
+    
+    assert response.status_code == InputError.code
+
+# The packaged message is split into messages of at most 1000 characters
+def test_standup_long_package_split(clear_data):
+    user1 = requests.post(BASE_URL + 'auth/register/v2', json = {
+        'email': 'joebrown@gmail.com', 'password': 'password', 
+        'name_first': 'Joe', 'name_last': 'Brown'
+    })
+    user1_data = user1.json()
+
+    requests.post(BASE_URL + 'channels/create/v2', json = {
+        'token': user1_data['token'], 'name': 'abc', 
+        'is_public': 'True'
+    })
+    
+    requests.post(BASE_URL + 'standup/start/v1', json = {
+        'token': user1_data['token'], 
+        'channel_id': 1,
+        'length': 2
+    })
+    
+    sent = ["a" * 600, "b" * 600, "c" * 1000, "hi"]
+    for message in sent:
+        requests.post(BASE_URL + 'standup/send/v1', json = {
+            'token': user1_data['token'], 
+            'channel_id': 1,
+            'message': message
+        })
+    
+    time.sleep(3)
+    
+    response = requests.get(BASE_URL + 'channel/messages/v2', params = {
+        'token': user1_data['token'], 
+        'channel_id': 1,
+        'start': 0
+    })
+    messages = [message['message'] for message in response.json()['messages']][::-1]
+    
+    assert all(len(message) <= 1000 for message in messages)
+    assert messages[:2] == ["joebrown: " + "a" * 600, "joebrown: " + "b" * 600]
+    assert "".join(messages[2:]).replace("\n", "") == "joebrown: " + "c" * 1000 + "joebrown: hi"
+
+# The packaged message is sent by an owner still in the channel if the user
+# who started the standup has left
+def test_standup_starter_left(clear_data):
+    user1 = requests.post(BASE_URL + 'auth/register/v2', json = {
+        'email': 'joebrown@gmail.com', 'password': 'password', 
+        'name_first': 'Joe', 'name_last': 'Brown'
+    })
+    user1_data = user1.json()
+    
+    user2 = requests.post(BASE_URL + 'auth/register/v2', json = {
+        'email': 'joewsmith@gmail.com', 'password': 'password', 
+        'name_first': 'John', 'name_last': 'Smith'
+    })
+    user2_data = user2.json()
+
+    requests.post(BASE_URL + 'channels/create/v2', json = {
+        'token': user1_data['token'], 'name': 'abc', 
+        'is_public': 'True'
+    })
+    
+    requests.post(BASE_URL + 'channel/join/v2', json = {
+        'token': user2_data['token'],
+        'channel_id': 1
+    })
+    
+    requests.post(BASE_URL + 'standup/start/v1', json = {
+        'token': user2_data['token'], 
+        'channel_id': 1,
+        'length': 2
+    })
+    
+    requests.post(BASE_URL + 'standup/send/v1', json = {
+        'token': user2_data['token'], 
+        'channel_id': 1,
+        'message': "bye"
+    })
+    
+    requests.post(BASE_URL + 'channel/leave/v1', json = {
+        'token': user2_data['token'],
+        'channel_id': 1
+    })
+    
+    time.sleep(3)
+    
+    response = requests.get(BASE_URL + 'channel/messages/v2', params = {
+        'token': user1_data['token'], 
+        'channel_id': 1,
+        'start': 0
+    })
+    response_data = response.json()
+    
+    assert response_data['messages'][0]['message'] == "johnsmith: bye"
+    assert response_data['messages'][0]['u_id'] == user1_data['auth_user_id']
+
+# The packaged message is dropped if no owner is left in the channel
+def test_standup_no_owner_left(clear_data):
+    user1 = requests.post(BASE_URL + 'auth/register/v2', json = {
+        'email': 'joebrown@gmail.com', 'password': 'password', 
+        'name_first': 'Joe', 'name_last': 'Brown'
+    })
+    user1_data = user1.json()
+    
+    user2 = requests.post(BASE_URL + 'auth/register/v2', json = {
+        'email': 'joewsmith@gmail.com', 'password': 'password', 
+        'name_first': 'John', 'name_last': 'Smith'
+    })
+    user2_data = user2.json()
+
+    requests.post(BASE_URL + 'channels/create/v2', json = {
+        'token': user1_data['token'], 'name': 'abc', 
+        'is_public': 'True'
+    })
+    
+    requests.post(BASE_URL + 'channel/join/v2', json = {
+        'token': user2_data['token'],
+        'channel_id': 1
+    })
+    
+    requests.post(BASE_URL + 'standup/start/v1', json = {
+        'token': user1_data['token'], 
+        'channel_id': 1,
+        'length': 2
+    })
+    
+    requests.post(BASE_URL + 'standup/send/v1', json = {
+        'token': user1_data['token'], 
+        'channel_id': 1,
+        'message': "bye"
+    })
+    
+    requests.post(BASE_URL + 'channel/leave/v1', json = {
+        'token': user1_data['token'],
+        'channel_id': 1
+    })
+    
+    time.sleep(3)
+    
+    response = requests.get(BASE_URL + 'channel/messages/v2', params = {
+        'token': user2_data['token'], 
+        'channel_id': 1,
+        'start': 0
+    })
+    
+    assert response.json()['messages'] == []